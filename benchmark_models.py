@@ -0,0 +1,126 @@
+"""
+Замер памяти и времени декодирования моделей MongoDB
+
+Сравнивает на N синтетических документах:
+- модели со __slots__ и те же модели с __dict__ (как было раньше);
+- полные документы и документы с проекцией нужных полей
+  (BSON-декодирование, которое делает драйвер, и построение объектов).
+
+База не нужна. Запуск: python benchmark_models.py [N]
+"""
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+
+from database.mongo_models import User, Payment
+
+
+def dict_based(model):
+    """Копия модели без __slots__ (экземпляры с __dict__)"""
+    return type(f"Dict{model.__name__}", (), {
+        "__init__": model.__init__,
+        "from_dict": classmethod(model.from_dict.__func__)
+    })
+
+
+def make_users(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "telegram_id": 100000000 + i,
+            "username": f"user_{i}",
+            "first_name": f"Имя {i}",
+            "last_name": f"Фамилия {i}",
+            "created_at": now - timedelta(minutes=i),
+            "last_activity": now,
+            "is_active": True
+        }
+        for i in range(count)
+    ]
+
+
+def make_payments(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": ObjectId(),
+            "amount": 1990.0,
+            "status": "succeeded",
+            "currency": "RUB",
+            "product_type": "course",
+            "course_slug": f"course-{i % 20}",
+            "tariff_id": "basic",
+            "consultation_slug": None,
+            "consultation_option_id": None,
+            "product_id": None,
+            "payment_id": f"2f{i:030d}",
+            "confirmation_url": f"https://yoomoney.ru/checkout/payments/v2/contract?orderId={i}",
+            "is_payment_link": False,
+            "chat_id": 100000000 + i,
+            "message_id": i,
+            "created_at": now,
+            "paid_at": now
+        }
+        for i in range(count)
+    ]
+
+
+def measure(func):
+    """(результат, секунды, пик памяти в МБ)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    for label, elapsed, peak in rows:
+        print(f"  {label:<40} {elapsed * 1000:9.1f} мс  {peak:8.1f} МБ")
+
+
+def bench_models(name, model, docs):
+    legacy = dict_based(model)
+    rows = []
+    for label, cls in ((f"{name} с __dict__", legacy), (f"{name} со __slots__", model)):
+        _, elapsed, peak = measure(lambda: [cls.from_dict(doc) for doc in docs])
+        rows.append((label, elapsed, peak))
+    report(f"Построение моделей из {len(docs)} документов", rows)
+
+
+def bench_projection(name, docs, fields):
+    full = [bson.encode(doc) for doc in docs]
+    projected = [bson.encode({field: doc[field] for field in fields}) for doc in docs]
+
+    rows = []
+    for label, raw in ((f"{name}: весь документ", full), (f"{name}: {', '.join(fields)}", projected)):
+        _, elapsed, peak = measure(lambda: [bson.decode(item) for item in raw])
+        rows.append((label, elapsed, peak))
+    report("BSON-декодирование (работа драйвера)", rows)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    users = make_users(count)
+    payments = make_payments(count)
+
+    bench_models("User", User, users)
+    bench_models("Payment", Payment, payments)
+
+    # Рассылке нужен только telegram_id, проверке доступа - поля покупки
+    bench_projection("users", users, ["telegram_id"])
+    bench_projection("payments", payments, ["product_type", "course_slug", "created_at", "paid_at"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 import asyncio
 import logging
+from typing import Optional, Tuple
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import config
-from database import mongodb
+from database import mongodb, activity_tracker, stats_counters, settings_cache, catalog_versions, create_fsm_storage
+from database.indexes import apply_index_manifest
 from handlers import (
     start_router,
     menu_router,
@@ -24,7 +26,17 @@ from handlers import (
     admin_subscriptions_router
 )
 from handlers.learning_handlers import learning_router
-from middlewares import NavigationMiddleware
+from middlewares import NavigationMiddleware, UserContextMiddleware
+from payments import shutdown_payment_pool
+from web import (
+    create_web_app,
+    start_web_server,
+    stop_web_server,
+    setup_yookassa_webhook,
+    setup_telegram_webhook,
+    set_telegram_webhook,
+    wait_for_stop_signal
+)
 from scheduler.payment_checker import start_payment_checker, stop_payment_checker
 
 
@@ -36,8 +48,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def run_sales_bot():
-    """Функция запуска основного бота (воронка продаж)"""
+async def setup_sales_bot(web_app: web.Application, user_context: UserContextMiddleware):
+    """
+    Создание основного бота (воронка продаж) и его фоновых задач
+
+    Args:
+        web_app: Общее веб-приложение (сюда монтируется вебхук ЮKassa)
+        user_context: Общая для ботов middleware загрузки пользователя
+
+    Returns:
+        (bot, dp, shutdown) - shutdown останавливает фоновые задачи бота
+    """
     logger.info("Initializing sales bot...")
     
     # Создание бота и диспетчера с хранилищем для FSM
@@ -45,9 +66,12 @@ async def run_sales_bot():
         token=config.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    storage = MemoryStorage()
+    storage = await create_fsm_storage()
     dp = Dispatcher(storage=storage)
     
+    # Пользователь загружается один раз на апдейт
+    dp.update.outer_middleware(user_context)
+    
     # Регистрация middleware для навигации
     dp.callback_query.middleware(NavigationMiddleware())
     logger.info("Navigation middleware registered")
@@ -56,19 +80,47 @@ async def run_sales_bot():
     logger.info("Initializing subscription services...")
     from services.subscription_service import SubscriptionService
     from services.subscription_payment_service import SubscriptionPaymentService
-    from payments import YooKassaPayment
-    from handlers import subscription_handlers, admin_subscriptions
+    from services.broadcast_service import BroadcastService
+    from payments import AsyncYooKassaPayment
+    from handlers import subscription_handlers, admin_subscriptions, admin
     
     subscription_service = SubscriptionService(bot)
     payment_service = SubscriptionPaymentService()
-    yookassa_payment = YooKassaPayment()
+    yookassa_payment = AsyncYooKassaPayment()
+    broadcast_service = BroadcastService(
+        bot,
+        rate=config.BROADCAST_RATE,
+        concurrency=config.BROADCAST_CONCURRENCY,
+        progress_interval=config.BROADCAST_PROGRESS_INTERVAL
+    )
     
     # Инициализируем сервисы в обработчиках
     subscription_handlers.init_services(subscription_service, payment_service)
     admin_subscriptions.init_service(subscription_service)
+    admin.init_broadcast_service(broadcast_service)
     
     logger.info("✅ Subscription services initialized")
     
+    # Правки каталога из админки, которые не удалось записать на диск
+    from data import catalog
+    
+    async def notify_catalog_write_failed(filename: str, error: BaseException):
+        for admin_id in config.ADMIN_IDS:
+            try:
+                await bot.send_message(
+                    admin_id,
+                    f"⚠️ <b>Не удалось сохранить {filename}</b>\n\n"
+                    f"Ошибка: {error}\n\n"
+                    f"Изменения пока есть только в памяти бота и пропадут при перезапуске. "
+                    f"Повторите правку после устранения причины."
+                )
+            except Exception as e:
+                logger.error(f"Error notifying admin {admin_id} about catalog write failure: {e}")
+    
+    catalog.add_error_listener(
+        lambda filename, error: asyncio.create_task(notify_catalog_write_failed(filename, error))
+    )
+    
     # Регистрация роутеров
     dp.include_router(start_router)
     dp.include_router(admin_router)
@@ -85,40 +137,59 @@ async def run_sales_bot():
     dp.include_router(payments_router)
     dp.include_router(cabinet_router)
     
+    # Прием уведомлений ЮKassa (если задан WEBHOOK_URL)
+    if config.WEBHOOK_URL:
+        setup_yookassa_webhook(web_app, bot, yookassa_payment, subscription_service)
+        logger.info("✅ Статусы платежей приходят через вебхук ЮKassa")
+    
     # Запуск автоматической проверки платежей
+    # (при работающем вебхуке - только как редкая подстраховка)
     logger.info("Starting payment checker...")
-    payment_checker = await start_payment_checker(bot, check_interval=60)
-    logger.info("✅ Платежи будут автоматически проверяться каждые 60 секунд")
+    if config.WEBHOOK_URL:
+        payment_checker = await start_payment_checker(
+            bot,
+            check_interval=60,
+            min_poll_interval=config.PAYMENT_CHECK_SAFETY_INTERVAL
+        )
+    else:
+        payment_checker = await start_payment_checker(bot)
+    logger.info(f"✅ Платежи будут автоматически проверяться (проход каждые {payment_checker.check_interval} секунд)")
     
     # Запуск планировщика для подписок
     logger.info("Starting subscription scheduler...")
     from scheduler.subscription_tasks import setup_subscription_scheduler
     subscription_scheduler = setup_subscription_scheduler(bot, subscription_service, yookassa_payment)
-    subscription_scheduler.start()
+    await subscription_scheduler.start()
+    await subscription_service.invite_links.start()
     logger.info("✅ Планировщик подписок запущен (с автопродлением)")
     
-    # Запуск основного бота (воронка продаж)
-    logger.info("💼 Sales bot started successfully!")
-    try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
-    finally:
+    # Продолжаем рассылки, прерванные прошлой остановкой (проверка повторяется,
+    # пока heartbeat_at рассылок, прерванных только что, не устареет)
+    await broadcast_service.start_resuming()
+    
+    async def shutdown():
+        # Прерываем рассылки (продолжатся после перезапуска)
+        await broadcast_service.shutdown()
+        
         # Останавливаем проверку платежей
         await stop_payment_checker()
         
-        # Останавливаем планировщик подписок
-        if subscription_scheduler.running:
-            subscription_scheduler.shutdown()
-            logger.info("Subscription scheduler stopped")
+        # Останавливаем планировщик подписок (его обработчики ждут пачек исключений из канала)
+        await subscription_scheduler.stop()
+        await subscription_service.membership.stop()
+        await subscription_service.invite_links.stop()
         
         await bot.session.close()
+    
+    return bot, dp, shutdown
 
 
-async def run_learning_bot():
-    """Функция запуска учебного бота"""
+async def setup_learning_bot(user_context: UserContextMiddleware) -> Optional[Tuple[Bot, Dispatcher]]:
+    """Создание учебного бота (None, если токен не задан)"""
     # Проверяем наличие токена учебного бота
     if not config.LEARNING_BOT_TOKEN:
         logger.error("❌ LEARNING_BOT_TOKEN не указан в .env - учебный бот не будет запущен")
-        return
+        return None
     
     logger.info("Initializing learning bot...")
     
@@ -127,18 +198,75 @@ async def run_learning_bot():
         token=config.LEARNING_BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    learning_storage = MemoryStorage()
+    learning_storage = await create_fsm_storage()
     learning_dp = Dispatcher(storage=learning_storage)
+    learning_dp.update.outer_middleware(user_context)
     
     # Регистрация роутера учебного бота
     learning_dp.include_router(learning_router)
     
-    # Запуск учебного бота
-    logger.info("🎓 Learning bot started successfully!")
+    return learning_bot, learning_dp
+
+
+async def run_bots():
+    """
+    Запуск обоих ботов на одном веб-приложении
+
+    В режиме polling веб-сервер поднимается только для вебхука ЮKassa.
+    В режиме webhook оба бота принимают апдейты через общий aiohttp сервер.
+    """
+    web_app = create_web_app()
+    user_context = UserContextMiddleware(activity_interval=config.USER_ACTIVITY_INTERVAL)
+    
+    sales_bot, sales_dp, shutdown_sales_bot = await setup_sales_bot(web_app, user_context)
+    bots = [("sales", sales_bot, sales_dp)]
+    
+    learning = await setup_learning_bot(user_context)
+    if learning:
+        bots.append(("learning", *learning))
+    
+    web_runner = None
     try:
-        await learning_dp.start_polling(learning_bot, allowed_updates=learning_dp.resolve_used_update_types())
+        if config.BOT_RUN_MODE == 'webhook':
+            # Маршруты регистрируются до запуска сервера
+            for name, bot, dp in bots:
+                setup_telegram_webhook(web_app, name, bot, dp)
+            
+            web_runner = await start_web_server(web_app)
+            
+            for name, bot, dp in bots:
+                await set_telegram_webhook(name, bot, dp)
+            
+            logger.info("🤖 Bots started in webhook mode")
+            await wait_for_stop_signal()
+        else:
+            if config.WEBHOOK_URL:
+                web_runner = await start_web_server(web_app)
+            
+            # getUpdates не работает, пока у бота установлен вебхук
+            for name, bot, dp in bots:
+                await bot.delete_webhook()
+            
+            logger.info("🤖 Bots started in polling mode")
+            await asyncio.gather(*(
+                dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+                for name, bot, dp in bots
+            ))
     finally:
-        await learning_bot.session.close()
+        # Сначала перестаем принимать запросы, затем гасим фоновые задачи.
+        # Вебхуки в Telegram не удаляются: их могут использовать другие реплики,
+        # а апдейты за время простоя Telegram доставит повторно
+        if web_runner:
+            await stop_web_server(web_runner)
+        
+        await shutdown_sales_bot()
+        
+        for name, bot, dp in bots[1:]:
+            await bot.session.close()
+        
+        # Дописываем отложенные изменения FSM, пока база еще подключена
+        for name, bot, dp in bots:
+            await dp.storage.close()
 
 
 async def fix_mongodb_index():
@@ -171,7 +299,7 @@ async def fix_mongodb_index():
             else:
                 logger.info("✓ Индекс payment_id корректный (sparse)")
         else:
-            logger.info("⚠️ Индекс payment_id отсутствует, будет создан автоматически")
+            logger.info("⚠️ Индекс payment_id отсутствует, будет создан после проверки документов")
         
         # Миграция: удаляем payment_id=null из существующих документов
         logger.info("Проверка документов с payment_id=null...")
@@ -188,6 +316,9 @@ async def fix_mongodb_index():
             logger.info(f"✅ Обновлено {result.modified_count} документов (удалено поле payment_id)")
         else:
             logger.info("✓ Нет документов с payment_id=null")
+        
+        # Индекс payment_id мог не создаться при подключении из-за payment_id=null
+        await apply_index_manifest(db)
     
     except Exception as e:
         logger.error(f"❌ Ошибка при исправлении индекса payment_id: {e}")
@@ -205,6 +336,24 @@ async def main():
         logger.info("Проверка и исправление индексов MongoDB...")
         await fix_mongodb_index()
         
+        # Пакетная запись last_activity
+        activity_tracker.start()
+        
+        # Настройки бота в памяти
+        await settings_cache.start()
+        
+        # Снимок каталога (compile_catalog.py) и изменения из других процессов
+        from data import catalog
+        logger.info(f"Catalog snapshot: {catalog.load_snapshot()} files")
+        await catalog_versions.start(catalog)
+        
+        # Счетчики статистики админ-панели (если включены)
+        await stats_counters.seed()
+        
+        # Материалы курсов в MongoDB (первый запуск - импорт из JSON)
+        from data import seed_course_materials
+        await seed_course_materials()
+        
         # Логируем состояние данных
         from data import get_all_courses, get_all_consultations, get_all_guides, get_mini_course
         
@@ -221,11 +370,15 @@ async def main():
         logger.info("=" * 60)
         
         # Запускаем оба бота параллельно
-        await asyncio.gather(
-            run_sales_bot(),
-            run_learning_bot()
-        )
+        await run_bots()
     finally:
+        # Дописать отложенные правки каталога до остановки оповещений
+        from data import catalog
+        catalog.flush()
+        await catalog_versions.stop()
+        await settings_cache.stop()
+        await activity_tracker.stop()
+        shutdown_payment_pool()
         await mongodb.close()
         logger.info("MongoDB connection closed")
 
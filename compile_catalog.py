@@ -0,0 +1,41 @@
+"""
+Сборка снимка каталога (CATALOG_SNAPSHOT_PATH, по умолчанию build/catalog.snapshot)
+
+    python compile_catalog.py
+
+Проверяет схемы JSON-файлов каталога и сохраняет их разобранными вместе
+с индексами. При ошибке схемы снимок не пишется, скрипт завершается с
+кодом 1 (сборка образа останавливается).
+
+Снимок собирается при сборке образа (Dockerfile) в /app/build - эта
+директория не монтируется, поэтому снимок доступен обоим ботам. Файлы,
+измененные в смонтированной data/ после сборки, не совпадут по хэшу и
+будут прочитаны из JSON.
+"""
+import logging
+import sys
+import time
+
+from data import catalog, CatalogSchemaError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def compile_catalog() -> int:
+    """Собрать снимок, вернуть код выхода"""
+    started = time.perf_counter()
+    try:
+        hashes = catalog.compile_snapshot()
+    except CatalogSchemaError as e:
+        logger.error(f"❌ Catalog schema error: {e}")
+        return 1
+
+    for filename, digest in hashes.items():
+        logger.info(f"{filename}: {digest[:12]}")
+    logger.info(f"✅ Catalog snapshot compiled: {len(hashes)} files in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(compile_catalog())
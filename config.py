@@ -1,5 +1,6 @@
 import os
 import logging
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,14 +40,48 @@ class Config:
     # ЮKassa
     YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
     YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
-    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публичный URL вебхука ЮKassa (включает прием уведомлений)
+    YOOKASSA_WEBHOOK_PATH = urlparse(WEBHOOK_URL).path or '/webhook/yookassa'
+    YOOKASSA_WEBHOOK_CHECK_IP = os.getenv('YOOKASSA_WEBHOOK_CHECK_IP', 'true').lower() == 'true'  # Принимать только IP ЮKassa
     RECEIPT_EMAIL = os.getenv('RECEIPT_EMAIL', 'info@example.com')  # Email для чеков (54-ФЗ)
-    
+    YOOKASSA_MAX_WORKERS = int(os.getenv('YOOKASSA_MAX_WORKERS', '8'))  # Потоков для запросов к ЮKassa
+    
+    # Фоновая проверка pending платежей
+    PAYMENT_CHECK_INTERVAL = int(os.getenv('PAYMENT_CHECK_INTERVAL', '5'))  # Секунд между проходами
+    PAYMENT_CHECK_CONCURRENCY = int(os.getenv('PAYMENT_CHECK_CONCURRENCY', '10'))  # Одновременных запросов
+    PAYMENT_CHECK_RPS = float(os.getenv('PAYMENT_CHECK_RPS', '5'))  # Запросов к ЮKassa в секунду
+    # Когда включен вебхук, опрос нужен только как подстраховка
+    PAYMENT_CHECK_SAFETY_INTERVAL = int(os.getenv('PAYMENT_CHECK_SAFETY_INTERVAL', '300'))
+    
+    # Встроенный веб-сервер (вебхуки)
+    WEB_SERVER_HOST = os.getenv('WEB_SERVER_HOST', '0.0.0.0')
+    WEB_SERVER_PORT = int(os.getenv('WEB_SERVER_PORT', '8080'))
+    WEB_TRUST_PROXY = os.getenv('WEB_TRUST_PROXY', 'false').lower() == 'true'  # Брать IP клиента из X-Forwarded-For (только за своим прокси)
+    WEB_TRUSTED_PROXY_HOPS = int(os.getenv('WEB_TRUSTED_PROXY_HOPS', '1'))  # Сколько доверенных прокси дописывают X-Forwarded-For
+
+    # Режим получения апдейтов Telegram: 'polling' (по умолчанию) или 'webhook'
+    BOT_RUN_MODE = os.getenv('BOT_RUN_MODE', 'polling').lower()
+    TELEGRAM_WEBHOOK_BASE_URL = os.getenv('TELEGRAM_WEBHOOK_BASE_URL', '').rstrip('/')  # Например: https://bot.example.com
+    TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', '/webhook/telegram')  # Бот доступен по {PATH}/{sales|learning}
+    TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')  # Пусто - выводится из токена бота
+
     # Telegram канал для платной подписки
     SUBSCRIPTION_CHANNEL_ID = os.getenv('SUBSCRIPTION_CHANNEL_ID', '')  # Например: -1003244100380
     SUBSCRIPTION_PRICE = float(os.getenv('SUBSCRIPTION_PRICE', '990.00'))
     SUBSCRIPTION_DAYS = int(os.getenv('SUBSCRIPTION_DAYS', '30'))
     SUBSCRIPTION_CURRENCY = os.getenv('SUBSCRIPTION_CURRENCY', 'RUB')
+    SUBSCRIPTION_EVENT_CONCURRENCY = int(os.getenv('SUBSCRIPTION_EVENT_CONCURRENCY', '50'))  # Событий подписок одновременно
+    CHANNEL_KICK_RPS = float(os.getenv('CHANNEL_KICK_RPS', '20'))  # Запросов ban/unban к Bot API в секунду
+    CHANNEL_KICK_BATCH_SIZE = int(os.getenv('CHANNEL_KICK_BATCH_SIZE', '100'))  # Истекших подписок в одной пачке
+    INVITE_LINK_POOL_SIZE = int(os.getenv('INVITE_LINK_POOL_SIZE', '50'))  # Запас заранее созданных ссылок (0 - создавать при покупке)
+    INVITE_LINK_POOL_LOW_WATER = int(os.getenv('INVITE_LINK_POOL_LOW_WATER', '10'))  # Пополнять запас, когда ссылок меньше
+    INVITE_LINK_SHELF_LIFE = int(os.getenv('INVITE_LINK_SHELF_LIFE', '21600'))  # Секунд, пока ссылка из запаса может быть выдана
+    
+    # Автопродление подписок
+    RENEWAL_CONCURRENCY = int(os.getenv('RENEWAL_CONCURRENCY', '5'))  # Одновременных запросов к ЮKassa
+    RENEWAL_RPS = float(os.getenv('RENEWAL_RPS', '5'))  # Запросов к ЮKassa в секунду
+    RENEWAL_MAX_ATTEMPTS = int(os.getenv('RENEWAL_MAX_ATTEMPTS', '5'))  # Попыток подряд при временных ошибках
+    RENEWAL_RETRY_INTERVAL = int(os.getenv('RENEWAL_RETRY_INTERVAL', '3600'))  # Секунд до следующего круга попыток
     
     # База данных MongoDB
     @staticmethod
@@ -66,6 +101,34 @@ class Config:
     MONGODB_URL = _get_mongodb_url()
     MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'astro_bot')
     
+    # Хранилище FSM: 'mongo' (переживает перезапуск) или 'memory'
+    FSM_STORAGE = os.getenv('FSM_STORAGE', 'mongo').lower()
+    FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(7 * 24 * 3600)))  # Секунд хранения неизменного состояния
+    FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '5'))  # Секунд свежести кэша в памяти
+    FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0.5'))  # Задержка записи в базу
+    
+    # Не чаще раза в столько секунд last_activity пользователя пишется в базу
+    USER_ACTIVITY_INTERVAL = int(os.getenv('USER_ACTIVITY_INTERVAL', '300'))
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '5'))  # Период пакетной записи активности
+    ENTITLEMENT_CACHE_TTL = float(os.getenv('ENTITLEMENT_CACHE_TTL', '300'))  # Секунд кэша доступов к курсам
+    SETTINGS_POLL_INTERVAL = float(os.getenv('SETTINGS_POLL_INTERVAL', '5'))  # Проверка изменений настроек без change stream
+    CATALOG_POLL_INTERVAL = float(os.getenv('CATALOG_POLL_INTERVAL', '1'))  # Проверка версий каталога без change stream
+    CATALOG_STAT_INTERVAL = float(os.getenv('CATALOG_STAT_INTERVAL', '30'))  # Сверка JSON с диском (ручные правки)
+    CATALOG_WRITE_DELAY = float(os.getenv('CATALOG_WRITE_DELAY', '0.5'))  # Окно объединения правок файла каталога в одну запись
+    CATALOG_SNAPSHOT_PATH = os.getenv(
+        'CATALOG_SNAPSHOT_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'catalog.snapshot')
+    )  # Снимок каталога (вне data/, которую монтирует docker-compose)
+    
+    # Статистика админ-панели
+    STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '30'))  # Секунд кэша статистики
+    STATS_COUNTERS_ENABLED = os.getenv('STATS_COUNTERS_ENABLED', 'false').lower() == 'true'  # Счетчики вместо агрегаций
+    
+    # Рассылки
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # Сообщений в секунду
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))  # Параллельных отправок
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '5'))  # Секунд между сохранениями прогресса
+    
     # Контакты для консультаций
     CONSULTATION_TELEGRAM = 'Katrin_fucco'  # Username без @
     
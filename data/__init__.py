@@ -1,26 +1,152 @@
 """
 Модуль для работы со статичными данными из JSON файлов
 """
-import json
 import os
 from typing import List, Dict, Optional
 
+from config import config
+from database.course_materials import course_materials
+from .catalog import CatalogCache, CatalogSchemaError
+
 # Путь к директории с данными
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Общий для процесса кэш JSON файлов
+catalog = CatalogCache(
+    DATA_DIR,
+    write_delay=config.CATALOG_WRITE_DELAY,
+    snapshot_path=config.CATALOG_SNAPSHOT_PATH
+)
+
 
 def load_json(filename: str) -> dict:
-    """Загрузка данных из JSON файла"""
-    filepath = os.path.join(DATA_DIR, filename)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загрузка данных из JSON файла (через кэш каталога)"""
+    return catalog.get(filename)
 
 
 def save_json(filename: str, data: dict) -> None:
-    """Сохранение данных в JSON файл"""
-    filepath = os.path.join(DATA_DIR, filename)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Сохранение данных в JSON файл (кэш обновляется сразу, файл - атомарно после короткой паузы)"""
+    catalog.put(filename, data)
+
+
+# ==================== Индексы каталога ====================
+# Строятся один раз при загрузке файла, поэтому все поиски ниже - O(1).
+# При дубликатах ключей побеждает первый элемент, как и при линейном поиске.
+
+def _is_active(item: Dict) -> bool:
+    return item.get('is_active', True)
+
+
+def _by_order(items: List[Dict]) -> List[Dict]:
+    return sorted(items, key=lambda item: item.get('order', 0))
+
+
+def _index_courses(data: dict) -> dict:
+    courses = data.get('courses', [])
+    by_slug = {}
+    tariffs = {}
+    for course in courses:
+        by_slug.setdefault(course['slug'], course)
+    for slug, course in by_slug.items():
+        for tariff in course.get('tariffs', []):
+            tariffs.setdefault((slug, tariff['id']), tariff)
+    return {
+        'by_slug': by_slug,
+        'tariffs': tariffs,
+        'active': [c for c in courses if _is_active(c)],
+    }
+
+
+def _index_consultations(data: dict) -> dict:
+    consultations = data.get('consultations', [])
+    by_slug = {}
+    options = {}
+    by_category = {}
+    for consultation in consultations:
+        by_slug.setdefault(consultation['slug'], consultation)
+    for slug, consultation in by_slug.items():
+        for option in consultation.get('options', []):
+            options.setdefault((slug, option['id']), option)
+    active = [c for c in consultations if _is_active(c)]
+    for consultation in active:
+        by_category.setdefault(consultation.get('category'), []).append(consultation)
+    return {
+        'by_slug': by_slug,
+        'options': options,
+        'active': active,
+        'by_category': by_category,
+    }
+
+
+def _index_by_id(key: str):
+    """Построитель индексов для плоских списков с полем id (гайды, отзывы)"""
+    def build(data: dict) -> dict:
+        items = data.get(key, [])
+        by_id = {}
+        for item in items:
+            by_id.setdefault(item['id'], item)
+        active = [item for item in items if _is_active(item)]
+        return {
+            'by_id': by_id,
+            'active': active,
+            'active_sorted': _by_order(active),
+        }
+    return build
+
+
+def _index_mini_course(data: dict) -> dict:
+    tariffs = {}
+    for tariff in (data.get('mini_course') or {}).get('tariffs', []):
+        tariffs.setdefault(tariff['id'], tariff)
+    return {'tariffs': tariffs}
+
+
+# ==================== Схемы каталога ====================
+# Проверяются при сборке снимка (compile_catalog.py): поля, без которых
+# не работают индексы и экраны бота.
+
+def _require(items, fields, where: str) -> None:
+    if not isinstance(items, list):
+        raise CatalogSchemaError(f"{where}: ожидается список")
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise CatalogSchemaError(f"{where}[{i}]: ожидается объект")
+        missing = [field for field in fields if field not in item]
+        if missing:
+            raise CatalogSchemaError(f"{where}[{i}] ({item.get('id', '?')}): нет полей {', '.join(missing)}")
+
+
+def _validate_courses(data: dict) -> None:
+    courses = data.get('courses', [])
+    _require(courses, ('id', 'slug', 'name'), 'courses')
+    for course in courses:
+        _require(course.get('tariffs', []), ('id', 'name', 'price'), f"courses.{course['slug']}.tariffs")
+
+
+def _validate_consultations(data: dict) -> None:
+    consultations = data.get('consultations', [])
+    _require(consultations, ('id', 'slug', 'name'), 'consultations')
+    for consultation in consultations:
+        _require(consultation.get('options', []), ('id', 'name', 'price'), f"consultations.{consultation['slug']}.options")
+
+
+def _validate_list(key: str, fields):
+    """Проверка плоских списков с полем id (гайды, отзывы)"""
+    def validate(data: dict) -> None:
+        _require(data.get(key, []), fields, key)
+    return validate
+
+
+def _validate_mini_course(data: dict) -> None:
+    mini_course = data.get('mini_course') or {}
+    _require(mini_course.get('tariffs', []), ('id', 'name', 'price'), 'mini_course.tariffs')
+
+
+catalog.register_index('courses.json', _index_courses, _validate_courses)
+catalog.register_index('consultations.json', _index_consultations, _validate_consultations)
+catalog.register_index('guides.json', _index_by_id('guides'), _validate_list('guides', ('id', 'name')))
+catalog.register_index('reviews.json', _index_by_id('reviews'), _validate_list('reviews', ('id',)))
+catalog.register_index('mini_course.json', _index_mini_course, _validate_mini_course)
 
 
 def get_all_courses() -> List[Dict]:
@@ -31,29 +157,17 @@ def get_all_courses() -> List[Dict]:
 
 def get_course_by_slug(slug: str) -> Optional[Dict]:
     """Получить курс по slug"""
-    courses = get_all_courses()
-    for course in courses:
-        if course['slug'] == slug:
-            return course
-    return None
+    return catalog.get_index('courses.json')['by_slug'].get(slug)
 
 
 def get_active_courses() -> List[Dict]:
     """Получить активные курсы"""
-    courses = get_all_courses()
-    return [c for c in courses if c.get('is_active', True)]
+    return list(catalog.get_index('courses.json')['active'])
 
 
 def get_tariff_by_id(course_slug: str, tariff_id: str) -> Optional[Dict]:
     """Получить тариф по ID"""
-    course = get_course_by_slug(course_slug)
-    if not course:
-        return None
-    
-    for tariff in course.get('tariffs', []):
-        if tariff['id'] == tariff_id:
-            return tariff
-    return None
+    return catalog.get_index('courses.json')['tariffs'].get((course_slug, tariff_id))
 
 
 def get_all_consultations() -> List[Dict]:
@@ -64,35 +178,22 @@ def get_all_consultations() -> List[Dict]:
 
 def get_consultation_by_slug(slug: str) -> Optional[Dict]:
     """Получить консультацию по slug"""
-    consultations = get_all_consultations()
-    for consultation in consultations:
-        if consultation['slug'] == slug:
-            return consultation
-    return None
+    return catalog.get_index('consultations.json')['by_slug'].get(slug)
 
 
 def get_active_consultations() -> List[Dict]:
     """Получить активные консультации"""
-    consultations = get_all_consultations()
-    return [c for c in consultations if c.get('is_active', True)]
+    return list(catalog.get_index('consultations.json')['active'])
 
 
 def get_consultations_by_category(category: str) -> List[Dict]:
     """Получить консультации по категории"""
-    consultations = get_active_consultations()
-    return [c for c in consultations if c.get('category') == category]
+    return list(catalog.get_index('consultations.json')['by_category'].get(category, []))
 
 
 def get_consultation_option(consultation_slug: str, option_id: str) -> Optional[Dict]:
     """Получить опцию консультации"""
-    consultation = get_consultation_by_slug(consultation_slug)
-    if not consultation:
-        return None
-    
-    for option in consultation.get('options', []):
-        if option['id'] == option_id:
-            return option
-    return None
+    return catalog.get_index('consultations.json')['options'].get((consultation_slug, option_id))
 
 
 def get_all_guides() -> List[Dict]:
@@ -103,17 +204,13 @@ def get_all_guides() -> List[Dict]:
 
 def get_guide_by_id(guide_id: str) -> Optional[Dict]:
     """Получить гайд по ID"""
-    guides = get_all_guides()
-    for guide in guides:
-        if guide['id'] == guide_id:
-            return guide
-    return None
+    return catalog.get_index('guides.json')['by_id'].get(guide_id)
 
 
-def get_active_guides() -> List[Dict]:
-    """Получить активные гайды из JSON"""
-    guides = get_all_guides()
-    return [g for g in guides if g.get('is_active', True)]
+def get_active_guides(sort_by_order: bool = False) -> List[Dict]:
+    """Получить активные гайды из JSON (опционально - отсортированные по order)"""
+    index = catalog.get_index('guides.json')
+    return list(index['active_sorted'] if sort_by_order else index['active'])
 
 
 # ==================== Функции записи ====================
@@ -236,17 +333,13 @@ def get_all_reviews() -> List[Dict]:
 
 def get_review_by_id(review_id: str) -> Optional[Dict]:
     """Получить отзыв по ID"""
-    reviews = get_all_reviews()
-    for review in reviews:
-        if review['id'] == review_id:
-            return review
-    return None
+    return catalog.get_index('reviews.json')['by_id'].get(review_id)
 
 
-def get_active_reviews() -> List[Dict]:
-    """Получить активные отзывы из JSON"""
-    reviews = get_all_reviews()
-    return [r for r in reviews if r.get('is_active', True)]
+def get_active_reviews(sort_by_order: bool = False) -> List[Dict]:
+    """Получить активные отзывы из JSON (опционально - отсортированные по order)"""
+    index = catalog.get_index('reviews.json')
+    return list(index['active_sorted'] if sort_by_order else index['active'])
 
 
 def save_reviews(reviews: List[Dict]) -> None:
@@ -286,154 +379,70 @@ def delete_review(review_id: str) -> bool:
 
 
 # ==================== Материалы курсов ====================
+# Хранятся в MongoDB по документу на модуль и урок (database/course_materials.py);
+# course_materials.json - источник первого импорта и формат резервной копии.
 
-def get_course_materials(course_slug: str) -> Optional[Dict]:
-    """Получить материалы курса"""
-    try:
-        data = load_json('course_materials.json')
-        materials = data.get('materials', {})
-        return materials.get(course_slug)
-    except Exception:
-        return None
+COURSE_MATERIALS_FILE = os.path.join(DATA_DIR, 'course_materials.json')
+
+
+async def seed_course_materials() -> None:
+    """Импортировать course_materials.json, если материалов в базе еще нет"""
+    await course_materials.import_file(COURSE_MATERIALS_FILE, only_if_empty=True)
 
 
-def get_course_modules(course_slug: str) -> List[Dict]:
-    """Получить модули курса"""
-    materials = get_course_materials(course_slug)
-    if not materials:
-        return []
-    return materials.get('modules', [])
+async def get_course_materials(course_slug: str) -> Optional[Dict]:
+    """Получить материалы курса (все модули с уроками)"""
+    return await course_materials.get_course(course_slug)
 
 
-def get_module_by_id(course_slug: str, module_id: str) -> Optional[Dict]:
-    """Получить модуль по ID"""
-    modules = get_course_modules(course_slug)
-    for module in modules:
-        if module['id'] == module_id:
-            return module
-    return None
+async def get_course_modules(course_slug: str) -> List[Dict]:
+    """Получить модули курса (без уроков)"""
+    return await course_materials.get_modules(course_slug)
 
 
-def get_lesson_by_id(course_slug: str, module_id: str, lesson_id: str) -> Optional[Dict]:
+async def get_module_by_id(course_slug: str, module_id: str, with_lessons: bool = True) -> Optional[Dict]:
+    """Получить модуль по ID (со списком уроков: id, title, type, order)"""
+    return await course_materials.get_module(course_slug, module_id, lessons=with_lessons)
+
+
+async def get_lesson_by_id(course_slug: str, module_id: str, lesson_id: str) -> Optional[Dict]:
     """Получить урок по ID"""
-    module = get_module_by_id(course_slug, module_id)
-    if not module:
-        return None
-    
-    for lesson in module.get('lessons', []):
-        if lesson['id'] == lesson_id:
-            return lesson
-    return None
+    return await course_materials.get_lesson(course_slug, module_id, lesson_id)
 
 
-def save_course_materials(course_slug: str, materials: Dict) -> None:
-    """Сохранить материалы курса"""
-    try:
-        data = load_json('course_materials.json')
-    except:
-        data = {'materials': {}}
-    
-    if 'materials' not in data:
-        data['materials'] = {}
-    
-    data['materials'][course_slug] = materials
-    save_json('course_materials.json', data)
+async def save_course_materials(course_slug: str, materials: Dict) -> None:
+    """Заменить все материалы курса"""
+    await course_materials.replace_course(course_slug, materials)
 
 
-def add_module_to_course(course_slug: str, module: Dict) -> None:
-    """Добавить модуль к курсу"""
-    materials = get_course_materials(course_slug)
-    if not materials:
-        materials = {'modules': []}
-    
-    if 'modules' not in materials:
-        materials['modules'] = []
-    
-    materials['modules'].append(module)
-    save_course_materials(course_slug, materials)
+async def add_module_to_course(course_slug: str, module: Dict) -> Dict:
+    """Добавить модуль к курсу (без id и order - следующий по порядку)"""
+    return await course_materials.add_module(course_slug, module)
 
 
-def update_module(course_slug: str, module_id: str, updated_module: Dict) -> bool:
-    """Обновить модуль"""
-    materials = get_course_materials(course_slug)
-    if not materials or 'modules' not in materials:
-        return False
-    
-    for i, module in enumerate(materials['modules']):
-        if module['id'] == module_id:
-            materials['modules'][i] = updated_module
-            save_course_materials(course_slug, materials)
-            return True
-    
-    return False
+async def update_module(course_slug: str, module_id: str, updates: Dict) -> bool:
+    """Изменить поля модуля"""
+    return await course_materials.update_module(course_slug, module_id, updates)
 
 
-def delete_module(course_slug: str, module_id: str) -> bool:
+async def delete_module(course_slug: str, module_id: str) -> bool:
     """Удалить модуль"""
-    materials = get_course_materials(course_slug)
-    if not materials or 'modules' not in materials:
-        return False
-    
-    original_len = len(materials['modules'])
-    materials['modules'] = [m for m in materials['modules'] if m['id'] != module_id]
-    
-    if len(materials['modules']) < original_len:
-        save_course_materials(course_slug, materials)
-        return True
-    
-    return False
+    return await course_materials.delete_module(course_slug, module_id)
 
 
-def add_lesson_to_module(course_slug: str, module_id: str, lesson: Dict) -> bool:
-    """Добавить урок в модуль"""
-    materials = get_course_materials(course_slug)
-    if not materials or 'modules' not in materials:
-        return False
-    
-    for module in materials['modules']:
-        if module['id'] == module_id:
-            if 'lessons' not in module:
-                module['lessons'] = []
-            module['lessons'].append(lesson)
-            save_course_materials(course_slug, materials)
-            return True
-    
-    return False
+async def add_lesson_to_module(course_slug: str, module_id: str, lesson: Dict) -> Optional[Dict]:
+    """Добавить урок в модуль (без id и order - следующий по порядку)"""
+    return await course_materials.add_lesson(course_slug, module_id, lesson)
 
 
-def update_lesson(course_slug: str, module_id: str, lesson_id: str, updated_lesson: Dict) -> bool:
-    """Обновить урок"""
-    materials = get_course_materials(course_slug)
-    if not materials or 'modules' not in materials:
-        return False
-    
-    for module in materials['modules']:
-        if module['id'] == module_id:
-            for i, lesson in enumerate(module.get('lessons', [])):
-                if lesson['id'] == lesson_id:
-                    module['lessons'][i] = updated_lesson
-                    save_course_materials(course_slug, materials)
-                    return True
-    
-    return False
+async def update_lesson(course_slug: str, module_id: str, lesson_id: str, updates: Dict) -> bool:
+    """Изменить поля урока"""
+    return await course_materials.update_lesson(course_slug, module_id, lesson_id, updates)
 
 
-def delete_lesson(course_slug: str, module_id: str, lesson_id: str) -> bool:
+async def delete_lesson(course_slug: str, module_id: str, lesson_id: str) -> bool:
     """Удалить урок"""
-    materials = get_course_materials(course_slug)
-    if not materials or 'modules' not in materials:
-        return False
-    
-    for module in materials['modules']:
-        if module['id'] == module_id:
-            original_len = len(module.get('lessons', []))
-            module['lessons'] = [l for l in module.get('lessons', []) if l['id'] != lesson_id]
-            
-            if len(module['lessons']) < original_len:
-                save_course_materials(course_slug, materials)
-                return True
-    
-    return False
+    return await course_materials.delete_lesson(course_slug, module_id, lesson_id)
 
 
 # ==================== Мини-курс ====================
@@ -449,14 +458,10 @@ def get_mini_course() -> Optional[Dict]:
 
 def get_mini_course_tariff(tariff_id: str) -> Optional[Dict]:
     """Получить тариф мини-курса по ID"""
-    mini_course = get_mini_course()
-    if not mini_course:
+    try:
+        return catalog.get_index('mini_course.json')['tariffs'].get(tariff_id)
+    except Exception:
         return None
-    
-    for tariff in mini_course.get('tariffs', []):
-        if tariff['id'] == tariff_id:
-            return tariff
-    return None
 
 
 def save_mini_course(mini_course_data: Dict) -> None:
@@ -467,6 +472,9 @@ def save_mini_course(mini_course_data: Dict) -> None:
 
 # Для удобства экспортируем функции
 __all__ = [
+    # Кэш каталога
+    'catalog',
+    'CatalogSchemaError',
     # Чтение курсов
     'get_all_courses',
     'get_course_by_slug',
@@ -478,6 +486,7 @@ __all__ = [
     'get_module_by_id',
     'get_lesson_by_id',
     # Редактирование материалов курсов
+    'seed_course_materials',
     'save_course_materials',
     'add_module_to_course',
     'update_module',
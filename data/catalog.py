@@ -0,0 +1,526 @@
+"""
+Кэш каталога: JSON-файлы из data/ читаются один раз и держатся в памяти
+
+Запись атомарна: JSON пишется во временный файл рядом с целевым, который
+после fsync заменяет целевой через os.replace. Читатель (в том числе
+другой процесс) видит либо старый файл целиком, либо новый, а падение
+посреди записи не портит каталог.
+
+Снимок каталога (compile_snapshot, скрипт compile_catalog.py) - уже
+разобранные и проверенные файлы вместе с индексами в одном pickle-файле
+(snapshot_path, по умолчанию вне data/: в docker-compose data/ смонтирована
+поверх образа и скрыла бы снимок, собранный при сборке).
+Процесс читает его один раз через mmap и берет файл из снимка, если
+совпадает SHA-256 исходного JSON и кода индексов; иначе файл разбирается
+из JSON, как без снимка.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import stat as stat_module
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Права нового файла каталога (mkstemp создает файл только для владельца)
+DEFAULT_FILE_MODE = 0o644
+
+# Версия формата снимка
+SNAPSHOT_FORMAT = 1
+
+# Попыток отложенной записи файла (пауза между ними растет вдвое) и предел паузы
+MAX_WRITE_ATTEMPTS = 5
+MAX_RETRY_DELAY = 60.0
+
+
+class CatalogSchemaError(ValueError):
+    """Файл каталога не соответствует схеме"""
+
+
+class CachedFile:
+    """Разобранный JSON-файл вместе с отпечатком файла на диске"""
+
+    __slots__ = ('data', 'mtime_ns', 'size', 'checked_at', 'index')
+
+    def __init__(self, data: dict, mtime_ns: int, size: int, checked_at: float):
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked_at = checked_at
+        # Индексы строятся лениво и живут ровно столько, сколько данные
+        self.index: Optional[dict] = None
+
+
+class CatalogCache:
+    """
+    Процессный кэш JSON-каталога
+
+    Каждый файл разбирается один раз. Повторное чтение происходит только
+    если изменились mtime или размер файла. Сам stat() выполняется не чаще
+    одного раза в check_interval секунд, поэтому между проверками обращения
+    к диску нет вовсе.
+
+    Сохранения из других процессов приходят через слушателей версий
+    (database.catalog_versions вызывает invalidate для измененного файла).
+
+    put сразу обновляет кэш, а на диск файл пишется через write_delay
+    секунд: серия правок одного файла (несколько шагов админки) дает одну
+    запись. Слушатели сохранений вызываются после того, как файл на диске.
+    Без event loop (скрипты) или при write_delay=0 запись синхронная.
+
+    Возвращаемые объекты общие для всего процесса: изменять их можно только
+    с последующим сохранением через save_json (как это делают функции записи
+    в data/__init__.py).
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        check_interval: float = 1.0,
+        write_delay: float = 0.5,
+        snapshot_path: Optional[str] = None
+    ):
+        """
+        Args:
+            data_dir: Директория с JSON файлами
+            check_interval: Как часто (в секундах) сверять файл с диском
+            write_delay: Сколько секунд копить правки файла перед записью
+            snapshot_path: Файл снимка каталога (None - без снимка)
+        """
+        self.data_dir = data_dir
+        self.snapshot_path = snapshot_path
+        self.check_interval = check_interval
+        self.write_delay = write_delay
+        self._files: Dict[str, CachedFile] = {}
+        self._indexers: Dict[str, Callable[[dict], dict]] = {}
+        self._validators: Dict[str, Callable[[dict], None]] = {}
+        self._compiled_files: Optional[Dict[str, Dict[str, Any]]] = None
+        self._code_hash: Optional[str] = None
+        self._save_listeners: List[Callable[[str], None]] = []
+        self._error_listeners: List[Callable[[str, BaseException], None]] = []
+        self._lock = threading.RLock()
+        # Отложенная запись: данные, ожидающие записи, и таймеры
+        self._pending: Dict[str, dict] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._failures: Dict[str, int] = {}
+        # Поколения снимков: более старый снимок не перезапишет более новый
+        self._generations: Dict[str, int] = {}
+        self._on_disk: Dict[str, int] = {}
+        self._write_locks: Dict[str, threading.Lock] = {}
+
+    def path(self, filename: str) -> str:
+        """Полный путь к файлу каталога"""
+        return os.path.join(self.data_dir, filename)
+
+    def register_index(
+        self,
+        filename: str,
+        builder: Callable[[dict], dict],
+        validator: Optional[Callable[[dict], None]] = None
+    ) -> None:
+        """
+        Зарегистрировать построитель индексов для файла
+
+        Args:
+            filename: Имя JSON файла
+            builder: Функция, которая по содержимому файла строит словарь индексов
+            validator: Проверка схемы, бросает CatalogSchemaError
+        """
+        with self._lock:
+            self._indexers[filename] = builder
+            if validator is not None:
+                self._validators[filename] = validator
+            self._code_hash = None
+            entry = self._files.get(filename)
+            if entry is not None:
+                entry.index = None
+
+    def add_save_listener(self, listener: Callable[[str], None]) -> None:
+        """
+        Подписаться на сохранения через put (например, чтобы оповестить другие процессы)
+
+        Args:
+            listener: Функция, получающая имя сохраненного файла
+        """
+        self._save_listeners.append(listener)
+
+    def add_error_listener(self, listener: Callable[[str, BaseException], None]) -> None:
+        """
+        Подписаться на отложенные записи, не удавшиеся после MAX_WRITE_ATTEMPTS попыток
+
+        Правка при этом остается только в памяти процесса: следующая правка
+        файла или flush при остановке попробуют записать ее снова.
+
+        Args:
+            listener: Функция, получающая имя файла и последнюю ошибку
+        """
+        self._error_listeners.append(listener)
+
+    def get(self, filename: str) -> dict:
+        """
+        Получить содержимое файла из кэша
+
+        Raises:
+            FileNotFoundError: если файла нет на диске
+            json.JSONDecodeError: если файл поврежден
+        """
+        return self._entry(filename).data
+
+    def get_index(self, filename: str) -> dict:
+        """
+        Получить индексы файла, построенные зарегистрированным построителем
+
+        Индексы пересчитываются только после перечитывания или сохранения файла.
+        """
+        entry = self._entry(filename)
+        index = entry.index
+        if index is not None:
+            return index
+
+        with self._lock:
+            if entry.index is None:
+                entry.index = self._indexers[filename](entry.data)
+            return entry.index
+
+    def _entry(self, filename: str) -> CachedFile:
+        """Актуальная запись кэша для файла"""
+        entry = self._files.get(filename)
+        now = time.monotonic()
+
+        # Несохраненные данные новее диска - сверять с ним нечего
+        if entry is not None and (entry.mtime_ns < 0 or now - entry.checked_at < self.check_interval):
+            return entry
+
+        with self._lock:
+            entry = self._files.get(filename)
+            try:
+                stat = os.stat(self.path(filename))
+            except FileNotFoundError:
+                self._files.pop(filename, None)
+                raise
+
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                entry.checked_at = now
+                return entry
+
+            return self._load(filename, now)
+
+    def put(self, filename: str, data: dict) -> None:
+        """Сразу обновить кэш и записать файл на диск (через write_delay секунд)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None or self.write_delay <= 0:
+            self._put_now(filename, data)
+            return
+
+        with self._lock:
+            # Отпечаток -1: в кэше данные новее файла на диске
+            self._files[filename] = CachedFile(data, -1, -1, time.monotonic())
+            self._pending[filename] = data
+            # Новая правка - новая серия попыток записи
+            self._failures.pop(filename, None)
+            if filename not in self._timers:
+                # Окно отсчитывается от первой правки, чтобы поток правок не откладывал запись бесконечно
+                self._timers[filename] = loop.call_later(self.write_delay, self._flush_later, loop, filename)
+
+    def _put_now(self, filename: str, data: dict) -> None:
+        with self._lock:
+            self._pending.pop(filename, None)
+            snapshot = self._snapshot(filename, data)
+            try:
+                written = self._write(filename, *snapshot)
+            except Exception:
+                # Вызывающий код мог уже изменить закэшированные объекты -
+                # сбрасываем запись, чтобы следующее чтение взяло данные с диска
+                self._files.pop(filename, None)
+                raise
+            self._files[filename] = CachedFile(data, -1, -1, time.monotonic())
+            self._failures.pop(filename, None)
+        if written:
+            self._saved(filename, data)
+
+    def _snapshot(self, filename: str, data: dict) -> Tuple[str, int]:
+        """Сериализовать данные для записи: (текст, поколение)"""
+        with self._lock:
+            generation = self._generations.get(filename, 0) + 1
+            self._generations[filename] = generation
+            return json.dumps(data, ensure_ascii=False, indent=2), generation
+
+    def _write(self, filename: str, text: str, generation: int) -> bool:
+        """
+        Атомарно записать файл (вызывается и из потоков исполнителя)
+
+        Returns:
+            False, если на диске уже более новое поколение
+        """
+        with self._lock:
+            write_lock = self._write_locks.setdefault(filename, threading.Lock())
+
+        with write_lock:
+            if generation <= self._on_disk.get(filename, 0):
+                return False
+
+            self._atomic_write(self.path(filename), text.encode('utf-8'))
+            self._on_disk[filename] = generation
+            return True
+
+    def _atomic_write(self, path: str, payload: bytes) -> None:
+        """Временный файл рядом с целевым, fsync и os.replace"""
+        directory, name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                mode = stat_module.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                mode = DEFAULT_FILE_MODE
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._sync_dir(directory)
+
+    def _sync_dir(self, directory: str) -> None:
+        """fsync директории, чтобы переименование пережило сбой питания"""
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            # Не все файловые системы (и не все ОС) это поддерживают
+            pass
+        finally:
+            os.close(fd)
+
+    def _flush_later(self, loop: asyncio.AbstractEventLoop, filename: str) -> None:
+        """Таймер отложенной записи: сериализация здесь, запись в потоке исполнителя"""
+        with self._lock:
+            self._timers.pop(filename, None)
+            data = self._pending.pop(filename, None)
+            if data is None:
+                return
+            snapshot = self._snapshot(filename, data)
+
+        future = loop.run_in_executor(None, self._write, filename, *snapshot)
+        future.add_done_callback(lambda done: self._written(loop, filename, data, done))
+
+    def _written(self, loop: asyncio.AbstractEventLoop, filename: str, data: dict, done: asyncio.Future) -> None:
+        error = done.exception()
+        if error is not None:
+            with self._lock:
+                # Повторить, если за это время не появились более новые данные
+                self._pending.setdefault(filename, data)
+                failures = self._failures.get(filename, 0) + 1
+                self._failures[filename] = failures
+                if failures < MAX_WRITE_ATTEMPTS and filename not in self._timers:
+                    delay = min(self.write_delay * 2 ** failures, MAX_RETRY_DELAY)
+                    self._timers[filename] = loop.call_later(delay, self._flush_later, loop, filename)
+
+            if failures < MAX_WRITE_ATTEMPTS:
+                logger.warning(f"Error writing catalog file {filename} (attempt {failures}/{MAX_WRITE_ATTEMPTS}): {error}")
+                return
+
+            logger.error(f"Giving up writing catalog file {filename} after {failures} attempts: {error}")
+            for listener in self._error_listeners:
+                listener(filename, error)
+            return
+
+        with self._lock:
+            self._failures.pop(filename, None)
+        if done.result():
+            self._saved(filename, data)
+
+    def _saved(self, filename: str, data: dict) -> None:
+        """Файл записан: запомнить отпечаток и оповестить слушателей"""
+        with self._lock:
+            entry = self._files.get(filename)
+            if entry is not None and entry.data is data:
+                try:
+                    stat = os.stat(self.path(filename))
+                    entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+                    entry.checked_at = time.monotonic()
+                except OSError:
+                    pass
+
+        for listener in self._save_listeners:
+            listener(filename)
+
+    def flush(self) -> None:
+        """Записать все отложенные изменения сейчас (при остановке)"""
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            pending = list(self._pending.items())
+
+        for filename, data in pending:
+            with self._lock:
+                if self._pending.get(filename) is not data:
+                    continue
+            try:
+                self._put_now(filename, data)
+            except Exception as e:
+                logger.error(f"Error writing catalog file {filename}: {e}")
+
+    def invalidate(self, filename: Optional[str] = None) -> None:
+        """Сбросить кэш одного файла или всего каталога (кроме еще не записанных правок)"""
+        with self._lock:
+            filenames = list(self._files) if filename is None else [filename]
+            for name in filenames:
+                entry = self._files.get(name)
+                if entry is not None and entry.mtime_ns >= 0:
+                    del self._files[name]
+
+    def _load(self, filename: str, now: float) -> CachedFile:
+        """Прочитать файл с диска и положить в кэш"""
+        with open(self.path(filename), 'rb') as f:
+            # Отпечаток берем с открытого дескриптора - он соответствует
+            # именно тому содержимому, которое мы прочитаем
+            stat = os.fstat(f.fileno())
+            raw = f.read()
+
+        compiled = self._from_snapshot(filename, raw)
+        if compiled is not None:
+            data, index = compiled
+        else:
+            data, index = json.loads(raw), None
+            validator = self._validators.get(filename)
+            if validator is not None:
+                try:
+                    validator(data)
+                except CatalogSchemaError as e:
+                    # Чтение не ломаем: ошибка проявится там же, где и без проверки
+                    logger.error(f"Catalog file {filename} is invalid: {e}")
+
+        entry = CachedFile(data, stat.st_mtime_ns, stat.st_size, now)
+        entry.index = index
+        self._files[filename] = entry
+        return entry
+
+    # Снимок каталога
+
+    def _get_code_hash(self) -> str:
+        """Хэш кода, от которого зависят индексы в снимке (модули построителей и этот модуль)"""
+        if self._code_hash is None:
+            sources = {__file__}
+            for function in (*self._indexers.values(), *self._validators.values()):
+                sources.add(function.__code__.co_filename)
+
+            digest = hashlib.sha256()
+            for source in sorted(sources):
+                with open(source, 'rb') as f:
+                    digest.update(f.read())
+            self._code_hash = digest.hexdigest()
+        return self._code_hash
+
+    def load_snapshot(self) -> int:
+        """
+        Прочитать снимок (один раз за процесс, дальше - по запросу)
+
+        Returns:
+            Сколько файлов в снимке (0 - снимка нет или он непригоден)
+        """
+        with self._lock:
+            self._compiled_files = {}
+            if self.snapshot_path is None:
+                return 0
+            try:
+                with open(self.snapshot_path, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        snapshot = pickle.loads(mapped)
+            except FileNotFoundError:
+                return 0
+            except Exception as e:
+                logger.warning(f"Catalog snapshot is unreadable, using JSON sources: {e}")
+                return 0
+
+            if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('code_hash') != self._get_code_hash():
+                logger.info("Catalog snapshot was built by another version of the code, using JSON sources")
+                return 0
+
+            self._compiled_files = snapshot['files']
+            return len(self._compiled_files)
+
+    def _from_snapshot(self, filename: str, raw: bytes) -> Optional[Tuple[dict, Optional[dict]]]:
+        """(данные, индексы) из снимка, если он собран из того же содержимого"""
+        if self._compiled_files is None:
+            self.load_snapshot()
+
+        compiled = self._compiled_files.get(filename)
+        if compiled is None:
+            return None
+        if compiled['hash'] != hashlib.sha256(raw).hexdigest():
+            logger.info(f"Catalog snapshot is stale for {filename}, parsing JSON")
+            return None
+
+        # Каждая загрузка - свои объекты: вызывающий код может их изменять
+        return pickle.loads(compiled['blob'])
+
+    def compile_snapshot(self) -> Dict[str, str]:
+        """
+        Собрать снимок из зарегистрированных файлов
+
+        Каждый файл проверяется валидатором и индексируется; при ошибке
+        снимок не записывается.
+
+        Returns:
+            Имя файла -> SHA-256 исходного JSON
+
+        Raises:
+            CatalogSchemaError: файл не соответствует схеме (или не разбирается)
+        """
+        if self.snapshot_path is None:
+            raise ValueError("snapshot_path is not configured")
+
+        files = {}
+        for filename in sorted(self._indexers):
+            try:
+                with open(self.path(filename), 'rb') as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                continue
+
+            try:
+                data = json.loads(raw)
+                validator = self._validators.get(filename)
+                if validator is not None:
+                    validator(data)
+                index = self._indexers[filename](data)
+            except CatalogSchemaError as e:
+                raise CatalogSchemaError(f"{filename}: {e}") from e
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                raise CatalogSchemaError(f"{filename}: {type(e).__name__}: {e}") from e
+
+            files[filename] = {
+                'hash': hashlib.sha256(raw).hexdigest(),
+                # Данные и индексы одним pickle: индексы ссылаются на те же объекты
+                'blob': pickle.dumps((data, index), protocol=pickle.HIGHEST_PROTOCOL),
+            }
+
+        snapshot = {'format': SNAPSHOT_FORMAT, 'code_hash': self._get_code_hash(), 'files': files}
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        self._atomic_write(self.snapshot_path, pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            self._compiled_files = files
+        return {filename: compiled['hash'] for filename, compiled in files.items()}
@@ -1,6 +1,12 @@
 from .mongo_models import User, Payment, BotSettings
 from .mongodb import mongodb, get_db
 from .repositories import UserRepository, PaymentRepository, BotSettingsRepository
+from .activity import ActivityTracker, activity_tracker
+from .counters import StatsCounters, stats_counters
+from .settings_cache import SettingsCache, settings_cache
+from .catalog_versions import CatalogVersions, catalog_versions
+from .course_materials import CourseMaterialsStore, course_materials
+from .fsm_storage import MongoStorage, create_fsm_storage
 
 __all__ = [
     'User',
@@ -10,6 +16,18 @@ __all__ = [
     'get_db',
     'UserRepository',
     'PaymentRepository',
-    'BotSettingsRepository'
+    'BotSettingsRepository',
+    'ActivityTracker',
+    'activity_tracker',
+    'StatsCounters',
+    'stats_counters',
+    'SettingsCache',
+    'settings_cache',
+    'CatalogVersions',
+    'catalog_versions',
+    'CourseMaterialsStore',
+    'course_materials',
+    'MongoStorage',
+    'create_fsm_storage'
 ]
 
@@ -0,0 +1,96 @@
+"""
+Буферизованная запись last_activity
+
+Отметки активности копятся в памяти (telegram_id -> время) и пишутся в
+users одним неупорядоченным bulk_write раз в flush_interval секунд.
+Повторные клики одного пользователя между сбросами схлопываются в одну запись.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import config
+from .mongodb import mongodb
+from .repositories import UserRepository
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """Буфер отметок активности пользователей"""
+
+    def __init__(self, flush_interval: float = 5.0):
+        """
+        Args:
+            flush_interval: Период записи в базу, секунд
+        """
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, datetime] = {}
+        self._in_flight: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def touch(self, telegram_id: int, timestamp: Optional[datetime] = None) -> None:
+        """Отметить активность пользователя (без обращения к базе)"""
+        timestamp = timestamp or datetime.utcnow()
+        current = self._pending.get(telegram_id)
+        if current is None or timestamp > current:
+            self._pending[telegram_id] = timestamp
+
+    def pending_since(self, since: datetime) -> List[int]:
+        """Пользователи с еще не записанной активностью не раньше since"""
+        telegram_ids = {tid for tid, ts in self._pending.items() if ts >= since}
+        telegram_ids.update(tid for tid, ts in self._in_flight.items() if ts >= since)
+        return list(telegram_ids)
+
+    async def flush(self) -> None:
+        """Записать накопленные отметки"""
+        async with self._lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+            try:
+                await UserRepository(mongodb.get_database()).bulk_update_activity(batch)
+            except asyncio.CancelledError:
+                # Остановка во время записи - отметки допишет stop()
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                logger.error(f"Error saving activity for {len(batch)} users: {e}")
+                self._requeue(batch)
+            finally:
+                self._in_flight = {}
+
+    def _requeue(self, batch: Dict[int, datetime]) -> None:
+        for telegram_id, timestamp in batch.items():
+            self.touch(telegram_id, timestamp)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Запуск периодической записи"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Activity tracker started (flush every {self.flush_interval}s)")
+
+    async def stop(self) -> None:
+        """Остановка с финальной записью буфера"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        logger.info("Activity tracker stopped")
+
+
+# Глобальный экземпляр
+activity_tracker = ActivityTracker(flush_interval=config.ACTIVITY_FLUSH_INTERVAL)
@@ -0,0 +1,153 @@
+"""
+Версии файлов каталога для нескольких процессов
+
+Основной и учебный боты работают в разных контейнерах с общей папкой data/.
+Каждое сохранение файла каталога (save_json) увеличивает его версию в
+коллекции catalog_versions (документ на файл). Остальные процессы узнают
+об этом из change stream, а если он недоступен (MongoDB без replica set) -
+опрашивая коллекцию раз в poll_interval секунд, и сбрасывают из кэша только
+изменившийся файл. Сверка файлов с диском (stat) при этом становится
+редкой подстраховкой на случай ручной правки JSON.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import config
+from .mongodb import mongodb
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogVersions:
+    """Оповещение процессов об изменениях файлов каталога"""
+
+    def __init__(self, poll_interval: float = 1.0, stat_interval: float = 30.0):
+        """
+        Args:
+            poll_interval: Период опроса версий, секунд (без change stream)
+            stat_interval: Как часто сверять файлы с диском, пока работают версии
+        """
+        self.poll_interval = poll_interval
+        self.stat_interval = stat_interval
+        self.catalog = None
+        self._versions: Dict[str, int] = {}
+        self._bumps: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._check_interval: Optional[float] = None
+
+    @property
+    def collection(self):
+        return mongodb.get_database().catalog_versions
+
+    def _on_save(self, filename: str) -> None:
+        """Слушатель CatalogCache.put (вызывается синхронно из обработчиков)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты) - другие процессы увидят файл при сверке с диском
+            return
+        task = loop.create_task(self._bump(filename))
+        self._bumps.add(task)
+        task.add_done_callback(self._bumps.discard)
+
+    async def _bump(self, filename: str) -> None:
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": filename},
+                {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logger.error(f"Error bumping catalog version of {filename}: {e}")
+            return
+
+        # Своя запись уже в кэше; если между версиями вклинился другой процесс - перечитаем
+        if doc["version"] == self._versions.get(filename, 0) + 1:
+            self._versions[filename] = doc["version"]
+
+    async def refresh(self, invalidate: bool = True) -> None:
+        """
+        Сбросить из кэша файлы, версия которых изменилась
+
+        Args:
+            invalidate: False - только запомнить текущие версии
+        """
+        async for doc in self.collection.find({}, {"version": 1}):
+            filename, version = doc["_id"], doc.get("version", 0)
+            known = self._versions.get(filename, 0)
+            self._versions[filename] = version
+            if invalidate and known != version:
+                self.catalog.invalidate(filename)
+                logger.info(f"Catalog file {filename} changed in another process (version {version})")
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Error polling catalog versions: {e}")
+
+    async def _watch(self) -> None:
+        try:
+            async with self.collection.watch() as stream:
+                # Изменения между первым чтением и открытием потока
+                await self.refresh()
+                logger.info("Catalog follows catalog_versions change stream")
+                async for _ in stream:
+                    await self.refresh()
+        except OperationFailure as e:
+            logger.info(f"Change streams unavailable ({e}), polling catalog versions every {self.poll_interval}s")
+        except PyMongoError as e:
+            logger.warning(f"Catalog change stream stopped ({e}), polling catalog versions every {self.poll_interval}s")
+
+        await self._poll()
+
+    async def start(self, catalog) -> None:
+        """
+        Начать следить за версиями
+
+        Args:
+            catalog: CatalogCache процесса (data.catalog)
+        """
+        if self._task is not None and not self._task.done():
+            return
+
+        self.catalog = catalog
+        catalog.add_save_listener(self._on_save)
+        try:
+            # Текущие версии - точка отсчета (кэш сейчас читает файлы с диска)
+            await self.refresh(invalidate=False)
+        except Exception as e:
+            logger.error(f"Error loading catalog versions: {e}")
+
+        self._check_interval = catalog.check_interval
+        catalog.check_interval = max(catalog.check_interval, self.stat_interval)
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.catalog.check_interval = self._check_interval
+
+        # Дописать версии последних сохранений
+        if self._bumps:
+            await asyncio.gather(*self._bumps, return_exceptions=True)
+
+
+# Глобальный экземпляр
+catalog_versions = CatalogVersions(
+    poll_interval=config.CATALOG_POLL_INTERVAL,
+    stat_interval=config.CATALOG_STAT_INTERVAL
+)
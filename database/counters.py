@@ -0,0 +1,178 @@
+"""
+Счетчики для статистики админ-панели
+
+Коллекция stats_counters хранит итоговые значения (документ "totals") и
+значения по дням (документы "day:YYYY-MM-DD", UTC). Счетчики увеличиваются
+при регистрации пользователя и успешной оплате, поэтому статистика читается
+несколькими маленькими документами независимо от размера users и payments.
+
+Включаются настройкой STATS_COUNTERS_ENABLED. Пока документа totals нет,
+инкременты не пишутся: seed() один раз строит его по коллекциям, rebuild()
+пересчитывает заново (например, после ручной правки данных).
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from config import config
+from .mongodb import mongodb
+
+logger = logging.getLogger(__name__)
+
+TOTALS_ID = "totals"
+
+# Сколько дней назад пересчитываются дневные документы при seed/rebuild
+SEED_DAYS = 31
+
+
+def _day_id(moment: datetime) -> str:
+    return f"day:{moment.strftime('%Y-%m-%d')}"
+
+
+class StatsCounters:
+    """Инкрементальные счетчики пользователей и оплат"""
+
+    def __init__(self, enabled: bool = False):
+        """
+        Args:
+            enabled: Писать и читать счетчики
+        """
+        self.enabled = enabled
+
+    @property
+    def collection(self):
+        return mongodb.get_database().stats_counters
+
+    async def _increment(self, moment: datetime, fields: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        try:
+            # Без upsert: пока totals не построен seed(), инкременты не нужны
+            result = await self.collection.update_one({"_id": TOTALS_ID}, {"$inc": fields})
+            if result.matched_count:
+                await self.collection.update_one({"_id": _day_id(moment)}, {"$inc": fields}, upsert=True)
+        except Exception as e:
+            # Счетчики - вспомогательные данные, ошибка не должна ломать оплату
+            logger.error(f"Error updating stats counters: {e}")
+
+    async def user_registered(self, created_at: Optional[datetime] = None) -> None:
+        """Новый пользователь"""
+        await self._increment(created_at or datetime.utcnow(), {"new_users": 1})
+
+    async def payment_succeeded(self, amount: float, created_at: Optional[datetime] = None) -> None:
+        """
+        Успешная оплата
+
+        Args:
+            amount: Сумма платежа
+            created_at: Дата создания платежа (как и в запросах статистики,
+                период покупки определяется по ней)
+        """
+        await self._increment(created_at or datetime.utcnow(), {"payments": 1, "revenue": amount or 0})
+
+    async def read(self, since: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Итоги и суммы за период с since (с точностью до дня)
+
+        Returns:
+            {total_users, total_purchases, total_revenue,
+             new_users, period_purchases, period_revenue}
+            или None, если счетчики выключены или еще не построены
+        """
+        if not self.enabled:
+            return None
+
+        # "day;" - первая строка после всех "day:..." (';' следует за ':')
+        docs = await self.collection.find(
+            {"$or": [{"_id": TOTALS_ID}, {"_id": {"$gte": _day_id(since), "$lt": "day;"}}]}
+        ).to_list(length=None)
+
+        totals = next((doc for doc in docs if doc["_id"] == TOTALS_ID), None)
+        if totals is None:
+            return None
+
+        days = [doc for doc in docs if doc["_id"] != TOTALS_ID]
+        return {
+            "total_users": totals.get("new_users", 0),
+            "total_purchases": totals.get("payments", 0),
+            "total_revenue": totals.get("revenue", 0),
+            "new_users": sum(doc.get("new_users", 0) for doc in days),
+            "period_purchases": sum(doc.get("payments", 0) for doc in days),
+            "period_revenue": sum(doc.get("revenue", 0) for doc in days)
+        }
+
+    async def _compute(self) -> Dict[str, Dict[str, Any]]:
+        """Значения счетчиков, посчитанные по коллекциям"""
+        db = mongodb.get_database()
+        since = datetime.utcnow() - timedelta(days=SEED_DAYS)
+        day_format = {"$dateToString": {"format": "day:%Y-%m-%d", "date": "$created_at"}}
+
+        docs: Dict[str, Dict[str, Any]] = {TOTALS_ID: {"new_users": 0, "payments": 0, "revenue": 0}}
+
+        users = await db.users.aggregate([
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "days": [
+                    {"$match": {"created_at": {"$gte": since}}},
+                    {"$group": {"_id": day_format, "count": {"$sum": 1}}}
+                ]
+            }}
+        ]).to_list(length=1)
+        users = users[0]
+        docs[TOTALS_ID]["new_users"] = users["total"][0]["count"] if users["total"] else 0
+        for day in users["days"]:
+            docs.setdefault(day["_id"], {"new_users": 0, "payments": 0, "revenue": 0})["new_users"] = day["count"]
+
+        payments = await db.payments.aggregate([
+            {"$match": {"status": "succeeded"}},
+            {"$facet": {
+                "total": [{"$group": {"_id": None, "count": {"$sum": 1}, "revenue": {"$sum": "$amount"}}}],
+                "days": [
+                    {"$match": {"created_at": {"$gte": since}}},
+                    {"$group": {"_id": day_format, "count": {"$sum": 1}, "revenue": {"$sum": "$amount"}}}
+                ]
+            }}
+        ]).to_list(length=1)
+        payments = payments[0]
+        if payments["total"]:
+            docs[TOTALS_ID]["payments"] = payments["total"][0]["count"]
+            docs[TOTALS_ID]["revenue"] = payments["total"][0]["revenue"]
+        for day in payments["days"]:
+            doc = docs.setdefault(day["_id"], {"new_users": 0, "payments": 0, "revenue": 0})
+            doc["payments"] = day["count"]
+            doc["revenue"] = day["revenue"]
+
+        return docs
+
+    async def seed(self) -> None:
+        """Построить счетчики, если их еще нет"""
+        if not self.enabled:
+            return
+        if await self.collection.find_one({"_id": TOTALS_ID}, {"_id": 1}):
+            return
+
+        try:
+            docs = await self._compute()
+            totals = docs.pop(TOTALS_ID)
+            for day_id, values in docs.items():
+                await self.collection.replace_one({"_id": day_id}, values, upsert=True)
+            # totals последним: до его появления инкременты пропускаются
+            await self.collection.insert_one({"_id": TOTALS_ID, **totals})
+            logger.info(f"Stats counters seeded: {totals}")
+        except DuplicateKeyError:
+            # Параллельно построил другой процесс
+            pass
+        except Exception as e:
+            # Без счетчиков статистика считается агрегациями
+            logger.error(f"Error seeding stats counters: {e}")
+
+    async def rebuild(self) -> None:
+        """Пересчитать счетчики по коллекциям"""
+        await self.collection.delete_many({})
+        await self.seed()
+
+
+# Глобальный экземпляр
+stats_counters = StatsCounters(enabled=config.STATS_COUNTERS_ENABLED)
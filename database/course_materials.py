@@ -0,0 +1,271 @@
+"""
+Материалы курсов в MongoDB
+
+Модули и уроки хранятся по документу на элемент (коллекции course_modules
+и course_lessons), поэтому правка урока - один update_one по индексу, а не
+перезапись всего дерева курсов. Одновременные правки разных полей и
+уроков не затирают друг друга.
+
+Экран модуля читает только поля уроков для списка (LESSON_SUMMARY),
+экран урока - один документ урока.
+
+course_materials.json остается форматом импорта и резервной копии:
+import_materials загружает его (повторный импорт перезаписывает те же
+модули и уроки), export_materials собирает дерево обратно.
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from .mongodb import mongodb
+
+logger = logging.getLogger(__name__)
+
+# Поля урока для списка уроков модуля
+LESSON_SUMMARY = {"_id": 0, "id": 1, "title": 1, "type": 1, "order": 1}
+
+# Служебные поля, которые не отдаются наружу
+MODULE_PROJECTION = {"_id": 0, "course_slug": 0}
+LESSON_PROJECTION = {"_id": 0, "course_slug": 0, "module_id": 0}
+
+# Попыток занять следующий номер при одновременном добавлении
+MAX_INSERT_ATTEMPTS = 5
+
+
+class CourseMaterialsStore:
+    """Модули и уроки курсов (документ на модуль и на урок)"""
+
+    @property
+    def modules(self):
+        return mongodb.get_database().course_modules
+
+    @property
+    def lessons(self):
+        return mongodb.get_database().course_lessons
+
+    # Чтение
+
+    async def get_modules(self, course_slug: str) -> List[Dict[str, Any]]:
+        """Модули курса по порядку (без уроков)"""
+        cursor = self.modules.find({"course_slug": course_slug}, MODULE_PROJECTION).sort("order", 1)
+        return await cursor.to_list(length=None)
+
+    async def get_module(self, course_slug: str, module_id: str, lessons: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Модуль курса
+
+        Args:
+            lessons: Добавить список уроков (только поля LESSON_SUMMARY)
+        """
+        module = await self.modules.find_one({"course_slug": course_slug, "id": module_id}, MODULE_PROJECTION)
+        if module and lessons:
+            cursor = self.lessons.find(
+                {"course_slug": course_slug, "module_id": module_id},
+                LESSON_SUMMARY
+            ).sort("order", 1)
+            module["lessons"] = await cursor.to_list(length=None)
+        return module
+
+    async def get_lesson(self, course_slug: str, module_id: str, lesson_id: str) -> Optional[Dict[str, Any]]:
+        """Урок целиком"""
+        return await self.lessons.find_one(
+            {"course_slug": course_slug, "module_id": module_id, "id": lesson_id},
+            LESSON_PROJECTION
+        )
+
+    async def get_course(self, course_slug: str) -> Optional[Dict[str, Any]]:
+        """Материалы курса в формате course_materials.json (модули с полными уроками)"""
+        modules = await self.get_modules(course_slug)
+        if not modules:
+            return None
+
+        by_module: Dict[str, List[Dict[str, Any]]] = {module["id"]: [] for module in modules}
+        cursor = self.lessons.find(
+            {"course_slug": course_slug},
+            {"_id": 0, "course_slug": 0}
+        ).sort([("module_id", 1), ("order", 1)])
+        async for lesson in cursor:
+            module_id = lesson.pop("module_id")
+            if module_id in by_module:
+                by_module[module_id].append(lesson)
+
+        for module in modules:
+            module["lessons"] = by_module[module["id"]]
+        return {"modules": modules}
+
+    # Запись
+
+    async def _insert_next(
+        self,
+        collection,
+        scope: Dict[str, Any],
+        item: Dict[str, Any],
+        make_id: Callable[[int], str]
+    ) -> Dict[str, Any]:
+        """
+        Вставить элемент в конец списка
+
+        Без order элемент получает номер после последнего, без id - id из
+        номера. Если тот же номер занял одновременный вызов, номер берется заново.
+        """
+        for attempt in range(MAX_INSERT_ATTEMPTS):
+            doc = dict(item)
+            if doc.get("order") is None:
+                last = await collection.find_one(scope, {"order": 1}, sort=[("order", -1)])
+                doc["order"] = (last["order"] if last else 0) + 1
+            if not doc.get("id"):
+                doc["id"] = make_id(doc["order"])
+
+            try:
+                await collection.insert_one({**doc, **scope})
+                return doc
+            except DuplicateKeyError:
+                # Повторяем, только если id выдали мы
+                if item.get("id") or attempt == MAX_INSERT_ATTEMPTS - 1:
+                    raise
+
+    async def add_module(self, course_slug: str, module: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Добавить модуль в конец курса
+
+        Returns:
+            Сохраненный модуль (с id и order)
+        """
+        module = {key: value for key, value in module.items() if key != "lessons"}
+        return await self._insert_next(
+            self.modules,
+            {"course_slug": course_slug},
+            module,
+            lambda order: f"module-{order}"
+        )
+
+    async def update_module(self, course_slug: str, module_id: str, updates: Dict[str, Any]) -> bool:
+        """Изменить поля модуля"""
+        result = await self.modules.update_one(
+            {"course_slug": course_slug, "id": module_id},
+            {"$set": updates}
+        )
+        return result.matched_count > 0
+
+    async def delete_module(self, course_slug: str, module_id: str) -> bool:
+        """Удалить модуль вместе с уроками"""
+        result = await self.modules.delete_one({"course_slug": course_slug, "id": module_id})
+        if not result.deleted_count:
+            return False
+        await self.lessons.delete_many({"course_slug": course_slug, "module_id": module_id})
+        return True
+
+    async def add_lesson(self, course_slug: str, module_id: str, lesson: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Добавить урок в конец модуля
+
+        Returns:
+            Сохраненный урок (с id и order) или None, если модуля нет
+        """
+        if not await self.modules.count_documents({"course_slug": course_slug, "id": module_id}, limit=1):
+            return None
+        return await self._insert_next(
+            self.lessons,
+            {"course_slug": course_slug, "module_id": module_id},
+            lesson,
+            lambda order: f"lesson-{module_id}-{order}"
+        )
+
+    async def update_lesson(self, course_slug: str, module_id: str, lesson_id: str, updates: Dict[str, Any]) -> bool:
+        """Изменить поля урока (остальные поля не трогаются)"""
+        result = await self.lessons.update_one(
+            {"course_slug": course_slug, "module_id": module_id, "id": lesson_id},
+            {"$set": updates}
+        )
+        return result.matched_count > 0
+
+    async def delete_lesson(self, course_slug: str, module_id: str, lesson_id: str) -> bool:
+        """Удалить урок"""
+        result = await self.lessons.delete_one({"course_slug": course_slug, "module_id": module_id, "id": lesson_id})
+        return result.deleted_count > 0
+
+    async def replace_course(self, course_slug: str, materials: Dict[str, Any]) -> None:
+        """Заменить все материалы курса"""
+        await self.modules.delete_many({"course_slug": course_slug})
+        await self.lessons.delete_many({"course_slug": course_slug})
+        await self.import_materials({"materials": {course_slug: materials}})
+
+    # Импорт и экспорт
+
+    async def import_materials(self, data: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Загрузить материалы в формате course_materials.json
+
+        Модули и уроки с теми же ключами перезаписываются, остальные не трогаются.
+
+        Returns:
+            (модулей, уроков)
+        """
+        module_ops: List[ReplaceOne] = []
+        lesson_ops: List[ReplaceOne] = []
+
+        for course_slug, materials in (data.get("materials") or {}).items():
+            for module in (materials or {}).get("modules", []):
+                module_doc = {key: value for key, value in module.items() if key != "lessons"}
+                module_doc["course_slug"] = course_slug
+                module_ops.append(ReplaceOne(
+                    {"course_slug": course_slug, "id": module["id"]},
+                    module_doc,
+                    upsert=True
+                ))
+                for lesson in module.get("lessons", []):
+                    lesson_ops.append(ReplaceOne(
+                        {"course_slug": course_slug, "module_id": module["id"], "id": lesson["id"]},
+                        {**lesson, "course_slug": course_slug, "module_id": module["id"]},
+                        upsert=True
+                    ))
+
+        if module_ops:
+            await self.modules.bulk_write(module_ops, ordered=False)
+        if lesson_ops:
+            await self.lessons.bulk_write(lesson_ops, ordered=False)
+        return len(module_ops), len(lesson_ops)
+
+    async def export_materials(self) -> Dict[str, Any]:
+        """Все материалы в формате course_materials.json"""
+        course_slugs = sorted(await self.modules.distinct("course_slug"))
+        materials = {}
+        for course_slug in course_slugs:
+            materials[course_slug] = await self.get_course(course_slug)
+        return {"materials": materials}
+
+    async def import_file(self, path: str, only_if_empty: bool = False) -> Tuple[int, int]:
+        """
+        Импорт из JSON файла
+
+        Args:
+            only_if_empty: Импортировать, только если материалов в базе еще нет
+        """
+        if only_if_empty and await self.modules.count_documents({}, limit=1):
+            return 0, 0
+        if not os.path.exists(path):
+            logger.warning(f"Course materials file not found: {path}")
+            return 0, 0
+
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        modules, lessons = await self.import_materials(data)
+        logger.info(f"Imported course materials from {path}: {modules} modules, {lessons} lessons")
+        return modules, lessons
+
+    async def export_file(self, path: str) -> Tuple[int, int]:
+        """Резервная копия в JSON файл"""
+        data = await self.export_materials()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+        modules = [module for materials in data["materials"].values() for module in materials["modules"]]
+        return len(modules), sum(len(module["lessons"]) for module in modules)
+
+
+# Глобальный экземпляр
+course_materials = CourseMaterialsStore()
@@ -0,0 +1,254 @@
+"""
+Хранилище FSM в MongoDB
+
+Состояния и данные FSM хранятся в коллекции fsm_states (один документ на
+ключ бот/чат/пользователь) и переживают перезапуск. Устаревшие документы
+удаляет TTL-индекс по updated_at.
+
+Перед базой стоит небольшой кэш в памяти процесса:
+- чтения обслуживаются из кэша, пока запись свежее cache_ttl секунд
+- записи попадают в кэш сразу, а в базу уходят пачкой через flush_interval
+
+cache_ttl ограничивает, насколько долго процесс может видеть чужое
+(записанное другим процессом) состояние устаревшим. Для нескольких
+процессов с общими пользователями стоит держать его небольшим.
+"""
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+from config import config
+from .mongodb import mongodb
+
+logger = logging.getLogger(__name__)
+
+
+class _CachedState:
+    """Запись кэша FSM"""
+
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], loaded_at: float):
+        self.state = state
+        self.data = data
+        self.loaded_at = loaded_at
+
+
+class MongoStorage(BaseStorage):
+    """FSM storage для aiogram поверх Motor с write-back кэшем"""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        collection: str = "fsm_states",
+        state_ttl: int = 7 * 24 * 3600,
+        cache_ttl: float = 5.0,
+        cache_size: int = 10000,
+        flush_interval: float = 0.5
+    ):
+        """
+        Args:
+            db: База данных MongoDB
+            collection: Имя коллекции
+            state_ttl: Через сколько секунд без изменений состояние удаляется
+            cache_ttl: Сколько секунд запись кэша считается свежей (0 - без кэша чтений)
+            cache_size: Максимум записей в кэше
+            flush_interval: Задержка отложенной записи в базу, секунд
+        """
+        self.collection = db[collection]
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+
+        self._cache: "OrderedDict[str, _CachedState]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    async def create_indexes(self) -> None:
+        """Создание TTL-индекса (при смене state_ttl индекс обновляется)"""
+        try:
+            await self.collection.create_index("updated_at", expireAfterSeconds=self.state_ttl)
+        except OperationFailure:
+            # Индекс уже есть с другим сроком жизни
+            await self.collection.database.command(
+                "collMod",
+                self.collection.name,
+                index={"keyPattern": {"updated_at": 1}, "expireAfterSeconds": self.state_ttl}
+            )
+
+    @staticmethod
+    def _build_key(key: StorageKey) -> str:
+        """Строковый _id документа для ключа aiogram"""
+        parts = [
+            str(key.bot_id),
+            str(key.chat_id),
+            str(key.user_id),
+            str(getattr(key, "thread_id", None) or ""),
+            str(getattr(key, "business_connection_id", None) or ""),
+            key.destiny
+        ]
+        return ":".join(parts)
+
+    async def _get_entry(self, doc_id: str) -> _CachedState:
+        """Запись из кэша или из базы"""
+        entry = self._cache.get(doc_id)
+        now = time.monotonic()
+
+        # Несохраненные изменения всегда новее базы
+        if entry is not None and (doc_id in self._dirty or now - entry.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(doc_id)
+            return entry
+
+        doc = await self.collection.find_one({"_id": doc_id}, {"state": 1, "data": 1})
+
+        # Пока ждали базу, запись могла измениться локально
+        if doc_id in self._dirty:
+            return self._cache[doc_id]
+
+        entry = _CachedState(
+            doc.get("state") if doc else None,
+            (doc.get("data") or {}) if doc else {},
+            now
+        )
+        self._remember(doc_id, entry)
+        return entry
+
+    def _remember(self, doc_id: str, entry: _CachedState) -> None:
+        """Положить запись в кэш, вытеснив самые старые чистые записи"""
+        self._cache[doc_id] = entry
+        self._cache.move_to_end(doc_id)
+
+        if len(self._cache) <= self.cache_size:
+            return
+
+        for cached_id in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            # Несохраненные записи не вытесняем - они еще не в базе
+            if cached_id not in self._dirty:
+                del self._cache[cached_id]
+
+    def _mark_dirty(self, doc_id: str) -> None:
+        """Отметить запись для отложенной записи в базу"""
+        self._dirty.add(doc_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Записать все накопленные изменения в базу"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            dirty, self._dirty = self._dirty, set()
+            now = datetime.utcnow()
+            operations = []
+
+            for doc_id in dirty:
+                entry = self._cache[doc_id]
+                if entry.state is None and not entry.data:
+                    operations.append(DeleteOne({"_id": doc_id}))
+                else:
+                    operations.append(UpdateOne(
+                        {"_id": doc_id},
+                        {"$set": {
+                            "state": entry.state,
+                            "data": entry.data,
+                            "updated_at": now
+                        }},
+                        upsert=True
+                    ))
+
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except asyncio.CancelledError:
+                # Остановка во время записи - ключи допишет close()
+                self._dirty |= dirty
+                raise
+            except Exception as e:
+                logger.error(f"Error flushing FSM states ({len(operations)} keys): {e}")
+                # Вернем ключи в очередь - запишем при следующем сбросе
+                self._dirty |= dirty
+                if not self._closed:
+                    self._flush_task = asyncio.create_task(self._delayed_flush())
+                return
+
+            # Записанные записи снова считаются свежими
+            loaded_at = time.monotonic()
+            for doc_id in dirty:
+                if doc_id not in self._dirty and doc_id in self._cache:
+                    self._cache[doc_id].loaded_at = loaded_at
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        doc_id = self._build_key(key)
+        entry = await self._get_entry(doc_id)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(doc_id)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get_entry(self._build_key(key))
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        doc_id = self._build_key(key)
+        entry = await self._get_entry(doc_id)
+        entry.data = copy.deepcopy(data)
+        self._mark_dirty(doc_id)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._get_entry(self._build_key(key))
+        return copy.deepcopy(entry.data)
+
+    async def close(self) -> None:
+        """Сбросить изменения в базу перед остановкой"""
+        self._closed = True
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+
+        await self.flush()
+        if self._dirty:
+            logger.error(f"{len(self._dirty)} FSM states were not saved on shutdown")
+
+
+async def create_fsm_storage() -> BaseStorage:
+    """
+    Хранилище FSM согласно FSM_STORAGE
+
+    'mongo' (по умолчанию) - MongoStorage, 'memory' - MemoryStorage
+    (состояния теряются при перезапуске, только для одного процесса).
+    """
+    if config.FSM_STORAGE == 'memory':
+        return MemoryStorage()
+
+    storage = MongoStorage(
+        mongodb.get_database(),
+        state_ttl=config.FSM_STATE_TTL,
+        cache_ttl=config.FSM_CACHE_TTL,
+        flush_interval=config.FSM_FLUSH_INTERVAL
+    )
+    await storage.create_indexes()
+    return storage
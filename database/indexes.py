@@ -0,0 +1,200 @@
+"""
+Манифест индексов MongoDB
+
+Индексы описаны декларативно и повторяют форму реальных запросов.
+При запуске манифест сравнивается с index_information(): создаются только
+отсутствующие индексы, индекс с тем же именем, но другими ключами или
+опциями пересоздается, устаревшие индексы из RETIRED_INDEXES удаляются.
+Остальные индексы коллекций (например, TTL-индекс fsm_states) не трогаются.
+"""
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Опции, которые сравниваются с index_information()
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+ACTIVE_SUBSCRIPTION = {"is_active": True}
+
+
+class IndexSpec:
+    """Описание одного индекса"""
+
+    __slots__ = ("keys", "name", "options")
+
+    def __init__(self, keys: Union[str, Sequence[Tuple[str, int]]], name: Optional[str] = None, **options: Any):
+        """
+        Args:
+            keys: Поле или список (поле, направление)
+            name: Имя индекса (по умолчанию - как у create_index: field_1_other_-1)
+            options: unique, sparse, partialFilterExpression, expireAfterSeconds
+        """
+        self.keys: List[Tuple[str, int]] = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        self.name = name or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+        self.options = options
+
+    def matches(self, info: Dict[str, Any]) -> bool:
+        """Совпадает ли существующий индекс (запись index_information()) с описанием"""
+        existing_keys = [(field, int(direction)) for field, direction in info.get("key", [])]
+        if existing_keys != self.keys:
+            return False
+
+        for option in COMPARED_OPTIONS:
+            expected = self.options.get(option)
+            actual = info.get(option)
+            if option in ("unique", "sparse"):
+                expected, actual = bool(expected), bool(actual)
+            elif isinstance(actual, dict):
+                actual = dict(actual)
+            if expected != actual:
+                return False
+        return True
+
+    def to_model(self) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, **self.options)
+
+
+INDEX_MANIFEST: Dict[str, List[IndexSpec]] = {
+    "users": [
+        IndexSpec("telegram_id", unique=True),
+        IndexSpec("username"),
+        IndexSpec("last_activity"),
+        IndexSpec("created_at"),
+    ],
+    "payments": [
+        # Уникальность только для платежей, уже созданных в YooKassa
+        IndexSpec("payment_id", unique=True, sparse=True),
+        IndexSpec("user_id"),
+        IndexSpec("status"),
+        IndexSpec("created_at"),
+        # Проверка доступа к курсам (EntitlementService) - покрывающий
+        IndexSpec([
+            ("user_id", 1),
+            ("status", 1),
+            ("product_type", 1),
+            ("course_slug", 1),
+            ("created_at", -1),
+            ("paid_at", 1)
+        ]),
+        # Фоновая проверка: status='pending' и created_at за последние сутки
+        IndexSpec(
+            [("created_at", -1)],
+            name="pending_created_at",
+            partialFilterExpression={"status": "pending"}
+        ),
+    ],
+    "subscriptions": [
+        IndexSpec("user_id"),
+        # Подписка, уже созданная по платежу (повтор активации)
+        IndexSpec("payment_id"),
+        IndexSpec([("user_id", 1), ("is_active", 1)]),
+        # Истекшие подписки: is_active и end_date < now
+        IndexSpec(
+            [("end_date", 1)],
+            name="active_end_date",
+            partialFilterExpression=ACTIVE_SUBSCRIPTION
+        ),
+        # Напоминания об окончании: is_active, notified_* = False, end_date в окне
+        IndexSpec(
+            [("notified_3_days", 1), ("end_date", 1)],
+            name="active_notified_3_days_end_date",
+            partialFilterExpression=ACTIVE_SUBSCRIPTION
+        ),
+        IndexSpec(
+            [("notified_1_day", 1), ("end_date", 1)],
+            name="active_notified_1_day_end_date",
+            partialFilterExpression=ACTIVE_SUBSCRIPTION
+        ),
+        # Автопродление: is_active, auto_renew, renewal_attempted, end_date в окне
+        IndexSpec(
+            [("auto_renew", 1), ("renewal_attempted", 1), ("end_date", 1)],
+            name="active_auto_renew_end_date",
+            partialFilterExpression=ACTIVE_SUBSCRIPTION
+        ),
+    ],
+    "subscription_payments": [
+        IndexSpec("payment_id", unique=True),
+        IndexSpec("user_id"),
+        IndexSpec("status"),
+    ],
+    "bot_settings": [
+        IndexSpec("setting_key", unique=True),
+    ],
+    "course_modules": [
+        IndexSpec([("course_slug", 1), ("id", 1)], unique=True),
+        # Модули курса по порядку и номер следующего модуля
+        IndexSpec([("course_slug", 1), ("order", 1)]),
+    ],
+    "course_lessons": [
+        IndexSpec([("course_slug", 1), ("module_id", 1), ("id", 1)], unique=True),
+        # Уроки модуля по порядку и номер следующего урока
+        IndexSpec([("course_slug", 1), ("module_id", 1), ("order", 1)]),
+    ],
+    "invite_links": [
+        # Выдача ссылки из запаса и отзыв невыданных: status='available' по created_at
+        IndexSpec(
+            [("created_at", 1)],
+            name="available_created_at",
+            partialFilterExpression={"status": "available"}
+        ),
+        # Отзыв ссылок закончившихся подписок
+        IndexSpec(
+            [("valid_until", 1)],
+            name="issued_valid_until",
+            partialFilterExpression={"status": "issued"}
+        ),
+    ],
+}
+
+# Индексы, замененные манифестом (одиночные поля под запросы подписок)
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "subscriptions": ["is_active_1", "end_date_1"],
+}
+
+
+async def apply_index_manifest(db: AsyncIOMotorDatabase) -> Dict[str, int]:
+    """
+    Привести индексы базы к манифесту
+
+    Ошибка одного индекса (например, дубликаты под уникальным ключом)
+    логируется и не мешает остальным.
+
+    Returns:
+        Счетчики: created, rebuilt, dropped, failed
+    """
+    stats = {"created": 0, "rebuilt": 0, "dropped": 0, "failed": 0}
+
+    for collection_name in sorted(set(INDEX_MANIFEST) | set(RETIRED_INDEXES)):
+        collection = db[collection_name]
+        existing = await collection.index_information()
+
+        for spec in INDEX_MANIFEST.get(collection_name, []):
+            info = existing.get(spec.name)
+            if info is not None and spec.matches(info):
+                continue
+
+            try:
+                if info is not None:
+                    logger.info(f"Rebuilding index {collection_name}.{spec.name}: {info} -> {spec.keys} {spec.options}")
+                    await collection.drop_index(spec.name)
+                await collection.create_indexes([spec.to_model()])
+                stats["rebuilt" if info is not None else "created"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.warning(f"⚠️ Ошибка создания индекса {collection_name}.{spec.name}: {e}")
+
+        for name in RETIRED_INDEXES.get(collection_name, []):
+            if name not in existing:
+                continue
+            try:
+                await collection.drop_index(name)
+                stats["dropped"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.warning(f"⚠️ Ошибка удаления индекса {collection_name}.{name}: {e}")
+
+    return stats
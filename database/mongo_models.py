@@ -1,5 +1,9 @@
 """
 Модели данных для MongoDB
+
+Модели объявлены с __slots__: без __dict__ на каждый экземпляр списки
+из сотен тысяч документов занимают заметно меньше памяти и быстрее
+создаются. Новые атрибуты нужно добавлять в __slots__.
 """
 from datetime import datetime
 from typing import Optional, Dict, Any
@@ -36,6 +40,8 @@ class BaseModel:
 class User:
     """Модель пользователя"""
     
+    __slots__ = ("id", "telegram_id", "username", "first_name", "last_name", "created_at", "last_activity", "is_active")
+    
     def __init__(
         self,
         telegram_id: int,
@@ -91,6 +97,12 @@ class User:
 class Payment:
     """Модель платежа"""
     
+    __slots__ = (
+        "id", "user_id", "amount", "status", "currency", "product_type", "course_slug", "tariff_id",
+        "consultation_slug", "consultation_option_id", "product_id", "payment_id", "confirmation_url",
+        "is_payment_link", "chat_id", "message_id", "created_at", "paid_at"
+    )
+    
     def __init__(
         self,
         user_id: ObjectId,
@@ -188,6 +200,11 @@ class Payment:
 class Subscription:
     """Модель подписки на канал"""
     
+    __slots__ = (
+        "id", "user_id", "invite_link", "start_date", "end_date", "is_active", "notified_3_days",
+        "notified_1_day", "payment_id", "payment_method_id", "auto_renew", "renewal_attempted", "created_at"
+    )
+    
     def __init__(
         self,
         user_id: int,
@@ -263,6 +280,10 @@ class Subscription:
 class SubscriptionPayment:
     """Модель платежа за подписку на канал (отдельно от обычных платежей)"""
     
+    __slots__ = (
+        "id", "user_id", "payment_id", "amount", "currency", "status", "created_at", "paid_at", "subscription_id"
+    )
+    
     def __init__(
         self,
         user_id: int,
@@ -322,6 +343,8 @@ class SubscriptionPayment:
 class BotSettings:
     """Модель настроек бота"""
     
+    __slots__ = ("id", "setting_key", "setting_value", "updated_at")
+    
     def __init__(
         self,
         setting_key: str,
@@ -5,6 +5,8 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from typing import Optional
 import logging
 
+from .indexes import apply_index_manifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,37 +36,16 @@ class MongoDB:
     
     @classmethod
     async def _create_indexes(cls):
-        """Создание индексов для коллекций"""
+        """Создание индексов для коллекций (см. database/indexes.py)"""
         if cls.db is None:
             return
         
         try:
-            # Индексы для users
-            await cls.db.users.create_index("telegram_id", unique=True)
-            await cls.db.users.create_index("username")
-            await cls.db.users.create_index("last_activity")
-            
-            # Индексы для payments
-            await cls.db.payments.create_index("user_id")
-            await cls.db.payments.create_index("payment_id", unique=True, sparse=True)
-            await cls.db.payments.create_index("status")
-            await cls.db.payments.create_index("created_at")
-            
-            # Индексы для subscriptions (подписки на канал)
-            await cls.db.subscriptions.create_index("user_id")
-            await cls.db.subscriptions.create_index("is_active")
-            await cls.db.subscriptions.create_index("end_date")
-            await cls.db.subscriptions.create_index([("user_id", 1), ("is_active", 1)])
-            
-            # Индексы для subscription_payments (платежи за подписки)
-            await cls.db.subscription_payments.create_index("payment_id", unique=True)
-            await cls.db.subscription_payments.create_index("user_id")
-            await cls.db.subscription_payments.create_index("status")
-            
-            # Индексы для bot_settings
-            await cls.db.bot_settings.create_index("setting_key", unique=True)
-            
-            logger.info("✅ Индексы созданы")
+            stats = await apply_index_manifest(cls.db)
+            logger.info(
+                f"✅ Индексы проверены: создано {stats['created']}, пересоздано {stats['rebuilt']}, "
+                f"удалено {stats['dropped']}, ошибок {stats['failed']}"
+            )
             
         except Exception as e:
             logger.warning(f"⚠️ Ошибка создания индексов: {e}")
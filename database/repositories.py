@@ -2,11 +2,24 @@
 Репозитории для работы с MongoDB
 """
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import AsyncIterator, Iterable, Optional, List, Dict
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 from .mongo_models import User, Payment, BotSettings
+from .counters import stats_counters
+
+# Размер пачки курсора для потокового чтения
+DEFAULT_BATCH_SIZE = 500
+
+
+def _projection(fields: Optional[Iterable[str]], required: Iterable[str]) -> Optional[dict]:
+    """Проекция из списка полей (обязательные для модели поля добавляются всегда)"""
+    if fields is None:
+        return None
+    return {field: 1 for field in (*required, *fields)}
 
 
 class UserRepository:
@@ -20,6 +33,7 @@ class UserRepository:
         data = user.to_dict()
         result = await self.collection.insert_one(data)
         user.id = result.inserted_id
+        await stats_counters.user_registered(user.created_at)
         return user
     
     async def get_by_telegram_id(self, telegram_id: int) -> Optional[User]:
@@ -37,30 +51,168 @@ class UserRepository:
         data = await self.collection.find_one({"username": username})
         return User.from_dict(data) if data else None
     
-    async def update_activity(self, telegram_id: int):
-        """Обновление времени последней активности"""
-        await self.collection.update_one(
-            {"telegram_id": telegram_id},
-            {"$set": {"last_activity": datetime.utcnow()}}
+    async def get_or_create(
+        self,
+        telegram_id: int,
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None
+    ) -> User:
+        """
+        Получение пользователя, с созданием при первом обращении
+        
+        Для существующего пользователя - одно чтение, без записи.
+        """
+        data = await self.collection.find_one({"telegram_id": telegram_id})
+        if data:
+            return User.from_dict(data)
+        
+        user = User(
+            telegram_id=telegram_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name
         )
+        try:
+            result = await self.collection.update_one(
+                {"telegram_id": telegram_id},
+                {"$setOnInsert": user.to_dict()},
+                upsert=True
+            )
+            if result.upserted_id is not None:
+                user.id = result.upserted_id
+                await stats_counters.user_registered(user.created_at)
+                return user
+        except DuplicateKeyError:
+            # Параллельный апдейт успел создать пользователя
+            pass
+        data = await self.collection.find_one({"telegram_id": telegram_id})
+        return User.from_dict(data)
+    
+    async def bulk_update_activity(self, activity: Dict[int, datetime]) -> None:
+        """
+        Обновление last_activity пачкой пользователей
+        
+        Args:
+            activity: telegram_id -> время активности
+        """
+        if not activity:
+            return
+        
+        # $max: запись из другого процесса с более поздним временем не откатится.
+        # Написавший боту пользователь снова получает рассылки (is_active).
+        operations = [
+            UpdateOne(
+                {"telegram_id": telegram_id},
+                {"$max": {"last_activity": timestamp}, "$set": {"is_active": True}}
+            )
+            for telegram_id, timestamp in activity.items()
+        ]
+        await self.collection.bulk_write(operations, ordered=False)
+    
+    async def update_activity(self, telegram_id: int):
+        """
+        Обновление времени последней активности
+        
+        Запись буферизуется и уходит в базу пачкой (см. ActivityTracker).
+        """
+        from .activity import activity_tracker
+        activity_tracker.touch(telegram_id)
+    
+    async def iter_users(
+        self,
+        query: Optional[dict] = None,
+        fields: Optional[Iterable[str]] = None,
+        sort: Optional[list] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[User]:
+        """
+        Потоковое чтение пользователей
+        
+        Документы приходят из курсора пачками по batch_size, полный список
+        в памяти не строится. С fields читаются только эти поля (и telegram_id),
+        остальные атрибуты модели получают значения по умолчанию.
+        """
+        cursor = self.collection.find(query or {}, _projection(fields, ("telegram_id",)))
+        if sort:
+            cursor = cursor.sort(sort)
+        async for data in cursor.batch_size(batch_size):
+            yield User.from_dict(data)
+    
+    def iter_all(
+        self,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[User]:
+        """Потоковое чтение всех пользователей"""
+        return self.iter_users(fields=fields, batch_size=batch_size)
     
     async def get_all(self) -> List[User]:
         """Получение всех пользователей"""
-        cursor = self.collection.find()
-        users = []
-        async for data in cursor:
-            users.append(User.from_dict(data))
-        return users
+        return [user async for user in self.iter_all()]
+    
+    async def get_telegram_ids(self, query: Optional[dict] = None) -> List[int]:
+        """
+        Только telegram_id пользователей (например, для рассылки)
+        
+        Без построения моделей: из базы читается одно поле.
+        """
+        cursor = self.collection.find(query or {}, {"_id": 0, "telegram_id": 1})
+        return [data["telegram_id"] async for data in cursor]
     
     async def count(self) -> int:
         """Подсчет всех пользователей"""
         return await self.collection.count_documents({})
     
     async def count_active_since(self, since: datetime) -> int:
-        """Подсчет активных пользователей с определенной даты"""
-        return await self.collection.count_documents({
+        """
+        Подсчет активных пользователей с определенной даты
+        
+        Учитывает отметки активности, еще не записанные в базу.
+        """
+        from .activity import activity_tracker
+        
+        count = await self.collection.count_documents({
             "last_activity": {"$gte": since}
         })
+        
+        pending = activity_tracker.pending_since(since)
+        if pending:
+            # Эти пользователи активны, но в базе у них еще старое время
+            count += await self.collection.count_documents({
+                "telegram_id": {"$in": pending},
+                "last_activity": {"$not": {"$gte": since}}
+            })
+        return count
+    
+    async def get_stats(self, since: datetime) -> Dict[str, int]:
+        """
+        Всего, активных и новых пользователей с since одной агрегацией
+        
+        Returns:
+            {total, active, new}
+        """
+        from .activity import activity_tracker
+        
+        active_match = {"last_activity": {"$gte": since}}
+        pending = activity_tracker.pending_since(since)
+        if pending:
+            # Активность этих пользователей еще не записана в базу
+            active_match = {"$or": [active_match, {"telegram_id": {"$in": pending}}]}
+        
+        result = await self.collection.aggregate([
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "active": [{"$match": active_match}, {"$count": "count"}],
+                "new": [{"$match": {"created_at": {"$gte": since}}}, {"$count": "count"}]
+            }}
+        ]).to_list(1)
+        
+        facets = result[0] if result else {}
+        return {
+            key: facets[key][0]["count"] if facets.get(key) else 0
+            for key in ("total", "active", "new")
+        }
     
     async def count_created_since(self, since: datetime) -> int:
         """Подсчет новых пользователей с определенной даты"""
@@ -68,14 +220,19 @@ class UserRepository:
             "created_at": {"$gte": since}
         })
     
+    def iter_inactive_users(
+        self,
+        days: int,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[User]:
+        """Потоковое чтение неактивных пользователей за N дней"""
+        threshold = datetime.utcnow() - timedelta(days=days)
+        return self.iter_users({"last_activity": {"$lt": threshold}}, fields=fields, batch_size=batch_size)
+    
     async def get_inactive_users(self, days: int) -> List[User]:
         """Получение неактивных пользователей за N дней"""
-        threshold = datetime.utcnow() - timedelta(days=days)
-        cursor = self.collection.find({"last_activity": {"$lt": threshold}})
-        users = []
-        async for data in cursor:
-            users.append(User.from_dict(data))
-        return users
+        return [user async for user in self.iter_inactive_users(days)]
     
     async def delete_by_telegram_id(self, telegram_id: int) -> bool:
         """Удаление пользователя по Telegram ID"""
@@ -120,14 +277,59 @@ class PaymentRepository:
             {"$set": updates}
         )
     
-    async def get_user_payments(self, user_id: ObjectId) -> List[Payment]:
-        """Получение всех платежей пользователя"""
-        cursor = self.collection.find({"user_id": user_id}).sort("created_at", -1)
+    async def mark_succeeded(self, payment_id: str, paid_at: Optional[datetime] = None) -> bool:
+        """
+        Атомарно перевести платеж в succeeded по YooKassa payment_id
+        
+        Returns:
+            True только для вызова, который действительно сменил статус
+            (вебхук, фоновая проверка и кнопка не обработают платеж дважды)
+        """
+        previous = await self.collection.find_one_and_update(
+            {"payment_id": payment_id, "status": {"$ne": "succeeded"}},
+            {"$set": {"status": "succeeded", "paid_at": paid_at or datetime.utcnow()}},
+            projection={"amount": 1, "created_at": 1}
+        )
+        if previous is None:
+            return False
+        
+        await stats_counters.payment_succeeded(previous.get("amount", 0), previous.get("created_at"))
+        return True
+    
+    async def get_user_payments(self, user_id: ObjectId, status: Optional[str] = None) -> List[Payment]:
+        """Получение платежей пользователя (всех или с указанным статусом)"""
+        query = {"user_id": user_id}
+        if status:
+            query["status"] = status
+        cursor = self.collection.find(query).sort("created_at", -1)
         payments = []
         async for data in cursor:
             payments.append(Payment.from_dict(data))
         return payments
     
+    async def get_succeeded_purchases(
+        self,
+        user_id: ObjectId,
+        product_types: List[str],
+        fields: tuple = ("product_type", "course_slug", "created_at", "paid_at")
+    ) -> List[dict]:
+        """
+        Успешные покупки пользователя, только нужные поля
+        
+        С полями по умолчанию запрос покрывается индексом
+        (user_id, status, product_type, course_slug, created_at, paid_at).
+        """
+        projection = {"_id": 0, **{field: 1 for field in fields}}
+        cursor = self.collection.find(
+            {
+                "user_id": user_id,
+                "status": "succeeded",
+                "product_type": {"$in": product_types}
+            },
+            projection
+        )
+        return await cursor.to_list(length=None)
+    
     async def count_by_status(self, status: str) -> int:
         """Подсчет платежей по статусу"""
         return await self.collection.count_documents({"status": status})
@@ -148,17 +350,68 @@ class PaymentRepository:
         result = await self.collection.aggregate(pipeline).to_list(1)
         return result[0]["total"] if result else 0.0
     
-    async def get_payments_since(self, since: datetime, status: Optional[str] = None) -> List[Payment]:
-        """Получение платежей с определенной даты"""
+    async def get_stats(self, since: datetime, status: str = "succeeded") -> Dict[str, float]:
+        """
+        Количество и сумма платежей всего и с since одной агрегацией
+        
+        Returns:
+            {total_count, total_amount, period_count, period_amount}
+        """
+        totals = {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}
+        result = await self.collection.aggregate([
+            {"$match": {"status": status}},
+            {"$facet": {
+                "total": [{"$group": totals}],
+                "period": [{"$match": {"created_at": {"$gte": since}}}, {"$group": totals}]
+            }}
+        ]).to_list(1)
+        
+        facets = result[0] if result else {}
+        total = facets["total"][0] if facets.get("total") else {}
+        period = facets["period"][0] if facets.get("period") else {}
+        return {
+            "total_count": total.get("count", 0),
+            "total_amount": total.get("amount", 0.0),
+            "period_count": period.get("count", 0),
+            "period_amount": period.get("amount", 0.0)
+        }
+    
+    async def iter_payments(
+        self,
+        query: Optional[dict] = None,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[Payment]:
+        """
+        Потоковое чтение платежей, новые сначала
+        
+        Документы приходят из курсора пачками по batch_size. С fields читаются
+        только эти поля (и user_id, amount), остальные атрибуты модели
+        получают значения по умолчанию.
+        """
+        cursor = self.collection.find(
+            query or {},
+            _projection(fields, ("user_id", "amount"))
+        ).sort("created_at", -1)
+        async for data in cursor.batch_size(batch_size):
+            yield Payment.from_dict(data)
+    
+    def iter_payments_since(
+        self,
+        since: datetime,
+        status: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[Payment]:
+        """Потоковое чтение платежей с определенной даты"""
         query = {"created_at": {"$gte": since}}
         if status:
             query["status"] = status
-        
-        cursor = self.collection.find(query).sort("created_at", -1)
-        payments = []
-        async for data in cursor:
-            payments.append(Payment.from_dict(data))
-        return payments
+        return self.iter_payments(query, fields=fields, batch_size=batch_size)
+    
+    async def get_payments_since(self, since: datetime, status: Optional[str] = None) -> List[Payment]:
+        """Получение платежей с определенной даты"""
+        return [payment async for payment in self.iter_payments_since(since, status)]
     
     async def count_since(self, since: datetime, status: Optional[str] = None) -> int:
         """Подсчет платежей с определенной даты"""
@@ -180,25 +433,37 @@ class PaymentRepository:
         result = await self.collection.aggregate(pipeline).to_list(1)
         return result[0]["total"] if result else 0.0
     
+    def iter_all(
+        self,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[Payment]:
+        """Потоковое чтение всех платежей"""
+        return self.iter_payments(fields=fields, batch_size=batch_size)
+    
     async def get_all(self) -> List[Payment]:
         """Получение всех платежей"""
-        cursor = self.collection.find().sort("created_at", -1)
-        payments = []
-        async for data in cursor:
-            payments.append(Payment.from_dict(data))
-        return payments
+        return [payment async for payment in self.iter_all()]
     
-    async def get_pending_since(self, since: datetime) -> List[dict]:
-        """Получение pending платежей с определенной даты (возвращает dict)"""
+    async def iter_pending_since(
+        self,
+        since: datetime,
+        fields: Optional[Iterable[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """Потоковое чтение pending платежей с определенной даты (dict)"""
         query = {
             "status": "pending",
             "created_at": {"$gte": since}
         }
-        cursor = self.collection.find(query).sort("created_at", -1)
-        payments = []
-        async for data in cursor:
-            payments.append(data)
-        return payments
+        projection = {field: 1 for field in fields} if fields is not None else None
+        cursor = self.collection.find(query, projection).sort("created_at", -1)
+        async for data in cursor.batch_size(batch_size):
+            yield data
+    
+    async def get_pending_since(self, since: datetime) -> List[dict]:
+        """Получение pending платежей с определенной даты (возвращает dict)"""
+        return [payment async for payment in self.iter_pending_since(since)]
 
 
 class BotSettingsRepository:
@@ -0,0 +1,143 @@
+"""
+Кэш настроек бота
+
+Коллекция bot_settings небольшая: она целиком загружается в память, и
+чтение настройки не обращается к базе. Запись (set/delete) идет в базу и
+сразу в кэш, а также увеличивает номер версии настроек (документ
+VERSION_KEY в той же коллекции).
+
+Другие процессы (учебный бот, дополнительные реплики) перезагружают
+кэш по change stream, а если он недоступен (MongoDB без replica set) -
+когда при опросе раз в poll_interval секунд меняется номер версии.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import config
+from .mongodb import mongodb
+from .repositories import BotSettingsRepository
+
+logger = logging.getLogger(__name__)
+
+# Документ с номером версии настроек (не настройка)
+VERSION_KEY = "__settings_version__"
+
+
+class SettingsCache:
+    """Настройки бота в памяти с инвалидацией между процессами"""
+
+    def __init__(self, poll_interval: float = 5.0):
+        """
+        Args:
+            poll_interval: Период опроса номера версии, секунд (без change stream)
+        """
+        self.poll_interval = poll_interval
+        self._values: Optional[Dict[str, Optional[str]]] = None
+        self._version = 0
+        self._load_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return mongodb.get_database().bot_settings
+
+    async def _read_version(self) -> int:
+        doc = await self.collection.find_one({"setting_key": VERSION_KEY}, {"version": 1})
+        return doc.get("version", 0) if doc else 0
+
+    async def load(self) -> None:
+        """Загрузить все настройки"""
+        # Версия читается первой: запись между чтениями даст лишнюю перезагрузку, а не пропуск
+        version = await self._read_version()
+        values = {}
+        async for doc in self.collection.find(
+            {"setting_key": {"$ne": VERSION_KEY}},
+            {"setting_key": 1, "setting_value": 1}
+        ):
+            values[doc["setting_key"]] = doc.get("setting_value")
+
+        self._values = values
+        self._version = version
+
+    async def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Значение настройки или default, если ее нет"""
+        if self._values is None:
+            async with self._load_lock:
+                if self._values is None:
+                    await self.load()
+        if key in self._values:
+            return self._values[key]
+        return default
+
+    async def _bump_version(self) -> None:
+        await self.collection.update_one(
+            {"setting_key": VERSION_KEY},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
+
+    async def set(self, key: str, value: Optional[str]) -> None:
+        """Записать настройку (в базу и в кэш)"""
+        await BotSettingsRepository(mongodb.get_database()).set(key, value)
+        if self._values is not None:
+            self._values[key] = value
+        await self._bump_version()
+
+    async def delete(self, key: str) -> None:
+        """Удалить настройку (из базы и из кэша)"""
+        await BotSettingsRepository(mongodb.get_database()).delete(key)
+        if self._values is not None:
+            self._values.pop(key, None)
+        await self._bump_version()
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self._read_version() != self._version:
+                    await self.load()
+            except Exception as e:
+                logger.warning(f"Error refreshing settings cache: {e}")
+
+    async def _watch(self) -> None:
+        try:
+            async with self.collection.watch() as stream:
+                # Изменения между первой загрузкой и открытием потока
+                await self.load()
+                logger.info("Settings cache follows bot_settings change stream")
+                async for _ in stream:
+                    await self.load()
+        except OperationFailure as e:
+            logger.info(f"Change streams unavailable ({e}), polling settings version every {self.poll_interval}s")
+        except PyMongoError as e:
+            logger.warning(f"Settings change stream stopped ({e}), polling settings version every {self.poll_interval}s")
+
+        await self._poll()
+
+    async def start(self) -> None:
+        """Загрузить настройки и следить за изменениями"""
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            await self.load()
+            logger.info(f"Settings cache loaded: {len(self._values)} settings")
+        except Exception as e:
+            # Загрузятся при первом чтении
+            logger.error(f"Error loading settings cache: {e}")
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Глобальный экземпляр
+settings_cache = SettingsCache(poll_interval=config.SETTINGS_POLL_INTERVAL)
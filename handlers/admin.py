@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
@@ -7,9 +7,7 @@ from aiogram.fsm.state import State, StatesGroup
 from bson import ObjectId
 import os
 import logging
-from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+import tempfile
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +24,15 @@ Lesson = None  # type: ignore
 
 router = Router()
 
+# Сервис рассылок (будет инициализирован в bot.py)
+broadcast_service = None
+
+
+def init_broadcast_service(service):
+    """Инициализация сервиса рассылок"""
+    global broadcast_service
+    broadcast_service = service
+
 
 class CourseManagement(StatesGroup):
     """Состояния для управления курсами"""
@@ -136,25 +143,19 @@ async def show_stats(callback: CallbackQuery):
         await callback.answer("❌ Доступ запрещен", show_alert=True)
         return
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
-    # Общая статистика
-    total_users = await user_repo.count()
-    total_purchases = await payment_repo.count_by_status("succeeded")
-    total_revenue = await payment_repo.sum_by_status("succeeded")
-    
-    # Активные пользователи (за последние 7 дней)
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    active_users = await user_repo.count_active_since(week_ago)
+    # Пользователи, покупки и подписки (кэш на несколько секунд, общий для админов)
+    from services.stats_service import stats_service
+    from handlers.subscription_handlers import subscription_service
     
-    # Новые пользователи за неделю
-    new_users = await user_repo.count_created_since(week_ago)
-    
-    # Покупки за неделю
-    week_purchases = await payment_repo.count_since(week_ago, "succeeded")
-    week_revenue = await payment_repo.sum_since(week_ago, "succeeded")
+    stats = await stats_service.get_dashboard_stats(subscription_service)
+    total_users = stats["total_users"]
+    active_users = stats["active_users"]
+    new_users = stats["new_users"]
+    total_purchases = stats["total_purchases"]
+    total_revenue = stats["total_revenue"]
+    week_purchases = stats["week_purchases"]
+    week_revenue = stats["week_revenue"]
+    subscription_stats = stats["subscriptions"]
     
     # Курсы, консультации и гайды (из JSON)
     total_courses = len(get_all_courses())
@@ -163,15 +164,6 @@ async def show_stats(callback: CallbackQuery):
     from data import get_all_guides
     total_guides = len(get_all_guides())
     
-    # Статистика подписок (если сервис доступен)
-    subscription_stats = None
-    try:
-        from handlers.subscription_handlers import subscription_service
-        if subscription_service:
-            subscription_stats = await subscription_service.get_subscription_stats()
-    except Exception as e:
-        logger.warning(f"Could not get subscription stats: {e}")
-    
     stats_text = f"""📊 <b>Статистика</b>
 
 👥 <b>Пользователи:</b>
@@ -253,32 +245,12 @@ async def broadcast_message(message: Message):
         )
         return
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    
-    # Получаем всех пользователей
-    users = await user_repo.get_all()
-    
-    success_count = 0
-    fail_count = 0
-    
-    status_msg = await message.answer(f"📤 Начинаю рассылку для {len(users)} пользователей...")
+    if not broadcast_service:
+        await message.answer("❌ Сервис рассылок не инициализирован")
+        return
     
-    for user in users:
-        try:
-            await message.bot.send_message(
-                chat_id=user.telegram_id,
-                text=text
-            )
-            success_count += 1
-        except Exception:
-            fail_count += 1
-    
-    await status_msg.edit_text(
-        f"✅ Рассылка завершена!\n\n"
-        f"Успешно: {success_count}\n"
-        f"Ошибок: {fail_count}"
-    )
+    # Рассылка идет в фоне, прогресс обновляется в отдельном сообщении
+    await broadcast_service.start({"media_type": "text", "text": text}, admin_chat_id=message.chat.id)
 
 
 # ===== Универсальный обработчик рассылки =====
@@ -359,57 +331,30 @@ async def confirm_and_send_broadcast(callback: CallbackQuery, state: FSMContext)
         await callback.answer("❌ Доступ запрещен", show_alert=True)
         return
     
-    data = await state.get_data()
-    media_type = data.get("media_type")
+    if not broadcast_service:
+        await callback.answer("❌ Сервис рассылок не инициализирован", show_alert=True)
+        return
     
-    db = await get_db()
-    user_repo = UserRepository(db)
+    data = await state.get_data()
+    # Очищаем состояние сразу: повторное нажатие не запустит вторую рассылку
+    await state.clear()
     
-    users = await user_repo.get_all()
+    if not data.get("media_type"):
+        await callback.answer("Рассылка уже запущена или отменена")
+        return
     
-    success_count = 0
-    fail_count = 0
+    content = {
+        key: data.get(key)
+        for key in ("media_type", "text", "photo_id", "video_id", "caption")
+    }
     
-    # Удаляем превью и отправляем новое сообщение о начале рассылки
+    # Удаляем превью, рассылка идет в фоне с сообщением о прогрессе
     try:
         await callback.message.delete()
     except:
         pass
     
-    status_msg = await callback.bot.send_message(
-        chat_id=callback.from_user.id,
-        text=f"📤 Начинаю рассылку для {len(users)} пользователей..."
-    )
-    
-    for user in users:
-        try:
-            if media_type == "text":
-                await callback.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=data["text"]
-                )
-            elif media_type == "photo":
-                await callback.bot.send_photo(
-                    chat_id=user.telegram_id,
-                    photo=data["photo_id"],
-                    caption=data.get("caption")
-                )
-            elif media_type == "video":
-                await callback.bot.send_video(
-                    chat_id=user.telegram_id,
-                    video=data["video_id"],
-                    caption=data.get("caption")
-                )
-            
-            success_count += 1
-        except Exception:
-            fail_count += 1
-    
-    await status_msg.edit_text(
-        f"✅ Рассылка завершена!\n\n"
-        f"Успешно: {success_count}\n"
-        f"Ошибок: {fail_count}"
-    )
+    await broadcast_service.start(content, admin_chat_id=callback.from_user.id)
     
     await callback.bot.send_message(
         chat_id=callback.from_user.id,
@@ -417,10 +362,27 @@ async def confirm_and_send_broadcast(callback: CallbackQuery, state: FSMContext)
         reply_markup=get_admin_keyboard()
     )
     
-    await state.clear()
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("broadcast_cancel_"))
+async def cancel_running_broadcast(callback: CallbackQuery):
+    """Остановка идущей рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Доступ запрещен", show_alert=True)
+        return
+    
+    if not broadcast_service:
+        await callback.answer("❌ Сервис рассылок не инициализирован", show_alert=True)
+        return
+    
+    broadcast_id = callback.data.replace("broadcast_cancel_", "")
+    if await broadcast_service.cancel(broadcast_id):
+        await callback.answer("⏹ Рассылка будет остановлена в течение нескольких секунд")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+
 @router.callback_query(F.data == "admin_courses")
 async def show_courses_management(callback: CallbackQuery):
     """Показать управление курсами"""
@@ -462,7 +424,7 @@ async def show_courses_management(callback: CallbackQuery):
         
         await callback.message.edit_text(
             "📚 <b>Управление курсами</b>\n\n"
-            "Просмотр курсов. Для редактирования используйте файлы data/courses.json и data/course_materials.json",
+            "Просмотр курсов. Для редактирования курсов используйте файл data/courses.json, модули и уроки редактируются здесь",
             reply_markup=keyboard
         )
     
@@ -645,7 +607,7 @@ async def manage_course(callback: CallbackQuery):
     # Извлекаем slug курса
     course_slug = "_".join(callback.data.split("_")[2:])
     
-    from data import get_course_by_slug, get_course_materials
+    from data import get_course_by_slug, get_course_modules
     
     course = get_course_by_slug(course_slug)
     
@@ -653,9 +615,8 @@ async def manage_course(callback: CallbackQuery):
         await callback.answer("Курс не найден", show_alert=True)
         return
     
-    # Получаем материалы курса
-    materials = get_course_materials(course_slug)
-    modules = materials.get('modules', []) if materials else []
+    # Получаем модули курса (уроки для списка не нужны)
+    modules = await get_course_modules(course_slug)
     
     text = f"📖 <b>{course['name']}</b>\n\n"
     text += f"📍 Slug: <code>{course['slug']}</code>\n"
@@ -711,7 +672,7 @@ async def view_modules(callback: CallbackQuery):
         await callback.answer("Курс не найден", show_alert=True)
         return
     
-    modules = get_course_modules(course_slug)
+    modules = await get_course_modules(course_slug)
     
     text = f"📂 <b>Модули курса: {course['name']}</b>\n\n"
     
@@ -752,7 +713,7 @@ async def view_module(callback: CallbackQuery):
     from data import get_course_by_slug, get_module_by_id
     
     course = get_course_by_slug(course_slug)
-    module = get_module_by_id(course_slug, module_id)
+    module = await get_module_by_id(course_slug, module_id)
     
     if not course or not module:
         await callback.answer("Модуль не найден", show_alert=True)
@@ -952,23 +913,16 @@ async def save_new_module(message: Message, state: FSMContext):
     data = await state.get_data()
     course_slug = data['course_slug']
     
-    from data import add_module_to_course, get_course_modules
-    import uuid
-    
-    # Генерируем ID
-    modules = get_course_modules(course_slug)
-    module_order = len(modules) + 1
+    from data import add_module_to_course
     
+    # ID и порядковый номер назначаются при сохранении
     new_module = {
-        'id': f"module-{module_order}",
         'title': data.get('module_title', 'Новый модуль'),
         'description': data.get('module_description', ''),
-        'order': module_order,
-        'lessons': []
     }
     
     try:
-        add_module_to_course(course_slug, new_module)
+        new_module = await add_module_to_course(course_slug, new_module)
         
         await message.answer(
             f"✅ <b>Модуль успешно добавлен!</b>\n\n"
@@ -1132,18 +1086,14 @@ async def save_new_lesson_to_module(message: Message, state: FSMContext):
     
     from data import add_lesson_to_module, get_module_by_id
     
-    # Получаем модуль чтобы определить порядок урока
-    module = get_module_by_id(course_slug, module_id)
+    module = await get_module_by_id(course_slug, module_id, with_lessons=False)
     if not module:
         await message.answer("❌ Модуль не найден")
         await state.clear()
         return
     
-    lessons_count = len(module.get('lessons', []))
-    lesson_order = lessons_count + 1
-    
+    # ID и порядковый номер урока назначаются при сохранении
     new_lesson = {
-        'id': f"lesson-{module_id}-{lesson_order}",
         'title': data.get('lesson_title', 'Новый урок'),
         'description': data.get('lesson_description', ''),
         'duration': '',
@@ -1151,14 +1101,13 @@ async def save_new_lesson_to_module(message: Message, state: FSMContext):
         'video_url': data.get('video_url', ''),
         'lecture_file_id': data.get('lecture_file_id', ''),
         'text_content': data.get('text_content', ''),
-        'order': lesson_order,
         'materials': []
     }
     
     try:
-        success = add_lesson_to_module(course_slug, module_id, new_lesson)
+        saved_lesson = await add_lesson_to_module(course_slug, module_id, new_lesson)
         
-        if success:
+        if saved_lesson:
             # Формируем информацию о добавленном контенте
             content_info = []
             if new_lesson['video_url']:
@@ -1262,7 +1211,7 @@ async def edit_lesson_menu(callback: CallbackQuery):
     
     from data import get_lesson_by_id
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
+    lesson = await get_lesson_by_id(course_slug, module_id, lesson_id)
     
     if not lesson:
         await callback.answer("Урок не найден", show_alert=True)
@@ -1424,10 +1373,9 @@ async def remove_json_lesson_lecture(callback: CallbackQuery, state: FSMContext)
     
     from data import get_lesson_by_id, update_lesson
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
+    lesson = await get_lesson_by_id(course_slug, module_id, lesson_id)
     if lesson:
-        lesson['lecture_file_id'] = ""
-        update_lesson(course_slug, module_id, lesson_id, lesson)
+        await update_lesson(course_slug, module_id, lesson_id, {'lecture_file_id': ""})
         
         await callback.answer("✅ PDF лекция удалена", show_alert=True)
         await state.clear()
@@ -1501,7 +1449,7 @@ async def delete_json_lesson_confirm(callback: CallbackQuery):
     
     from data import get_lesson_by_id
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
+    lesson = await get_lesson_by_id(course_slug, module_id, lesson_id)
     
     if not lesson:
         await callback.answer("❌ Урок не найден", show_alert=True)
@@ -1536,7 +1484,7 @@ async def delete_json_lesson_execute(callback: CallbackQuery):
     
     from data import delete_lesson
     
-    success = delete_lesson(course_slug, module_id, lesson_id)
+    success = await delete_lesson(course_slug, module_id, lesson_id)
     
     if success:
         await callback.answer("✅ Урок удален", show_alert=True)
@@ -1544,7 +1492,7 @@ async def delete_json_lesson_execute(callback: CallbackQuery):
         # Возвращаемся к модулю - показываем его заново
         from data import get_module_by_id, get_course_by_slug
         
-        module = get_module_by_id(course_slug, module_id)
+        module = await get_module_by_id(course_slug, module_id)
         course = get_course_by_slug(course_slug)
         
         if not module or not course:
@@ -1608,12 +1556,9 @@ async def save_json_lesson_title(message: Message, state: FSMContext):
     module_id = data['module_id']
     lesson_id = data['lesson_id']
     
-    from data import get_lesson_by_id, update_lesson
+    from data import update_lesson
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
-    if lesson:
-        lesson['title'] = message.text.strip()
-        update_lesson(course_slug, module_id, lesson_id, lesson)
+    if await update_lesson(course_slug, module_id, lesson_id, {'title': message.text.strip()}):
         
         await message.answer(
             f"✅ Название урока обновлено!",
@@ -1638,12 +1583,9 @@ async def save_json_lesson_description(message: Message, state: FSMContext):
     module_id = data['module_id']
     lesson_id = data['lesson_id']
     
-    from data import get_lesson_by_id, update_lesson
+    from data import update_lesson
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
-    if lesson:
-        lesson['description'] = message.text.strip()
-        update_lesson(course_slug, module_id, lesson_id, lesson)
+    if await update_lesson(course_slug, module_id, lesson_id, {'description': message.text.strip()}):
         
         await message.answer(
             f"✅ Описание урока обновлено!",
@@ -1668,13 +1610,10 @@ async def save_json_lesson_video(message: Message, state: FSMContext):
     module_id = data['module_id']
     lesson_id = data['lesson_id']
     
-    from data import get_lesson_by_id, update_lesson
+    from data import update_lesson
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
-    if lesson:
-        video_url = message.text.strip()
-        lesson['video_url'] = "" if video_url == "-" else video_url
-        update_lesson(course_slug, module_id, lesson_id, lesson)
+    video_url = message.text.strip()
+    if await update_lesson(course_slug, module_id, lesson_id, {'video_url': "" if video_url == "-" else video_url}):
         
         if video_url == "-":
             msg = "✅ Видео удалено из урока!"
@@ -1720,12 +1659,9 @@ async def save_json_lesson_lecture(message: Message, state: FSMContext):
         module_id = data['module_id']
         lesson_id = data['lesson_id']
         
-        from data import get_lesson_by_id, update_lesson
+        from data import update_lesson
         
-        lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
-        if lesson:
-            lesson['lecture_file_id'] = message.document.file_id
-            update_lesson(course_slug, module_id, lesson_id, lesson)
+        if await update_lesson(course_slug, module_id, lesson_id, {'lecture_file_id': message.document.file_id}):
             
             await message.answer(
                 "✅ PDF лекция обновлена!",
@@ -1756,13 +1692,10 @@ async def save_json_lesson_text(message: Message, state: FSMContext):
     module_id = data['module_id']
     lesson_id = data['lesson_id']
     
-    from data import get_lesson_by_id, update_lesson
+    from data import update_lesson
     
-    lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
-    if lesson:
-        text_content = message.text.strip()
-        lesson['text_content'] = "" if text_content == "-" else text_content
-        update_lesson(course_slug, module_id, lesson_id, lesson)
+    text_content = message.text.strip()
+    if await update_lesson(course_slug, module_id, lesson_id, {'text_content': "" if text_content == "-" else text_content}):
         
         if text_content == "-":
             msg = "✅ Текстовое содержание удалено из урока!"
@@ -2117,185 +2050,16 @@ async def download_analytics(callback: CallbackQuery):
     
     await callback.answer("⏳ Генерирую файл...")
     
-    db: Session = get_db()
+    from services.analytics_export import AnalyticsExporter
+    
+    # Генерируем имя файла с датой
+    filename = f"analytics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
     
     try:
-        # Импортируем функции для работы с данными
-        from data import get_all_guides
-        
-        # Создаем Excel файл
-        wb = Workbook()
-        
-        # Лист 1: Общая статистика
-        ws_stats = wb.active
-        ws_stats.title = "Общая статистика"
-        
-        # Заголовки
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        
-        ws_stats['A1'] = 'Общая статистика бота'
-        ws_stats['A1'].font = Font(bold=True, size=14)
-        ws_stats.merge_cells('A1:B1')
-        
-        row = 3
-        ws_stats[f'A{row}'] = 'Показатель'
-        ws_stats[f'B{row}'] = 'Значение'
-        ws_stats[f'A{row}'].fill = header_fill
-        ws_stats[f'B{row}'].fill = header_fill
-        ws_stats[f'A{row}'].font = header_font
-        ws_stats[f'B{row}'].font = header_font
-        
-        # Данные
-        total_users = db.query(User).count()
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        month_ago = datetime.utcnow() - timedelta(days=30)
-        
-        active_week = db.query(User).filter(User.last_activity >= week_ago).count()
-        active_month = db.query(User).filter(User.last_activity >= month_ago).count()
-        new_week = db.query(User).filter(User.created_at >= week_ago).count()
-        new_month = db.query(User).filter(User.created_at >= month_ago).count()
-        
-        total_payments = db.query(Payment).filter(Payment.status == 'succeeded').count()
-        total_revenue = db.query(func.sum(Payment.amount)).filter(Payment.status == 'succeeded').scalar() or 0
-        week_payments = db.query(Payment).filter(
-            Payment.status == 'succeeded',
-            Payment.created_at >= week_ago
-        ).count()
-        week_revenue = db.query(func.sum(Payment.amount)).filter(
-            Payment.status == 'succeeded',
-            Payment.created_at >= week_ago
-        ).scalar() or 0
-        month_payments = db.query(Payment).filter(
-            Payment.status == 'succeeded',
-            Payment.created_at >= month_ago
-        ).count()
-        month_revenue = db.query(func.sum(Payment.amount)).filter(
-            Payment.status == 'succeeded',
-            Payment.created_at >= month_ago
-        ).scalar() or 0
-        
-        stats_data = [
-            ('ПОЛЬЗОВАТЕЛИ', ''),
-            ('Всего пользователей', total_users),
-            ('Активных за неделю', active_week),
-            ('Активных за месяц', active_month),
-            ('Новых за неделю', new_week),
-            ('Новых за месяц', new_month),
-            ('', ''),
-            ('ФИНАНСЫ', ''),
-            ('Всего покупок', total_payments),
-            ('Общая выручка, ₽', f'{total_revenue:,.2f}'),
-            ('Покупок за неделю', week_payments),
-            ('Выручка за неделю, ₽', f'{week_revenue:,.2f}'),
-            ('Покупок за месяц', month_payments),
-            ('Выручка за месяц, ₽', f'{month_revenue:,.2f}'),
-            ('', ''),
-            ('КОНТЕНТ', ''),
-            ('Курсов', len(get_all_courses())),
-            ('Консультаций', len(get_all_consultations())),
-            ('Гайдов', len(get_all_guides())),
-        ]
-        
-        row = 4
-        for label, value in stats_data:
-            ws_stats[f'A{row}'] = label
-            ws_stats[f'B{row}'] = value
-            if label and not value:
-                ws_stats[f'A{row}'].font = Font(bold=True)
-            row += 1
-        
-        # Автоширина колонок
-        ws_stats.column_dimensions['A'].width = 30
-        ws_stats.column_dimensions['B'].width = 20
-        
-        # Лист 2: Пользователи
-        ws_users = wb.create_sheet("Пользователи")
-        
-        headers = ['ID', 'Telegram ID', 'Username', 'Имя', 'Фамилия', 'Дата регистрации', 'Последняя активность', 'Покупок']
-        for col, header in enumerate(headers, 1):
-            cell = ws_users.cell(1, col, header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-        
-        users = db.query(User).order_by(User.created_at.desc()).all()
-        
-        for row, user in enumerate(users, 2):
-            payments_count = db.query(Payment).filter(
-                Payment.user_id == user.id,
-                Payment.status == 'succeeded'
-            ).count()
-            
-            ws_users.cell(row, 1, user.id)
-            ws_users.cell(row, 2, user.telegram_id)
-            ws_users.cell(row, 3, user.username or '-')
-            ws_users.cell(row, 4, user.first_name or '-')
-            ws_users.cell(row, 5, user.last_name or '-')
-            ws_users.cell(row, 6, user.created_at.strftime('%d.%m.%Y %H:%M'))
-            ws_users.cell(row, 7, user.last_activity.strftime('%d.%m.%Y %H:%M') if user.last_activity else '-')
-            ws_users.cell(row, 8, payments_count)
-        
-        # Автоширина
-        for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-            ws_users.column_dimensions[col].width = 15
-        
-        # Лист 3: Покупки
-        ws_payments = wb.create_sheet("Покупки")
-        
-        headers = ['ID', 'Пользователь', 'Продукт', 'Сумма, ₽', 'Статус', 'Дата создания', 'Дата оплаты']
-        for col, header in enumerate(headers, 1):
-            cell = ws_payments.cell(1, col, header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-        
-        payments = db.query(Payment).order_by(Payment.created_at.desc()).all()
-        
-        for row, payment in enumerate(payments, 2):
-            user = payment.user
-            username = user.username if user.username else f"{user.first_name or 'Пользователь'}"
-            
-            product_name = '-'
-            # Определяем тип продукта и название из новой структуры
-            from data import get_course_by_slug, get_consultation_by_slug, get_guide_by_id
-            
-            if payment.product_type == 'course' and payment.course_slug:
-                course = get_course_by_slug(payment.course_slug)
-                product_name = f"Курс: {course['name']}" if course else "Курс"
-            elif payment.product_type == 'consultation' and payment.consultation_slug:
-                consultation = get_consultation_by_slug(payment.consultation_slug)
-                product_name = f"Консультация: {consultation['name']}" if consultation else "Консультация"
-            elif payment.product_type == 'guide' and payment.product_id:
-                guide = get_guide_by_id(payment.product_id)
-                product_name = f"Гайд: {guide['name']}" if guide else "Гайд"
-            else:
-                product_name = payment.product_type or "Неизвестно"
-            
-            ws_payments.cell(row, 1, payment.id)
-            ws_payments.cell(row, 2, username)
-            ws_payments.cell(row, 3, product_name)
-            ws_payments.cell(row, 4, payment.amount)
-            ws_payments.cell(row, 5, payment.status)
-            ws_payments.cell(row, 6, payment.created_at.strftime('%d.%m.%Y %H:%M'))
-            ws_payments.cell(row, 7, payment.paid_at.strftime('%d.%m.%Y %H:%M') if payment.paid_at else '-')
-        
-        # Автоширина
-        for col, width in zip(['A', 'B', 'C', 'D', 'E', 'F', 'G'], [8, 20, 30, 12, 12, 18, 18]):
-            ws_payments.column_dimensions[col].width = width
-        
-        # Сохраняем в буфер
-        buffer = BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
-        
-        # Генерируем имя файла с датой
-        filename = f"analytics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        # Сохраняем временно
-        temp_path = f"/tmp/{filename}"
-        with open(temp_path, 'wb') as f:
-            f.write(buffer.getvalue())
+        db = await get_db()
+        await AnalyticsExporter(db).export(temp_path)
         
         # Отправляем файл
         await callback.message.answer_document(
@@ -2306,17 +2070,14 @@ async def download_analytics(callback: CallbackQuery):
                    "• Список всех пользователей\n"
                    "• Все покупки"
         )
-        
-        # Удаляем временный файл
-        os.remove(temp_path)
-        
-        await callback.answer("✅ Файл отправлен!")
     
     except Exception as e:
-        await callback.answer(f"Ошибка при генерации: {str(e)}", show_alert=True)
+        logger.error(f"Error generating analytics: {e}", exc_info=True)
+        await callback.message.answer(f"❌ Ошибка при генерации: {str(e)}")
     
     finally:
-        db.close()
+        # Удаляем временный файл
+        os.remove(temp_path)
 
 
 @router.callback_query(F.data == "admin_consultations")
@@ -2830,7 +2591,7 @@ async def process_amount(message: Message, state: FSMContext):
 
 async def create_payment_link(message: Message, state: FSMContext):
     """Создание платежной ссылки и платежа в БД"""
-    from payments import YooKassaPayment
+    from payments import AsyncYooKassaPayment
     
     data = await state.get_data()
     
@@ -2879,12 +2640,12 @@ async def create_payment_link(message: Message, state: FSMContext):
         payment = await payment_repo.create(payment)
         
         # Создаем платеж в YooKassa
-        yookassa = YooKassaPayment()
+        yookassa = AsyncYooKassaPayment()
         
         bot_info = await message.bot.get_me()
         return_url = f"https://t.me/{bot_info.username}" if bot_info.username else "https://t.me"
         
-        payment_result = yookassa.create_payment(
+        payment_result = await yookassa.create_payment(
             amount=amount,
             description=description,
             return_url=return_url,
@@ -1,9 +1,10 @@
 import logging
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from bson import ObjectId
 
-from database import get_db, UserRepository, PaymentRepository
+from database import get_db, User, PaymentRepository
 from keyboards import get_back_keyboard
 from data import (
     get_course_by_slug, 
@@ -18,25 +19,21 @@ router = Router()
 
 
 @router.callback_query(F.data == "my_cabinet")
-async def show_my_cabinet(callback: CallbackQuery):
+async def show_my_cabinet(callback: CallbackQuery, user: Optional[User] = None):
     """Показать личный кабинет - статистика покупок"""
     from config import config as bot_config
     from database.mongodb import mongodb
     
     db = await get_db()
-    user_repo = UserRepository(db)
     payment_repo = PaymentRepository(db)
     
     try:
-        # Обновляем активность
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        if user:
-            await user_repo.update_activity(callback.from_user.id)
+        if not user:
+            await callback.answer("Ошибка: пользователь не найден", show_alert=True)
+            return
         
-        # Проверяем платежи
-        payments = await payment_repo.get_user_payments(user.id)
-        # Фильтруем только успешные платежи
-        payments = [p for p in payments if p.status == 'succeeded']
+        # Только успешные платежи
+        payments = await payment_repo.get_user_payments(user.id, status='succeeded')
         
         # Считаем статистику
         courses_count = len([p for p in payments if p.product_type in ['course', 'mini_course']])
@@ -167,10 +164,10 @@ async def show_my_cabinet(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "my_courses")
-async def show_my_courses(callback: CallbackQuery):
+async def show_my_courses(callback: CallbackQuery, user: Optional[User] = None):
     """Перенаправление на личный кабинет (для совместимости)"""
     # Перенаправляем на my_cabinet
-    await show_my_cabinet(callback)
+    await show_my_cabinet(callback, user)
 
 
 @router.callback_query(F.data == "manage_subscription")
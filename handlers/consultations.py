@@ -2,7 +2,6 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.exceptions import TelegramBadRequest
 
-from database import get_db, UserRepository
 from data import get_active_consultations, get_consultation_by_slug, get_consultation_option
 from keyboards import (
     get_consultations_keyboard,
@@ -17,12 +16,6 @@ router = Router()
 @router.callback_query(F.data == "consultations")
 async def show_consultations_catalog(callback: CallbackQuery):
     """Показать каталог консультаций"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    
-    # Обновляем активность
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Получаем активные консультации из JSON
     consultations = get_active_consultations()
     
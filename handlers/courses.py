@@ -2,7 +2,6 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.exceptions import TelegramBadRequest
 
-from database import get_db, UserRepository
 from data import get_active_courses, get_course_by_slug, get_tariff_by_id, get_course_modules
 from keyboards import (
     get_courses_keyboard,
@@ -16,11 +15,6 @@ router = Router()
 @router.callback_query(F.data == "courses")
 async def show_courses_catalog(callback: CallbackQuery):
     """Показать каталог курсов"""
-    # Обновляем активность пользователя
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     text = "📚 **Каталог курсов**\n\nВыберите интересующий вас курс:"
     
     # Создаем кнопки с бесплатным курсом первым
@@ -237,10 +231,6 @@ async def show_course_detail(callback: CallbackQuery):
 @router.callback_query(F.data == "free_natal_chart")
 async def show_free_natal_chart_block(callback: CallbackQuery):
     """Показать бесплатный блок 'Как построить свою натальную карту' - Урок 1"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить кастомный текст из БД
     from utils.bot_settings import get_setting
     custom_text = await get_setting("free_course_step1_text")
@@ -290,10 +280,6 @@ async def show_free_natal_chart_block(callback: CallbackQuery):
 @router.callback_query(F.data == "free_natal_chart_step_2")
 async def show_free_natal_chart_step_2(callback: CallbackQuery):
     """Показать бесплатный блок - Урок 2"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить кастомный текст из БД
     from utils.bot_settings import get_setting
     custom_text = await get_setting("free_course_step2_text")
@@ -339,10 +325,6 @@ async def show_free_natal_chart_step_2(callback: CallbackQuery):
 @router.callback_query(F.data == "free_natal_chart_step_3")
 async def show_free_natal_chart_step_3(callback: CallbackQuery):
     """Показать бесплатный блок - Урок 3: Инструкция по Sotis Online"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить кастомный текст из БД
     from utils.bot_settings import get_setting
     custom_text = await get_setting("free_course_step3_text")
@@ -491,10 +473,6 @@ async def show_free_natal_chart_step_3(callback: CallbackQuery):
 @router.callback_query(F.data == "free_natal_chart_step_4")
 async def show_free_natal_chart_step_4(callback: CallbackQuery):
     """Показать бесплатный блок - Шаг 4: Текст + несколько фото"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить кастомный текст из БД
     from utils.bot_settings import get_setting
     custom_text = await get_setting("free_course_step4_text")
@@ -598,10 +576,6 @@ async def show_free_natal_chart_step_4(callback: CallbackQuery):
 @router.callback_query(F.data == "free_natal_chart_step_5")
 async def show_free_natal_chart_step_5(callback: CallbackQuery):
     """Показать бесплатный блок - Шаг 5: Текст + одно фото"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить кастомный текст из БД
     from utils.bot_settings import get_setting
     custom_text = await get_setting("free_course_step5_text")
@@ -666,10 +640,6 @@ async def show_free_natal_chart_step_5(callback: CallbackQuery):
 @router.callback_query(F.data == "natal_chart_done")
 async def natal_chart_done(callback: CallbackQuery):
     """Обработчик кнопки 'Получилось' - показываем три пути"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Пытаемся получить текст из БД
     from utils.bot_settings import get_setting
     
@@ -3,11 +3,13 @@
 """
 import logging
 from datetime import datetime, timedelta
+from typing import Optional
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
-from database import get_db, UserRepository, PaymentRepository
+from database import User
+from services.entitlement_service import entitlement_service
 from data import (
     get_course_by_slug,
     get_course_modules,
@@ -21,31 +23,15 @@ learning_router = Router()
 
 
 @learning_router.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, user: Optional[User] = None):
     """Стартовое сообщение учебного бота"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
-    # Создаем или обновляем пользователя
-    user = await user_repo.get_by_telegram_id(message.from_user.id)
-    
+    # Пользователь создается в UserContextMiddleware
     if not user:
-        from database import User
-        user = User(
-            telegram_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-            last_name=message.from_user.last_name
-        )
-        user = await user_repo.create(user)
-        logger.info(f"New user created in learning bot: {user.telegram_id}")
-    else:
-        await user_repo.update_activity(message.from_user.id)
+        await message.answer("❌ Произошла ошибка. Попробуйте позже.")
+        return
     
     # Проверяем купленные курсы
-    payments = await payment_repo.get_user_payments(user.id)
-    purchased_courses = [p for p in payments if p.status == 'succeeded' and p.product_type in ['course', 'mini_course']]
+    purchased_courses = await entitlement_service.list_entitlements(user.id)
     
     if not purchased_courses:
         text = "🎓 <b>Учебный бот</b>\n\n"
@@ -90,24 +76,15 @@ async def cmd_start(message: Message):
 
 
 @learning_router.callback_query(F.data == "my_courses")
-async def show_my_courses(callback: CallbackQuery):
+async def show_my_courses(callback: CallbackQuery, user: Optional[User] = None):
     """Показать список купленных курсов"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        if user:
-            await user_repo.update_activity(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
         # Получаем купленные курсы
-        payments = await payment_repo.get_user_payments(user.id)
-        purchased_courses = [p for p in payments if p.status == 'succeeded' and p.product_type in ['course', 'mini_course']]
+        purchased_courses = await entitlement_service.list_entitlements(user.id)
         
         if not purchased_courses:
             text = "📚 У вас пока нет купленных курсов.\n\n"
@@ -164,25 +141,18 @@ async def show_my_courses(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("my_course_"))
-async def show_my_course(callback: CallbackQuery):
+async def show_my_course(callback: CallbackQuery, user: Optional[User] = None):
     """Показать купленный курс с материалами"""
     course_slug = callback.data.replace("my_course_", "")
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
         # Проверяем, что пользователь купил этот курс
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
         # Проверяем наличие успешного платежа за курс
-        payments = await payment_repo.get_user_payments(user.id)
-        payment = next((p for p in payments if p.course_slug == course_slug and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+        payment = await entitlement_service.get_entitlement(user.id, course_slug)
         
         if not payment:
             await callback.answer("У вас нет доступа к этому курсу", show_alert=True)
@@ -292,7 +262,7 @@ async def show_my_course(callback: CallbackQuery):
         
         text += "\n✅ <b>У вас есть доступ к материалам курса</b>\n\n"
         
-        modules = get_course_modules(course_slug)
+        modules = await get_course_modules(course_slug)
         
         if modules:
             text += "📚 <b>Модули курса:</b>\n\n"
@@ -333,7 +303,7 @@ async def show_my_course(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("module_"))
-async def show_module(callback: CallbackQuery):
+async def show_module(callback: CallbackQuery, user: Optional[User] = None):
     """Показать модуль курса с уроками"""
     parts = callback.data.split("_", 2)
     if len(parts) < 3:
@@ -343,18 +313,12 @@ async def show_module(callback: CallbackQuery):
     course_slug = parts[1]
     module_id = parts[2]
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
-        module = get_module_by_id(course_slug, module_id)
+        module = await get_module_by_id(course_slug, module_id)
         
         if not module:
             await callback.answer("Модуль не найден", show_alert=True)
@@ -365,8 +329,7 @@ async def show_module(callback: CallbackQuery):
         
         # Если модуль не бесплатный, проверяем наличие оплаты
         if not is_free:
-            payments = await payment_repo.get_user_payments(user.id)
-            payment = next((p for p in payments if p.course_slug == course_slug and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+            payment = await entitlement_service.get_entitlement(user.id, course_slug)
             
             if not payment:
                 await callback.answer("У вас нет доступа к этому курсу", show_alert=True)
@@ -429,7 +392,7 @@ async def show_module(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("lesson_"))
-async def show_lesson(callback: CallbackQuery):
+async def show_lesson(callback: CallbackQuery, user: Optional[User] = None):
     """Показать урок"""
     parts = callback.data.split("_", 3)
     if len(parts) < 4:
@@ -440,31 +403,24 @@ async def show_lesson(callback: CallbackQuery):
     module_id = parts[2]
     lesson_id = parts[3]
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
-        lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
+        lesson = await get_lesson_by_id(course_slug, module_id, lesson_id)
         
         if not lesson:
             await callback.answer("Урок не найден", show_alert=True)
             return
         
         # Проверяем, является ли модуль бесплатным
-        module = get_module_by_id(course_slug, module_id)
+        module = await get_module_by_id(course_slug, module_id, with_lessons=False)
         is_free = module.get('is_free', False) if module else False
         
         # Если модуль не бесплатный, проверяем наличие оплаты
         if not is_free:
-            payments = await payment_repo.get_user_payments(user.id)
-            payment = next((p for p in payments if p.course_slug == course_slug and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+            payment = await entitlement_service.get_entitlement(user.id, course_slug)
             
             if not payment:
                 await callback.answer("У вас нет доступа к этому курсу", show_alert=True)
@@ -558,7 +514,7 @@ async def show_lesson(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("download_lecture_"))
-async def download_lecture(callback: CallbackQuery):
+async def download_lecture(callback: CallbackQuery, user: Optional[User] = None):
     """Скачать PDF лекцию урока"""
     parts = callback.data.replace("download_lecture_", "").split("_", 2)
     
@@ -570,31 +526,24 @@ async def download_lecture(callback: CallbackQuery):
     module_id = parts[1]
     lesson_id = parts[2]
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
-        lesson = get_lesson_by_id(course_slug, module_id, lesson_id)
+        lesson = await get_lesson_by_id(course_slug, module_id, lesson_id)
         
         if not lesson:
             await callback.answer("Урок не найден", show_alert=True)
             return
         
         # Проверяем, является ли модуль бесплатным
-        module = get_module_by_id(course_slug, module_id)
+        module = await get_module_by_id(course_slug, module_id, with_lessons=False)
         is_free = module.get('is_free', False) if module else False
         
         # Если модуль не бесплатный, проверяем наличие оплаты
         if not is_free:
-            payments = await payment_repo.get_user_payments(user.id)
-            payment = next((p for p in payments if p.course_slug == course_slug and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+            payment = await entitlement_service.get_entitlement(user.id, course_slug)
             
             if not payment:
                 await callback.answer("У вас нет доступа к этому курсу", show_alert=True)
@@ -622,23 +571,16 @@ async def download_lecture(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("mini_module_"))
-async def show_mini_module(callback: CallbackQuery):
+async def show_mini_module(callback: CallbackQuery, user: Optional[User] = None):
     """Показать модуль мини-курса с уроками"""
     module_id = callback.data.replace("mini_module_", "")
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
-        payments = await payment_repo.get_user_payments(user.id)
-        payment = next((p for p in payments if p.course_slug == "mini_course" and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+        payment = await entitlement_service.get_entitlement(user.id, "mini_course")
         
         if not payment:
             await callback.answer("У вас нет доступа к мини-курсу", show_alert=True)
@@ -726,7 +668,7 @@ async def show_mini_module(callback: CallbackQuery):
 
 
 @learning_router.callback_query(F.data.startswith("mini_lesson_"))
-async def show_mini_lesson(callback: CallbackQuery):
+async def show_mini_lesson(callback: CallbackQuery, user: Optional[User] = None):
     """Показать урок мини-курса"""
     parts = callback.data.replace("mini_lesson_", "").split("_", 1)
     if len(parts) < 2:
@@ -736,19 +678,12 @@ async def show_mini_lesson(callback: CallbackQuery):
     module_id = parts[0]
     lesson_id = parts[1]
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
-        
         if not user:
             await callback.answer("Ошибка: пользователь не найден", show_alert=True)
             return
         
-        payments = await payment_repo.get_user_payments(user.id)
-        payment = next((p for p in payments if p.course_slug == "mini_course" and p.status == 'succeeded' and p.product_type in ['course', 'mini_course']), None)
+        payment = await entitlement_service.get_entitlement(user.id, "mini_course")
         
         if not payment:
             await callback.answer("У вас нет доступа к мини-курсу", show_alert=True)
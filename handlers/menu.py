@@ -3,7 +3,6 @@ from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardBut
 from aiogram.fsm.context import FSMContext
 
 from config import config
-from database import get_db, UserRepository
 from data import get_active_guides, get_guide_by_id, get_mini_course, get_mini_course_tariff, get_course_by_slug
 from keyboards import get_main_menu_keyboard, get_back_keyboard, get_guides_list_keyboard, get_guide_keyboard, get_about_me_keyboard, get_mini_course_keyboard, get_mini_course_tariff_keyboard
 
@@ -100,12 +99,6 @@ async def show_main_menu(callback: CallbackQuery):
     """Показать главное меню"""
     from utils.bot_settings import get_setting, WELCOME_VIDEO_KEY
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    
-    # Обновляем активность пользователя
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Получаем file_id видео
     welcome_video_id = await get_setting(WELCOME_VIDEO_KEY) or config.WELCOME_VIDEO_FILE_ID
     
@@ -480,10 +473,6 @@ async def show_mini_course_tariff_selection(callback: CallbackQuery):
 @router.callback_query(F.data == "webinar")
 async def show_webinar(callback: CallbackQuery):
     """Показать информацию о вебинаре"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     # Текст о вебинаре (можно изменить на нужный)
     text = """🎥 **Вебинар**
 
@@ -528,11 +517,6 @@ async def show_webinar(callback: CallbackQuery):
 @router.callback_query(F.data == "support")
 async def show_support(callback: CallbackQuery):
     """Показать информацию о поддержке"""
-    # Обновляем активность пользователя
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
     text = f"""💬 <b>Поддержка</b>
 
 Если у вас возникли вопросы или нужна помощь, вы можете связаться с нами:
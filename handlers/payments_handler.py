@@ -2,6 +2,7 @@ import logging
 import html
 from datetime import datetime
 import re
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
@@ -9,14 +10,15 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import StateFilter
 from bson import ObjectId
 
-from database import get_db, User, Payment, UserRepository, PaymentRepository
+from database import get_db, User, Payment, PaymentRepository
 from data import get_course_by_slug, get_tariff_by_id, get_consultation_by_slug, get_consultation_option, get_guide_by_id, get_mini_course, get_mini_course_tariff
 from keyboards import get_payment_keyboard, get_back_keyboard
-from payments import YooKassaPayment
+from payments import AsyncYooKassaPayment
+from services.entitlement_service import entitlement_service
 
 logger = logging.getLogger(__name__)
 router = Router()
-yookassa = YooKassaPayment()
+yookassa = AsyncYooKassaPayment()
 
 
 class PaymentEmailStates(StatesGroup):
@@ -25,7 +27,7 @@ class PaymentEmailStates(StatesGroup):
 
 
 @router.callback_query(F.data.startswith("tariff_"))
-async def process_tariff_selection(callback: CallbackQuery, state: FSMContext):
+async def process_tariff_selection(callback: CallbackQuery, state: FSMContext, user: Optional[User] = None):
     """Обработка выбора тарифа и запрос email"""
     logger.info(f"User {callback.from_user.id} selecting tariff: {callback.data}")
     
@@ -45,10 +47,6 @@ async def process_tariff_selection(callback: CallbackQuery, state: FSMContext):
         course_slug = parts[1]
         tariff_id = parts[2]
     
-    db = await get_db()
-    user_repo = UserRepository(db)
-    payment_repo = PaymentRepository(db)
-    
     try:
         # Определяем, это мини-курс или обычный курс
         if course_slug == "mini_course":
@@ -84,7 +82,6 @@ async def process_tariff_selection(callback: CallbackQuery, state: FSMContext):
             product_name = course['name']
             product_type = 'course'
         
-        user = await user_repo.get_by_telegram_id(callback.from_user.id)
         if not user:
             logger.error(f"User not found in database: {callback.from_user.id}")
             await callback.answer("Ошибка при создании платежа", show_alert=True)
@@ -132,7 +129,7 @@ async def cancel_payment_request(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(StateFilter(PaymentEmailStates.waiting_for_email))
-async def process_email_and_create_payment(message: Message, state: FSMContext):
+async def process_email_and_create_payment(message: Message, state: FSMContext, user: Optional[User] = None):
     """Обработка введенного email и создание платежа"""
     email = message.text.strip()
     
@@ -159,11 +156,9 @@ async def process_email_and_create_payment(message: Message, state: FSMContext):
     tariff_with_support = data.get('tariff_with_support', False)
     
     db = await get_db()
-    user_repo = UserRepository(db)
     payment_repo = PaymentRepository(db)
     
     try:
-        user = await user_repo.get_by_telegram_id(message.from_user.id)
         if not user:
             logger.error(f"User not found in database: {message.from_user.id}")
             await message.answer("❌ Ошибка при создании платежа. Попробуйте позже.")
@@ -190,7 +185,7 @@ async def process_email_and_create_payment(message: Message, state: FSMContext):
         bot_info = await message.bot.get_me()
         return_url = f"https://t.me/{bot_info.username}" if bot_info.username else "https://t.me"
         
-        payment_result = yookassa.create_payment(
+        payment_result = await yookassa.create_payment(
             amount=tariff_price,
             description=description,
             return_url=return_url,
@@ -290,14 +285,12 @@ async def check_payment_status(callback: CallbackQuery):
         
         # Проверяем статус в ЮKassa
         if payment.payment_id:
-            payment_status = yookassa.get_payment_status(payment.payment_id)
+            payment_status = await yookassa.get_payment_status(payment.payment_id)
             
             if payment_status and payment_status['status'] == 'succeeded':
-                # Обновляем платеж
-                await payment_repo.update(payment.id, {
-                    "status": "succeeded",
-                    "paid_at": datetime.utcnow()
-                })
+                # Обновляем платеж (атомарно: вебхук мог успеть раньше)
+                await payment_repo.mark_succeeded(payment.payment_id)
+                entitlement_service.invalidate(payment.user_id)
                 
                 logger.info(f"Payment {payment_id} status updated to succeeded")
                 
@@ -1,7 +1,6 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InputMediaPhoto
 
-from database import get_db, UserRepository
 from data import get_active_reviews
 from keyboards import get_reviews_navigation_keyboard
 
@@ -25,13 +24,8 @@ async def show_reviews_page_handler(callback: CallbackQuery):
 
 async def show_reviews_page_number(callback: CallbackQuery, page: int = 0):
     """Показать страницу отзывов с фотографиями"""
-    # Обновляем активность пользователя
-    db = await get_db()
-    user_repo = UserRepository(db)
-    await user_repo.update_activity(callback.from_user.id)
-    
-    # Получаем все активные отзывы
-    all_reviews = get_active_reviews()
+    # Получаем все активные отзывы (уже отсортированные по порядку)
+    all_reviews = get_active_reviews(sort_by_order=True)
     
     if not all_reviews:
         try:
@@ -49,11 +43,8 @@ async def show_reviews_page_number(callback: CallbackQuery, page: int = 0):
         await callback.answer()
         return
     
-    # Сортируем отзывы по порядку
-    reviews_sorted = sorted(all_reviews, key=lambda r: r.get('order', 0))
-    
     # Фильтруем только отзывы с фото
-    reviews_with_photos = [r for r in reviews_sorted if r.get('photo_id')]
+    reviews_with_photos = [r for r in all_reviews if r.get('photo_id')]
     
     if not reviews_with_photos:
         try:
@@ -3,7 +3,6 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery
 
 from config import config
-from database import get_db, User, UserRepository
 from keyboards import get_main_menu_keyboard
 from utils.bot_settings import get_setting, WELCOME_VIDEO_KEY
 
@@ -13,24 +12,7 @@ router = Router()
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
-    db = await get_db()
-    user_repo = UserRepository(db)
-    
-    # Проверяем, есть ли пользователь в базе
-    user = await user_repo.get_by_telegram_id(message.from_user.id)
-    
-    if not user:
-        # Создаем нового пользователя
-        user = User(
-            telegram_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-            last_name=message.from_user.last_name
-        )
-        await user_repo.create(user)
-    else:
-        # Обновляем активность
-        await user_repo.update_activity(message.from_user.id)
+    # Пользователь создается в UserContextMiddleware
     
     # Получаем file_id видео (сначала из БД, потом из config)
     welcome_video_id = await get_setting(WELCOME_VIDEO_KEY) or config.WELCOME_VIDEO_FILE_ID
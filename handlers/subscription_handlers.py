@@ -6,7 +6,7 @@ import html
 import re
 from datetime import datetime
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton, ChatMemberUpdated
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import StateFilter
@@ -39,6 +39,36 @@ def init_services(sub_service, pay_service):
     payment_service = pay_service
 
 
+def format_subscription_activated_text(subscription: dict) -> str:
+    """Текст сообщения об активированной подписке (Markdown)"""
+    end_date_str = subscription['end_date'].strftime('%d.%m.%Y %H:%M')
+    auto_renew = subscription.get('auto_renew', False)
+    
+    text = f"""✅ **Оплата успешно завершена!**
+
+🎉 Поздравляем! Ваша подписка активирована.
+
+🔗 **Ваша персональная ссылка:**
+{subscription['invite_link']}
+
+📅 **Действует до:** {end_date_str}"""
+    
+    if auto_renew:
+        text += f"\n🔄 **Автопродление:** включено"
+        text += f"\n💳 Через {config.SUBSCRIPTION_DAYS} дней автоматически спишется {config.SUBSCRIPTION_PRICE:.0f}₽"
+    
+    text += """
+
+💡 **Важно:**
+• Ссылка работает только для вас
+• Срок действия ограничен
+• За 3 дня и за 1 день до окончания вы получите напоминание
+
+Приятного использования! 🤍"""
+    
+    return text
+
+
 @router.callback_query(F.data == "subscription_channel")
 async def show_subscription_channel(callback: CallbackQuery):
     """Показать информацию о канале с подпиской"""
@@ -180,7 +210,7 @@ async def process_subscription_email(message: Message, state: FSMContext):
         bot_info = await message.bot.get_me()
         return_url = f"https://t.me/{bot_info.username}" if bot_info.username else "https://t.me"
         
-        payment_data = payment_service.create_payment(
+        payment_data = await payment_service.create_payment(
             user_id=message.from_user.id,
             return_url=return_url,
             customer_email=email
@@ -240,59 +270,22 @@ async def check_payment(callback: CallbackQuery):
         payment_id = callback.data.replace("subscription_check_payment_", "")
         
         # Проверяем статус в YooKassa
-        payment_data = payment_service.check_payment(payment_id)
+        payment_data = await payment_service.check_payment(payment_id)
         
         # Обрабатываем статус
         if payment_data["status"] == "succeeded" and payment_data["paid"]:
-            # Обновляем статус в БД
-            await subscription_service.update_payment_status(
-                payment_id=payment_id,
-                status="succeeded",
-                paid_at=datetime.utcnow()
-            )
-            
-            # Получаем payment_method_id для автопродления
-            payment_method_id = payment_data.get("payment_method_id")
-            
-            # Создаем подписку с автопродлением (только если есть payment_method_id)
-            subscription = await subscription_service.create_subscription(
+            # Активируем подписку (если вебхук уже успел - получим существующую)
+            subscription, _ = await subscription_service.activate_paid_subscription(
                 user_id=callback.from_user.id,
                 payment_id=payment_id,
-                payment_method_id=payment_method_id,
-                auto_renew=bool(payment_method_id)  # Включаем только если получен payment_method_id
+                payment_method_id=payment_data.get("payment_method_id")
             )
             
-            # Связываем платеж с подпиской
-            await subscription_service.link_payment_to_subscription(
-                payment_id=payment_id,
-                subscription_id=subscription['_id']
-            )
+            if not subscription:
+                await callback.answer("✅ Оплата уже обработана", show_alert=True)
+                return
             
-            # Формируем сообщение с ссылкой
-            end_date_str = subscription['end_date'].strftime('%d.%m.%Y %H:%M')
-            auto_renew = subscription.get('auto_renew', False)
-            
-            text = f"""✅ **Оплата успешно завершена!**
-
-🎉 Поздравляем! Ваша подписка активирована.
-
-🔗 **Ваша персональная ссылка:**
-{subscription['invite_link']}
-
-📅 **Действует до:** {end_date_str}"""
-            
-            if auto_renew:
-                text += f"\n🔄 **Автопродление:** включено"
-                text += f"\n💳 Через {config.SUBSCRIPTION_DAYS} дней автоматически спишется {config.SUBSCRIPTION_PRICE:.0f}₽"
-            
-            text += """
-
-💡 **Важно:**
-• Ссылка работает только для вас
-• Срок действия ограничен
-• За 3 дня и за 1 день до окончания вы получите напоминание
-
-Приятного использования! 🤍"""
+            text = format_subscription_activated_text(subscription)
             
             await callback.message.edit_text(
                 text,
@@ -382,3 +375,22 @@ async def show_subscription_status(callback: CallbackQuery):
         logger.error(f"Error showing subscription status: {e}")
         await callback.answer("Произошла ошибка. Попробуйте позже.", show_alert=True)
 
+
+@router.chat_member()
+async def track_channel_membership(event: ChatMemberUpdated):
+    """Журнал участия в канале: вступление и самостоятельный выход"""
+    if not subscription_service or str(event.chat.id) != str(config.SUBSCRIPTION_CHANNEL_ID):
+        return
+    
+    # Исключения ботом журнал уже учел
+    if event.from_user and event.from_user.id == event.bot.id:
+        return
+    
+    from services.channel_membership import MEMBER, LEFT
+    
+    status = event.new_chat_member.status
+    user_id = event.new_chat_member.user.id
+    if status in ("member", "administrator", "creator", "restricted"):
+        await subscription_service.membership.mark([user_id], MEMBER)
+    elif status in ("left", "kicked"):
+        await subscription_service.membership.mark([user_id], LEFT)
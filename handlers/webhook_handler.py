@@ -10,7 +10,8 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from database import get_db, PaymentRepository, UserRepository
 from data import get_course_by_slug, get_consultation_by_slug, get_guide_by_id, get_tariff_by_id
-from payments import YooKassaPayment
+from payments import YooKassaPayment, AsyncYooKassaPayment
+from services.entitlement_service import entitlement_service
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -18,14 +19,22 @@ logger = logging.getLogger(__name__)
 
 async def process_payment_webhook(
     notification_data: Dict[str, Any], 
-    bot: Bot
+    bot: Bot,
+    yookassa: AsyncYooKassaPayment,
+    subscription_service=None
 ) -> bool:
     """
     Обработка уведомления от YooKassa о статусе платежа
     
+    Статус из тела уведомления не используется как есть: платеж
+    перепроверяется через API ЮKassa, поэтому поддельное уведомление
+    не может открыть доступ.
+    
     Args:
         notification_data: Данные уведомления от YooKassa
         bot: Экземпляр бота для отправки сообщений
+        yookassa: Асинхронный клиент YooKassa
+        subscription_service: Сервис подписок (для платежей за канал)
         
     Returns:
         bool: Успешность обработки
@@ -38,12 +47,23 @@ async def process_payment_webhook(
             logger.error("Failed to parse webhook notification")
             return False
         
-        # Получаем объект платежа из уведомления
-        payment_obj = notification.object
-        payment_id = payment_obj.id
-        payment_status = payment_obj.status
+        payment_id = notification.object.id
+        
+        # Сверяем статус с API
+        payment_status = await yookassa.get_payment_status(payment_id)
+        
+        if not payment_status:
+            logger.error(f"Failed to verify webhook payment {payment_id}")
+            return False
+        
+        status = payment_status['status']
+        metadata = payment_status.get('metadata') or {}
         
-        logger.info(f"Processing webhook for payment {payment_id}, status: {payment_status}")
+        logger.info(f"Processing webhook for payment {payment_id}, status: {status}")
+        
+        # Платежи за подписку на канал хранятся отдельно
+        if metadata.get('product_type') == 'channel_subscription':
+            return await process_subscription_payment_webhook(bot, subscription_service, payment_status)
         
         # Находим платеж в нашей базе данных
         db = await get_db()
@@ -56,24 +76,27 @@ async def process_payment_webhook(
             return False
         
         # Обрабатываем успешный платеж
-        if payment_status == 'succeeded' and payment['status'] != 'succeeded':
-            await payment_repo.update_status(payment_id, 'succeeded')
-            
-            logger.info(f"Payment {payment_id} marked as succeeded")
-            
-            # Отправляем уведомление пользователю
-            await notify_user_payment_success(bot, payment, db)
-            
-            # Уведомляем админа
-            await notify_admin_new_payment(bot, payment, db)
+        if status == 'succeeded':
+            # Уведомления отправляет только тот, кто первым сменил статус
+            if await payment_repo.mark_succeeded(payment_id):
+                logger.info(f"Payment {payment_id} marked as succeeded")
+                entitlement_service.invalidate(payment.user_id)
+                
+                payment_data = await db.payments.find_one({"payment_id": payment_id})
+                
+                # Отправляем уведомление пользователю
+                await notify_user_payment_success(bot, payment_data, db)
+                
+                # Уведомляем админа
+                await notify_admin_new_payment(bot, payment_data, db)
             
             return True
         
         # Обрабатываем отмененный/неуспешный платеж
-        elif payment_status in ['canceled', 'failed']:
-            await payment_repo.update_status(payment_id, payment_status)
+        elif status in ['canceled', 'failed'] and payment.status == 'pending':
+            await payment_repo.update_by_payment_id(payment_id, {"status": status})
             
-            logger.info(f"Payment {payment_id} marked as {payment_status}")
+            logger.info(f"Payment {payment_id} marked as {status}")
             return True
         
         return True
@@ -83,6 +106,59 @@ async def process_payment_webhook(
         return False
 
 
+async def process_subscription_payment_webhook(bot: Bot, subscription_service, payment_status: Dict[str, Any]) -> bool:
+    """
+    Активация подписки на канал по уведомлению YooKassa
+    
+    Args:
+        bot: Экземпляр бота
+        subscription_service: Сервис подписок
+        payment_status: Проверенные через API данные платежа
+    """
+    payment_id = payment_status['id']
+    
+    if not subscription_service:
+        logger.warning(f"Subscription service not configured, skipping payment {payment_id}")
+        return False
+    
+    if payment_status['status'] in ['canceled', 'failed']:
+        await subscription_service.update_payment_status(payment_id, payment_status['status'])
+        return True
+    
+    if payment_status['status'] != 'succeeded' or not payment_status.get('paid'):
+        return True
+    
+    payment = await subscription_service.get_payment(payment_id)
+    if not payment:
+        logger.warning(f"Subscription payment {payment_id} not found in database")
+        return False
+    
+    if payment.get('status') == 'succeeded':
+        # Уже обработан кнопкой «Проверить оплату» или предыдущим уведомлением
+        return True
+    
+    from handlers.subscription_handlers import format_subscription_activated_text
+    from keyboards.keyboards import get_subscription_status_keyboard
+    
+    user_id = payment['user_id']
+    subscription, created = await subscription_service.activate_paid_subscription(
+        user_id=user_id,
+        payment_id=payment_id,
+        payment_method_id=payment_status.get('payment_method_id')
+    )
+    
+    if created:
+        await bot.send_message(
+            chat_id=user_id,
+            text=format_subscription_activated_text(subscription),
+            reply_markup=get_subscription_status_keyboard(),
+            parse_mode="Markdown"
+        )
+        logger.info(f"Subscription activated by webhook for user {user_id}")
+    
+    return True
+
+
 async def notify_user_payment_success(bot: Bot, payment: dict, db):
     """
     Отправка уведомления пользователю об успешной оплате
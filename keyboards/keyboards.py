@@ -58,10 +58,8 @@ def get_guides_list_keyboard() -> InlineKeyboardMarkup:
     
     buttons = []
     
-    # Получаем активные гайды из JSON
-    guides = get_active_guides()
-    # Сортируем по порядку
-    guides_sorted = sorted(guides, key=lambda g: g.get('order', 0))
+    # Получаем активные гайды из JSON (уже отсортированные по порядку)
+    guides_sorted = get_active_guides(sort_by_order=True)
     
     for guide in guides_sorted:
         buttons.append([InlineKeyboardButton(
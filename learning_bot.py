@@ -3,11 +3,12 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import config
-from database import mongodb
+from database import mongodb, activity_tracker, settings_cache, catalog_versions, create_fsm_storage
 from handlers.learning_handlers import learning_router
+from middlewares import UserContextMiddleware
+from web import create_web_app, start_web_server, stop_web_server, setup_telegram_webhook, set_telegram_webhook, wait_for_stop_signal
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,9 +28,18 @@ async def main():
     # Инициализация MongoDB (общая БД с основным ботом)
     logger.info(f"Connecting to MongoDB: {config.MONGODB_URL}")
     await mongodb.connect(config.MONGODB_URL, config.MONGODB_DB_NAME)
+    activity_tracker.start()
+    await settings_cache.start()
     
     # Логируем состояние данных
-    from data import get_all_courses, get_mini_course
+    from data import catalog, get_all_courses, get_mini_course, seed_course_materials
+    
+    # Снимок каталога и изменения из админки основного бота
+    logger.info(f"Catalog snapshot: {catalog.load_snapshot()} files")
+    await catalog_versions.start(catalog)
+    
+    # Материалы курсов в MongoDB (первый запуск - импорт из JSON)
+    await seed_course_materials()
     
     courses = get_all_courses()
     mini_course = get_mini_course()
@@ -42,17 +52,34 @@ async def main():
         token=config.LEARNING_BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    storage = MemoryStorage()
+    storage = await create_fsm_storage()
     dp = Dispatcher(storage=storage)
+    user_context = UserContextMiddleware(activity_interval=config.USER_ACTIVITY_INTERVAL)
+    dp.update.outer_middleware(user_context)
     
     # Регистрация роутера учебного бота
     dp.include_router(learning_router)
     
     # Запуск бота
     logger.info("🎓 Learning bot started successfully!")
+    web_runner = None
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.BOT_RUN_MODE == 'webhook':
+            web_app = create_web_app()
+            setup_telegram_webhook(web_app, "learning", bot, dp)
+            web_runner = await start_web_server(web_app)
+            await set_telegram_webhook("learning", bot, dp)
+            await wait_for_stop_signal()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        if web_runner:
+            await stop_web_server(web_runner)
+        await storage.close()
+        await catalog_versions.stop()
+        await settings_cache.stop()
+        await activity_tracker.stop()
         await mongodb.close()
         await bot.session.close()
 
@@ -1,5 +1,5 @@
 """Middleware для бота"""
 from .navigation import NavigationMiddleware
+from .user_context import UserContextMiddleware
 
-__all__ = ['NavigationMiddleware']
-
+__all__ = ['NavigationMiddleware', 'UserContextMiddleware']
@@ -0,0 +1,62 @@
+"""Middleware загрузки пользователя из базы"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Any, Awaitable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import UserRepository, activity_tracker, get_db
+
+logger = logging.getLogger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает пользователя один раз на апдейт и кладет его в data['user']
+
+    Новый пользователь создается при первом обращении. Активность
+    отмечается в ActivityTracker, не чаще одного раза в activity_interval
+    на пользователя, и не блокирует обработку.
+
+    Регистрируется как outer middleware на dp.update.
+    """
+
+    def __init__(self, activity_interval: int = 300):
+        """
+        Args:
+            activity_interval: Минимальный интервал между записями last_activity, секунд
+        """
+        self.activity_interval = activity_interval
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка события"""
+        tg_user = data.get('event_from_user')
+
+        if tg_user and not tg_user.is_bot:
+            try:
+                db = await get_db()
+                user = await UserRepository(db).get_or_create(
+                    telegram_id=tg_user.id,
+                    username=tg_user.username,
+                    first_name=tg_user.first_name,
+                    last_name=tg_user.last_name
+                )
+                data['user'] = user
+                self._track_activity(user.telegram_id, user.last_activity, user.is_active)
+            except Exception as e:
+                # Обработчики сами сообщат пользователю, если им нужен user
+                logger.error(f"Error loading user {tg_user.id}: {e}")
+
+        return await handler(event, data)
+
+    def _track_activity(self, telegram_id: int, last_activity: Optional[datetime], is_active: bool) -> None:
+        """Отметить активность, если сохраненная отметка устарела или пользователь неактивен"""
+        now = datetime.utcnow()
+        if is_active and last_activity and (now - last_activity).total_seconds() < self.activity_interval:
+            return
+        activity_tracker.touch(telegram_id, now)
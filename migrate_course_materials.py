@@ -0,0 +1,50 @@
+"""
+Перенос материалов курсов между course_materials.json и MongoDB
+
+    python migrate_course_materials.py import [путь]   # JSON -> MongoDB
+    python migrate_course_materials.py export [путь]   # MongoDB -> JSON (резервная копия)
+
+По умолчанию используется data/course_materials.json. Повторный импорт
+перезаписывает модули и уроки с теми же id, остальные не трогает.
+"""
+import asyncio
+import logging
+import sys
+
+from config import config
+from database import mongodb, course_materials
+from data import COURSE_MATERIALS_FILE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def migrate_course_materials(command: str, path: str):
+    """Импорт или экспорт материалов курсов"""
+    try:
+        # Подключение создает индексы, в том числе уникальные для модулей и уроков
+        await mongodb.connect(config.MONGODB_URL, config.MONGODB_DB_NAME)
+
+        if command == "import":
+            modules, lessons = await course_materials.import_file(path)
+            logger.info(f"✅ Imported {modules} modules, {lessons} lessons from {path}")
+        else:
+            modules, lessons = await course_materials.export_file(path)
+            logger.info(f"✅ Exported {modules} modules, {lessons} lessons to {path}")
+
+    except Exception as e:
+        logger.error(f"Error during course materials {command}: {e}", exc_info=True)
+        raise
+    finally:
+        await mongodb.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ("import", "export"):
+        print(__doc__)
+        sys.exit(1)
+
+    asyncio.run(migrate_course_materials(
+        sys.argv[1],
+        sys.argv[2] if len(sys.argv) > 2 else COURSE_MATERIALS_FILE
+    ))
@@ -1,4 +1,5 @@
-from .yookassa_payment import YooKassaPayment
+from .yookassa_payment import YooKassaPayment, PaymentTemporaryError
+from .async_client import AsyncYooKassaPayment, run_in_payment_pool, shutdown_payment_pool
 
-__all__ = ['YooKassaPayment']
+__all__ = ['YooKassaPayment', 'PaymentTemporaryError', 'AsyncYooKassaPayment', 'run_in_payment_pool', 'shutdown_payment_pool']
 
@@ -0,0 +1,128 @@
+"""
+Асинхронный клиент ЮKassa
+
+SDK ЮKassa синхронный: каждый вызов - это блокирующий HTTP-запрос.
+Здесь такие вызовы выполняются в отдельном ограниченном пуле потоков,
+поэтому медленный ответ ЮKassa не останавливает обработку апдейтов ботов.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+from config import config
+from .yookassa_payment import YooKassaPayment
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Общий пул потоков для вызовов ЮKassa (создается при первом обращении)"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config.YOOKASSA_MAX_WORKERS,
+                    thread_name_prefix="yookassa"
+                )
+                logger.info(f"YooKassa thread pool started (workers: {config.YOOKASSA_MAX_WORKERS})")
+    return _executor
+
+
+async def run_in_payment_pool(func: Callable, *args, **kwargs) -> Any:
+    """
+    Выполнить синхронный вызов ЮKassa в пуле потоков
+
+    Args:
+        func: Синхронная функция (обычно метод SDK или YooKassaPayment)
+        *args, **kwargs: Аргументы функции
+
+    Returns:
+        Результат функции
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_payment_pool() -> None:
+    """Остановка пула потоков (вызывается при завершении бота)"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+            logger.info("YooKassa thread pool stopped")
+
+
+class AsyncYooKassaPayment:
+    """Асинхронный интерфейс к YooKassaPayment для вызова из хэндлеров и фоновых задач"""
+
+    def __init__(self, yookassa: Optional[YooKassaPayment] = None):
+        """
+        Args:
+            yookassa: Синхронный клиент (по умолчанию создается новый)
+        """
+        self.sync = yookassa or YooKassaPayment()
+
+    async def create_payment(
+        self,
+        amount: float,
+        description: str,
+        return_url: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        customer_email: Optional[str] = None,
+        save_payment_method: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Создание платежа в YooKassa (см. YooKassaPayment.create_payment)"""
+        return await run_in_payment_pool(
+            self.sync.create_payment,
+            amount=amount,
+            description=description,
+            return_url=return_url,
+            metadata=metadata,
+            customer_email=customer_email,
+            save_payment_method=save_payment_method
+        )
+
+    async def get_payment_status(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Получение статуса платежа (см. YooKassaPayment.get_payment_status)"""
+        return await run_in_payment_pool(self.sync.get_payment_status, payment_id)
+
+    async def cancel_payment(self, payment_id: str) -> bool:
+        """Отмена платежа (см. YooKassaPayment.cancel_payment)"""
+        return await run_in_payment_pool(self.sync.cancel_payment, payment_id)
+
+    async def create_recurrent_payment(
+        self,
+        amount: float,
+        description: str,
+        payment_method_id: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        customer_email: Optional[str] = None,
+        idempotence_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Создание рекуррентного платежа (см. YooKassaPayment.create_recurrent_payment)"""
+        return await run_in_payment_pool(
+            self.sync.create_recurrent_payment,
+            amount=amount,
+            description=description,
+            payment_method_id=payment_method_id,
+            metadata=metadata,
+            customer_email=customer_email,
+            idempotence_key=idempotence_key
+        )
+
+    async def setup_webhook(self, webhook_url: str) -> bool:
+        """Настройка webhook (см. YooKassaPayment.setup_webhook)"""
+        return await run_in_payment_pool(self.sync.setup_webhook, webhook_url)
+
+    # Разбор уведомления не делает сетевых запросов - вызываем напрямую
+    parse_webhook_notification = staticmethod(YooKassaPayment.parse_webhook_notification)
@@ -1,13 +1,33 @@
 import uuid
 import logging
 from typing import Optional, Dict, Any
+from requests.exceptions import RequestException
 from yookassa import Configuration, Payment, Webhook
+from yookassa.domain.exceptions import ApiError, ResponseProcessingError, TooManyRequestsError
 from yookassa.domain.notification import WebhookNotificationFactory
 from config import config
 
 logger = logging.getLogger(__name__)
 
 
+class PaymentTemporaryError(Exception):
+    """Временная ошибка ЮKassa (сеть, 5xx, 429): запрос можно повторить с тем же ключом идемпотентности"""
+
+
+def is_temporary_error(error: Optional[BaseException]) -> bool:
+    """Сетевая ошибка или ответ, после которого ЮKassa советует повторить запрос"""
+    # При сетевой ошибке SDK падает с AttributeError, разбирая несуществующий
+    # ответ, - исходная ошибка остается в __context__
+    while error is not None:
+        if isinstance(error, (RequestException, ResponseProcessingError, TooManyRequestsError)):
+            return True
+        if isinstance(error, ApiError):
+            # 4xx - ошибка запроса; 5xx (InternalServerError) и неожиданные коды повторяем
+            return not 400 <= error.HTTP_CODE < 500
+        error = error.__context__
+    return False
+
+
 class YooKassaPayment:
     """Класс для работы с ЮKassa API"""
     
@@ -163,7 +183,8 @@ class YooKassaPayment:
         description: str,
         payment_method_id: str,
         metadata: Optional[Dict[str, Any]] = None,
-        customer_email: Optional[str] = None
+        customer_email: Optional[str] = None,
+        idempotence_key: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Создание рекуррентного платежа с сохраненным методом оплаты
@@ -174,11 +195,16 @@ class YooKassaPayment:
             payment_method_id: ID сохраненного метода оплаты
             metadata: Дополнительные метаданные
             customer_email: Email покупателя для чека
+            idempotence_key: Ключ идемпотентности (повтор с тем же ключом
+                в течение 24 часов вернет тот же платеж, а не спишет еще раз)
             
         Returns:
             dict: Данные созданного платежа или None при ошибке
+            
+        Raises:
+            PaymentTemporaryError: Временная ошибка, запрос можно повторить
         """
-        idempotence_key = str(uuid.uuid4())
+        idempotence_key = idempotence_key or str(uuid.uuid4())
         
         payment_metadata = {"order_id": idempotence_key, "recurrent": True}
         if metadata:
@@ -217,17 +243,22 @@ class YooKassaPayment:
             logger.info(f"Creating recurrent payment: amount={amount}, payment_method={payment_method_id}")
             payment = Payment.create(payment_data, idempotence_key)
             
+            cancellation = getattr(payment, 'cancellation_details', None)
             result = {
                 'id': payment.id,
                 'status': payment.status,
                 'amount': float(payment.amount.value),
-                'currency': payment.amount.currency
+                'currency': payment.amount.currency,
+                'cancellation_reason': cancellation.reason if cancellation else None
             }
             
-            logger.info(f"Recurrent payment created: {payment.id}")
+            logger.info(f"Recurrent payment created: {payment.id} - {payment.status}")
             return result
             
         except Exception as e:
+            if is_temporary_error(e):
+                logger.warning(f"Temporary error creating recurrent payment ({idempotence_key}): {e}")
+                raise PaymentTemporaryError(str(e)) from e
             logger.error(f"Error creating recurrent payment: {e}", exc_info=True)
             return None
     
@@ -1,14 +1,21 @@
 """
 Периодическая проверка статуса платежей
-Проверяет pending платежи и уведомляет админа при успешной оплате
+Проверяет pending платежи и уведомляет админа при успешной оплате.
+Платежи опрашиваются параллельно (с ограничением числа одновременных
+запросов и запросов в секунду), свежие - часто, старые - редко.
 """
 import logging
 import asyncio
+import time
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 from aiogram import Bot
 
+from config import config
 from database import get_db, PaymentRepository
-from payments import YooKassaPayment
+from payments import AsyncYooKassaPayment
+from services.entitlement_service import entitlement_service
+from utils.rate_limiter import RateLimiter
 from handlers.webhook_handler import notify_user_payment_success, notify_admin_new_payment
 
 logger = logging.getLogger(__name__)
@@ -17,17 +24,49 @@ logger = logging.getLogger(__name__)
 class PaymentChecker:
     """Класс для периодической проверки статуса платежей"""
     
-    def __init__(self, bot: Bot, check_interval: int = 60):
+    # Как часто опрашивать платеж в зависимости от его возраста:
+    # (максимальный возраст в секундах, интервал опроса в секундах)
+    POLL_SCHEDULE = [
+        (10 * 60, 5),          # первые 10 минут - каждые 5 секунд
+        (60 * 60, 30),         # до часа - раз в 30 секунд
+        (6 * 60 * 60, 5 * 60), # до 6 часов - раз в 5 минут
+    ]
+    # Более старые платежи (до 24 часов) - раз в 30 минут
+    OLD_PAYMENT_POLL_INTERVAL = 30 * 60
+    # Поля pending платежа, нужные для проверки (полный документ читается
+    # только после успешной оплаты, для уведомлений)
+    PAYMENT_FIELDS = ("payment_id", "status", "user_id", "created_at")
+    
+    def __init__(
+        self,
+        bot: Bot,
+        check_interval: int = 5,
+        concurrency: int = 10,
+        requests_per_second: float = 5.0,
+        min_poll_interval: float = 0
+    ):
         """
         Args:
             bot: Экземпляр бота
-            check_interval: Интервал проверки в секундах (по умолчанию 60)
+            check_interval: Интервал между проходами в секундах (по умолчанию 5).
+                Каждый платеж опрашивается не чаще, чем позволяет POLL_SCHEDULE
+            concurrency: Сколько платежей проверяется одновременно
+            requests_per_second: Лимит запросов к YooKassa в секунду
+            min_poll_interval: Нижняя граница интервала опроса платежа
+                (когда статусы приходят вебхуком, проверка нужна лишь как подстраховка)
         """
         self.bot = bot
         self.check_interval = check_interval
-        self.yookassa = YooKassaPayment()
+        self.yookassa = AsyncYooKassaPayment()
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.min_poll_interval = min_poll_interval
         self.is_running = False
         self._task = None
+        # payment_id -> время (monotonic), раньше которого платеж не опрашиваем
+        self._next_check: Dict[str, float] = {}
+        # Метрики последнего прохода
+        self.last_sweep: Dict[str, Any] = {}
     
     async def start(self):
         """Запуск периодической проверки"""
@@ -37,7 +76,10 @@ class PaymentChecker:
         
         self.is_running = True
         self._task = asyncio.create_task(self._check_loop())
-        logger.info(f"Payment checker started (interval: {self.check_interval}s)")
+        logger.info(
+            f"Payment checker started (interval: {self.check_interval}s, "
+            f"concurrency: {self.concurrency}, rps: {self.rate_limiter.rate})"
+        )
     
     async def stop(self):
         """Остановка периодической проверки"""
@@ -61,74 +103,144 @@ class PaymentChecker:
             # Ждем до следующей проверки
             await asyncio.sleep(self.check_interval)
     
+    def _poll_interval(self, created_at: Optional[datetime]) -> float:
+        """Интервал опроса платежа по его возрасту"""
+        interval = self.OLD_PAYMENT_POLL_INTERVAL
+        
+        if created_at:
+            age = (datetime.utcnow() - created_at).total_seconds()
+            for max_age, schedule_interval in self.POLL_SCHEDULE:
+                if age < max_age:
+                    interval = schedule_interval
+                    break
+        
+        return max(interval, self.min_poll_interval)
+    
     async def _check_pending_payments(self):
-        """Проверка всех pending платежей"""
+        """Проверка pending платежей, у которых подошло время опроса"""
+        started = time.monotonic()
+        stats = {"pending": 0, "checked": 0, "changed": 0, "errors": 0}
+        
         try:
             db = await get_db()
             payment_repo = PaymentRepository(db)
             
-            # Получаем все pending платежи, которые были созданы не более 24 часов назад
-            # (старые платежи уже не актуальны)
+            # Pending платежи, созданные не более 24 часов назад
+            # (старые платежи уже не актуальны), читаются курсором
             day_ago = datetime.utcnow() - timedelta(hours=24)
-            pending_payments = await payment_repo.get_pending_since(day_ago)
-            
-            if not pending_payments:
-                return
+            pending_ids = set()
+            due_payments = []
             
-            logger.info(f"Checking {len(pending_payments)} pending payments")
-            
-            for payment in pending_payments:
+            async for payment in payment_repo.iter_pending_since(day_ago, fields=self.PAYMENT_FIELDS):
                 # Пропускаем платежи без payment_id (еще не созданы в YooKassa)
                 if not payment.get('payment_id'):
                     continue
                 
-                # Проверяем статус в YooKassa
-                payment_status = self.yookassa.get_payment_status(payment['payment_id'])
-                
-                if not payment_status:
-                    logger.warning(f"Failed to get status for payment {payment['payment_id']}")
-                    continue
+                stats["pending"] += 1
+                pending_ids.add(payment['payment_id'])
                 
-                # Если статус изменился
-                if payment_status['status'] != payment['status']:
-                    logger.info(
-                        f"Payment {payment['payment_id']} status changed: "
-                        f"{payment['status']} -> {payment_status['status']}"
-                    )
-                    
-                    # Обновляем статус в БД
-                    update_data = {"status": payment_status['status']}
-                    
-                    # Если платеж успешен
-                    if payment_status['status'] == 'succeeded':
-                        update_data["paid_at"] = datetime.utcnow()
-                        
-                        # Обновляем платеж
-                        await payment_repo.update_by_payment_id(
-                            payment['payment_id'],
-                            update_data
-                        )
-                        
-                        # Получаем обновленный платеж как dict
-                        updated_payment_data = await self._get_payment_dict(payment_repo, payment['payment_id'])
-                        
-                        if updated_payment_data:
-                            # Отправляем уведомления
-                            await notify_user_payment_success(self.bot, updated_payment_data, db)
-                            await notify_admin_new_payment(self.bot, updated_payment_data, db)
-                        
-                        logger.info(f"Payment {payment['payment_id']} processed successfully")
-                    
-                    # Если платеж отменен или не прошел
-                    elif payment_status['status'] in ['canceled', 'failed']:
-                        await payment_repo.update_by_payment_id(
-                            payment['payment_id'],
-                            update_data
-                        )
-                        logger.info(f"Payment {payment['payment_id']} marked as {payment_status['status']}")
+                if self._next_check.get(payment['payment_id'], 0) <= time.monotonic():
+                    due_payments.append(payment)
+                    # В памяти не больше одной пачки платежей
+                    if len(due_payments) >= self.concurrency * 4:
+                        await self._check_batch(due_payments, payment_repo, db, stats)
+                        due_payments = []
+            
+            if due_payments:
+                await self._check_batch(due_payments, payment_repo, db, stats)
+            
+            # Забываем платежи, которые больше не pending
+            for payment_id in list(self._next_check):
+                if payment_id not in pending_ids:
+                    del self._next_check[payment_id]
         
         except Exception as e:
             logger.error(f"Error checking pending payments: {e}", exc_info=True)
+        
+        stats["duration"] = round(time.monotonic() - started, 3)
+        self.last_sweep = stats
+        
+        if stats["checked"] or stats["errors"]:
+            logger.info(
+                f"Payment sweep: duration={stats['duration']}s, pending={stats['pending']}, "
+                f"checked={stats['checked']}, changed={stats['changed']}, errors={stats['errors']}"
+            )
+    
+    async def _check_batch(self, payments: List[dict], payment_repo: PaymentRepository, db, stats: dict):
+        """Параллельная проверка пачки платежей (не больше concurrency запросов)"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def check(payment: dict):
+            async with semaphore:
+                await self.rate_limiter.acquire()
+                self._next_check[payment['payment_id']] = (
+                    time.monotonic() + self._poll_interval(payment.get('created_at'))
+                )
+                return await self._check_payment(payment, payment_repo, db)
+        
+        results = await asyncio.gather(*(check(p) for p in payments), return_exceptions=True)
+        
+        for payment, result in zip(payments, results):
+            if isinstance(result, Exception):
+                stats["errors"] += 1
+                logger.error(f"Error checking payment {payment['payment_id']}: {result}")
+            elif result is None:
+                stats["errors"] += 1
+                stats["checked"] += 1
+            else:
+                stats["checked"] += 1
+                if result:
+                    stats["changed"] += 1
+    
+    async def _check_payment(self, payment: dict, payment_repo: PaymentRepository, db) -> Optional[bool]:
+        """
+        Проверка одного pending платежа
+        
+        Returns:
+            True - статус изменился, False - не изменился, None - не удалось получить статус
+        """
+        # Проверяем статус в YooKassa
+        payment_status = await self.yookassa.get_payment_status(payment['payment_id'])
+        
+        if not payment_status:
+            logger.warning(f"Failed to get status for payment {payment['payment_id']}")
+            return None
+        
+        # Если статус не изменился
+        if payment_status['status'] == payment['status']:
+            return False
+        
+        logger.info(
+            f"Payment {payment['payment_id']} status changed: "
+            f"{payment['status']} -> {payment_status['status']}"
+        )
+        
+        # Если платеж успешен
+        if payment_status['status'] == 'succeeded':
+            # Обновляем платеж (если его уже не обработал вебхук)
+            if not await payment_repo.mark_succeeded(payment['payment_id']):
+                return False
+            entitlement_service.invalidate(payment.get('user_id'))
+            
+            # Получаем обновленный платеж как dict
+            updated_payment_data = await self._get_payment_dict(payment_repo, payment['payment_id'])
+            
+            if updated_payment_data:
+                # Отправляем уведомления
+                await notify_user_payment_success(self.bot, updated_payment_data, db)
+                await notify_admin_new_payment(self.bot, updated_payment_data, db)
+            
+            logger.info(f"Payment {payment['payment_id']} processed successfully")
+        
+        # Если платеж отменен или не прошел
+        elif payment_status['status'] in ['canceled', 'failed']:
+            await payment_repo.update_by_payment_id(
+                payment['payment_id'],
+                {"status": payment_status['status']}
+            )
+            logger.info(f"Payment {payment['payment_id']} marked as {payment_status['status']}")
+        
+        return True
     
     async def _get_payment_dict(self, payment_repo, payment_id: str) -> dict:
         """Получение платежа как dict"""
@@ -147,18 +259,25 @@ class PaymentChecker:
 _payment_checker: PaymentChecker = None
 
 
-async def start_payment_checker(bot: Bot, check_interval: int = 60):
+async def start_payment_checker(bot: Bot, check_interval: Optional[int] = None, min_poll_interval: float = 0):
     """
     Запуск проверки платежей
     
     Args:
         bot: Экземпляр бота
-        check_interval: Интервал проверки в секундах
+        check_interval: Интервал между проходами в секундах (по умолчанию из конфига)
+        min_poll_interval: Минимальный интервал опроса одного платежа
     """
     global _payment_checker
     
     if _payment_checker is None:
-        _payment_checker = PaymentChecker(bot, check_interval)
+        _payment_checker = PaymentChecker(
+            bot,
+            check_interval=check_interval or config.PAYMENT_CHECK_INTERVAL,
+            concurrency=config.PAYMENT_CHECK_CONCURRENCY,
+            requests_per_second=config.PAYMENT_CHECK_RPS,
+            min_poll_interval=min_poll_interval
+        )
     
     await _payment_checker.start()
     return _payment_checker
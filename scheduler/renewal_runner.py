@@ -0,0 +1,330 @@
+"""
+Автопродление подписок
+
+Попытка продления за период хранится в коллекции subscription_renewals
+под ключом идемпотентности из ID подписки и даты окончания периода. Тот же
+ключ уходит в ЮKassa, поэтому повтор после сетевой ошибки или перезапуска
+бота возвращает уже созданный платеж, а не списывает деньги второй раз.
+
+Временные ошибки ЮKassa (сеть, 5xx, 429) повторяются с экспоненциальной
+задержкой; если круг попыток не помог, следующий планируется через
+retry_interval, пока действует ключ идемпотентности (24 часа). Из канала
+удаляет только отказ в оплате (платеж canceled); пока продление не
+завершено, окончание подписки откладывается.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from config import config
+from database.mongodb import mongodb
+from payments import PaymentTemporaryError
+from scheduler.subscription_events import EXPIRE, RENEW
+from utils.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Статусы попытки продления
+RENEWAL_PENDING = "pending"
+RENEWAL_SUCCEEDED = "succeeded"
+RENEWAL_CANCELED = "canceled"
+RENEWAL_ERROR = "error"
+
+# Сколько ЮKassa помнит ключ идемпотентности
+IDEMPOTENCE_WINDOW = timedelta(hours=24)
+
+# На сколько откладывается окончание подписки после очередной попытки продления
+EXPIRY_GRACE = timedelta(minutes=5)
+
+
+def renewal_key(subscription_id: ObjectId, end_date: datetime) -> str:
+    """Ключ идемпотентности продления: подписка + период (не длиннее 64 символов)"""
+    return f"renew-{subscription_id}-{end_date:%Y%m%d%H%M%S}"
+
+
+class RenewalRunner:
+    """Списание за продление подписок с повторами и журналом попыток"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        subscription_service,
+        yookassa_payment,
+        concurrency: int = 5,
+        requests_per_second: float = 5.0,
+        max_attempts: int = 5,
+        retry_interval: int = 3600,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0
+    ):
+        """
+        Args:
+            bot: Экземпляр бота
+            subscription_service: Сервис управления подписками
+            yookassa_payment: Асинхронный клиент YooKassa (AsyncYooKassaPayment)
+            concurrency: Сколько запросов к ЮKassa выполняется одновременно
+            requests_per_second: Лимит запросов к ЮKassa в секунду
+            max_attempts: Попыток подряд при временных ошибках
+            retry_interval: Секунд до следующего круга попыток
+            backoff_base: Задержка перед второй попыткой (дальше удваивается)
+            backoff_max: Максимальная задержка между попытками
+        """
+        self.bot = bot
+        self.subscription_service = subscription_service
+        self.yookassa_payment = yookassa_payment
+        self.max_attempts = max_attempts
+        self.retry_interval = timedelta(seconds=retry_interval)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def collection(self):
+        return mongodb.get_database().subscription_renewals
+
+    async def renew(self, subscription_id: ObjectId, end_date: datetime) -> None:
+        """Обработчик события RENEW: продлить подписку за период, заканчивающийся end_date"""
+        subscription = await self.subscription_service.get_renewal_candidate(subscription_id, end_date)
+        if not subscription:
+            return
+
+        renewal = await self._open(subscription)
+
+        if renewal["status"] == RENEWAL_PENDING:
+            next_attempt_at = renewal.get("next_attempt_at")
+            if next_attempt_at and next_attempt_at > datetime.utcnow():
+                # После перезапуска: следующий круг попыток еще не наступил
+                self._schedule(RENEW, subscription_id, end_date, next_attempt_at)
+                return
+            renewal = await self._attempt(renewal)
+
+        await self._settle(renewal, subscription)
+
+    async def defer_expiry(self, subscription_id: ObjectId, end_date: datetime) -> bool:
+        """
+        Отложить окончание подписки, пока продление за этот период не завершено
+
+        Returns:
+            True, если окончание перенесено (обработчик окончания должен выйти)
+        """
+        scheduler = self.subscription_service.event_scheduler
+        if not scheduler:
+            return False
+
+        renewal = await self.collection.find_one(
+            {"_id": renewal_key(subscription_id, end_date), "status": RENEWAL_PENDING},
+            {"next_attempt_at": 1}
+        )
+        if not renewal:
+            return False
+
+        now = datetime.utcnow()
+        due_at = max(renewal.get("next_attempt_at") or now, now) + EXPIRY_GRACE
+        scheduler.schedule_event(EXPIRE, subscription_id, end_date, due_at)
+        logger.info(f"Expiry of subscription {subscription_id} deferred until {due_at}: renewal in progress")
+        return True
+
+    async def _open(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        """Запись о продлении за период (создается при первой попытке)"""
+        end_date = subscription["end_date"]
+        return await self.collection.find_one_and_update(
+            {"_id": renewal_key(subscription["_id"], end_date)},
+            {"$setOnInsert": {
+                "subscription_id": subscription["_id"],
+                "user_id": subscription["user_id"],
+                "end_date": end_date,
+                # Сумма и способ оплаты фиксируются: повторы шлют тот же запрос
+                "amount": config.SUBSCRIPTION_PRICE,
+                "payment_method_id": subscription["payment_method_id"],
+                "status": RENEWAL_PENDING,
+                "payment_id": None,
+                "attempts": 0,
+                "last_error": None,
+                "next_attempt_at": None,
+                "created_at": datetime.utcnow()
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _update(self, key: str, fields: Dict[str, Any], attempt: bool = True) -> Dict[str, Any]:
+        update: Dict[str, Any] = {"$set": {**fields, "updated_at": datetime.utcnow()}}
+        if attempt:
+            update["$inc"] = {"attempts": 1}
+        return await self.collection.find_one_and_update(
+            {"_id": key},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        # Разброс, чтобы одновременно упавшие продления не повторялись залпом
+        return random.uniform(delay / 2, delay)
+
+    async def _charge(self, renewal: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Создать платеж (или узнать статус уже созданного)"""
+        async with self._semaphore:
+            await self.rate_limiter.acquire()
+
+            if renewal.get("payment_id"):
+                payment = await self.yookassa_payment.get_payment_status(renewal["payment_id"])
+                if payment is None:
+                    raise PaymentTemporaryError(f"status of {renewal['payment_id']} unavailable")
+                return payment
+
+            return await self.yookassa_payment.create_recurrent_payment(
+                amount=renewal["amount"],
+                description="Автопродление подписки на канал",
+                payment_method_id=renewal["payment_method_id"],
+                metadata={
+                    "user_id": renewal["user_id"],
+                    "subscription_id": str(renewal["subscription_id"]),
+                    "auto_renewal": True,
+                    "renewal_key": renewal["_id"]
+                },
+                idempotence_key=renewal["_id"]
+            )
+
+    async def _attempt(self, renewal: Dict[str, Any]) -> Dict[str, Any]:
+        """Круг попыток списания; возвращает обновленную запись"""
+        key = renewal["_id"]
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt))
+
+            try:
+                payment = await self._charge(renewal)
+            except PaymentTemporaryError as e:
+                renewal = await self._update(key, {"last_error": str(e)})
+                continue
+
+            if payment is None:
+                # ЮKassa отклонила запрос (способ оплаты, настройки магазина) - повтор не поможет
+                return await self._update(key, {"status": RENEWAL_ERROR, "last_error": "payment request rejected"})
+
+            status = payment["status"]
+            if status == "succeeded":
+                return await self._update(key, {"status": RENEWAL_SUCCEEDED, "payment_id": payment["id"]})
+            if status == "canceled":
+                return await self._update(key, {
+                    "status": RENEWAL_CANCELED,
+                    "payment_id": payment["id"],
+                    "last_error": payment.get("cancellation_reason")
+                })
+
+            # pending: платеж еще обрабатывается - дальше опрашиваем его статус
+            renewal = await self._update(key, {"payment_id": payment["id"], "last_error": f"payment {status}"})
+
+        next_attempt_at = datetime.utcnow() + self.retry_interval
+        if next_attempt_at > renewal["created_at"] + IDEMPOTENCE_WINDOW:
+            logger.error(f"Renewal {key} failed: temporary errors for {IDEMPOTENCE_WINDOW}, last: {renewal.get('last_error')}")
+            return await self._update(key, {"status": RENEWAL_ERROR}, attempt=False)
+
+        logger.warning(f"Renewal {key} postponed until {next_attempt_at}: {renewal.get('last_error')}")
+        return await self._update(key, {"next_attempt_at": next_attempt_at}, attempt=False)
+
+    def _schedule(self, kind: str, subscription_id: ObjectId, end_date: datetime, due_at: datetime) -> None:
+        scheduler = self.subscription_service.event_scheduler
+        if scheduler:
+            scheduler.schedule_event(kind, subscription_id, end_date, due_at)
+
+    async def _settle(self, renewal: Dict[str, Any], subscription: Dict[str, Any]) -> None:
+        """Применить результат продления к подписке"""
+        status = renewal["status"]
+        subscription_id = subscription["_id"]
+        end_date = subscription["end_date"]
+
+        if status == RENEWAL_SUCCEEDED:
+            await self._on_succeeded(renewal, subscription)
+        elif status == RENEWAL_CANCELED:
+            await self._on_canceled(renewal, subscription)
+        elif status == RENEWAL_ERROR:
+            # Без кика: подписка закончится в свой срок
+            if await self.subscription_service.close_renewal(subscription_id, end_date):
+                await self._send(subscription["user_id"], self._error_text(end_date))
+        else:
+            self._schedule(RENEW, subscription_id, end_date, renewal["next_attempt_at"])
+
+    async def _on_succeeded(self, renewal: Dict[str, Any], subscription: Dict[str, Any]) -> None:
+        user_id = subscription["user_id"]
+        payment_id = renewal["payment_id"]
+
+        # Повторный вызов (после перезапуска) не дублирует платеж и продление
+        try:
+            if not await self.subscription_service.get_payment(payment_id):
+                await self.subscription_service.save_payment(
+                    user_id=user_id,
+                    payment_id=payment_id,
+                    amount=renewal["amount"],
+                    status='succeeded'
+                )
+                await self.subscription_service.link_payment_to_subscription(payment_id, subscription["_id"])
+        except Exception as e:
+            logger.error(f"Error saving renewal payment {payment_id}: {e}")
+
+        extended = await self.subscription_service.extend_subscription(
+            subscription["_id"],
+            payment_id,
+            end_date=subscription["end_date"]
+        )
+        if not extended:
+            return
+
+        new_end_date = subscription["end_date"] + timedelta(days=config.SUBSCRIPTION_DAYS)
+        text = f"""✅ **Подписка успешно продлена!**
+
+💳 Списано: {renewal['amount']:.0f}₽
+📅 Подписка действует до: {new_end_date.strftime('%d.%m.%Y')}
+
+Спасибо за то, что остаетесь с нами! 🌟"""
+        await self._send(user_id, text)
+        logger.info(f"Successfully renewed subscription for user {user_id}")
+
+    async def _on_canceled(self, renewal: Dict[str, Any], subscription: Dict[str, Any]) -> None:
+        user_id = subscription["user_id"]
+        logger.warning(f"Auto-renewal payment canceled for user {user_id}: {renewal.get('last_error')}")
+
+        # Деактивируем подписку (один раз за период) и удаляем из канала
+        expired, _ = await self.subscription_service.membership.expire(subscription["_id"], subscription["end_date"])
+        if not expired:
+            return
+
+        text = f"""❌ **Не удалось продлить подписку**
+
+К сожалению, автоматическое списание не прошло.
+
+💳 Сумма: {renewal['amount']:.0f}₽
+
+Возможные причины:
+• Недостаточно средств на карте
+• Карта заблокирована
+• Истек срок действия карты
+
+Вы были удалены из канала. Чтобы восстановить доступ, оформите подписку заново."""
+        await self._send(user_id, text)
+        logger.info(f"User {user_id} removed from channel due to failed payment")
+
+    @staticmethod
+    def _error_text(end_date: datetime) -> str:
+        return f"""⚠️ **Не удалось выполнить автопродление**
+
+Платеж за следующий период провести не получилось.
+
+📅 Подписка действует до: {end_date.strftime('%d.%m.%Y %H:%M')}
+
+Чтобы не потерять доступ, продлите подписку вручную."""
+
+    async def _send(self, user_id: int, text: str) -> None:
+        try:
+            await self.bot.send_message(chat_id=user_id, text=text, parse_mode="Markdown")
+        except Exception as e:
+            logger.error(f"Error sending renewal notification to user {user_id}: {e}")
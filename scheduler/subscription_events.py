@@ -0,0 +1,206 @@
+"""
+Планировщик событий подписок
+
+Вместо периодических проходов по окнам end_date держит в памяти min-heap
+ближайших событий каждой активной подписки: напоминания за 3 дня и за
+1 день, попытку автопродления и окончание. Heap заполняется один раз
+запросом по индексу при запуске и пополняется, когда подписка создается
+или продлевается. Событие срабатывает в свое время; обработчик атомарно
+забирает его в базе (см. SubscriptionService.claim_*), поэтому устаревшие
+события (подписка продлена или отменена) просто ничего не делают.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_3_DAYS = "notify_3_days"
+NOTIFY_1_DAY = "notify_1_day"
+RENEW = "renew"
+EXPIRE = "expire"
+
+# При одинаковом времени: напоминание раньше списания, списание раньше окончания
+EVENT_PRIORITY = {NOTIFY_3_DAYS: 0, NOTIFY_1_DAY: 1, RENEW: 2, EXPIRE: 3}
+
+# Максимальный сон между проверками heap (на случай перевода системных часов)
+MAX_SLEEP = 60
+
+# Обработчик события: (ID подписки, end_date на момент планирования)
+EventHandler = Callable[[ObjectId, datetime], Awaitable[Any]]
+
+
+class SubscriptionEventScheduler:
+    """Очередь событий подписок по времени срабатывания"""
+
+    def __init__(self, subscription_service, handlers: Dict[str, EventHandler], concurrency: int = 10):
+        """
+        Args:
+            subscription_service: SubscriptionService (источник подписок при запуске)
+            handlers: Обработчики по типу события; события без обработчика не планируются
+            concurrency: Сколько событий обрабатывается одновременно
+        """
+        self.subscription_service = subscription_service
+        self.handlers = handlers
+        self.concurrency = concurrency
+
+        # (время, приоритет, порядковый номер, тип, ID подписки, end_date)
+        self._heap: List[Tuple[datetime, int, int, str, ObjectId, datetime]] = []
+        self._keys: Set[Tuple[ObjectId, str, datetime]] = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # События одной подписки выполняются по очереди: ID -> [блокировка, ожидающих]
+        self._locks: Dict[ObjectId, list] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop_task is not None and not self._loop_task.done()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @staticmethod
+    def events_for(subscription: Dict[str, Any]) -> List[Tuple[str, datetime]]:
+        """Еще не выполненные события подписки: [(тип, время)]"""
+        end_date = subscription["end_date"]
+        events = []
+
+        if not subscription.get("notified_3_days"):
+            events.append((NOTIFY_3_DAYS, end_date - timedelta(days=3)))
+        if not subscription.get("notified_1_day"):
+            events.append((NOTIFY_1_DAY, end_date - timedelta(days=1)))
+        if (
+            subscription.get("auto_renew")
+            and subscription.get("payment_method_id")
+            and not subscription.get("renewal_attempted")
+        ):
+            events.append((RENEW, end_date - timedelta(days=1)))
+        events.append((EXPIRE, end_date))
+
+        return events
+
+    def _push(self, kind: str, subscription_id: ObjectId, end_date: datetime, due_at: datetime) -> bool:
+        key = (subscription_id, kind, end_date)
+        if kind not in self.handlers or key in self._keys:
+            return False
+        self._keys.add(key)
+        heapq.heappush(
+            self._heap,
+            (due_at, EVENT_PRIORITY[kind], next(self._counter), kind, subscription_id, end_date)
+        )
+        return True
+
+    def _wake_if_earliest(self, earliest: Optional[datetime]) -> None:
+        # Новое событие раньше текущего ближайшего - пересчитать время сна
+        if self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def schedule(self, subscription: Dict[str, Any]) -> None:
+        """Добавить события подписки (повторный вызов для тех же дат ничего не меняет)"""
+        earliest = self._heap[0][0] if self._heap else None
+        for kind, due_at in self.events_for(subscription):
+            self._push(kind, subscription["_id"], subscription["end_date"], due_at)
+        self._wake_if_earliest(earliest)
+
+    def schedule_event(self, kind: str, subscription_id: ObjectId, end_date: datetime, due_at: datetime) -> bool:
+        """
+        Запланировать одно событие на произвольное время (например, повтор продления)
+
+        Returns:
+            False, если такое событие для этого периода уже в очереди
+        """
+        earliest = self._heap[0][0] if self._heap else None
+        added = self._push(kind, subscription_id, end_date, due_at)
+        self._wake_if_earliest(earliest)
+        return added
+
+    async def seed(self) -> int:
+        """Заполнить очередь активными подписками из базы"""
+        count = 0
+        async for subscription in self.subscription_service.iter_active_subscriptions():
+            self.schedule(subscription)
+            count += 1
+        return count
+
+    @staticmethod
+    def _is_relevant(kind: str, end_date: datetime, now: datetime) -> bool:
+        """Не слать запоздавшие напоминания (например, после простоя бота)"""
+        if kind == NOTIFY_3_DAYS:
+            # Меньше суток до конца - хватит напоминания за 1 день
+            return end_date - now > timedelta(days=1)
+        if kind == NOTIFY_1_DAY:
+            return end_date > now
+        return True
+
+    async def _run_event(self, kind: str, subscription_id: ObjectId, end_date: datetime) -> None:
+        entry = self._locks.setdefault(subscription_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._semaphore:
+                await self.handlers[kind](subscription_id, end_date)
+        except Exception as e:
+            logger.error(f"Error handling {kind} for subscription {subscription_id}: {e}", exc_info=True)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(subscription_id, None)
+
+    def _dispatch(self, kind: str, subscription_id: ObjectId, end_date: datetime) -> None:
+        task = asyncio.create_task(self._run_event(kind, subscription_id, end_date))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+
+            while self._heap and self._heap[0][0] <= now:
+                _, _, _, kind, subscription_id, end_date = heapq.heappop(self._heap)
+                self._keys.discard((subscription_id, kind, end_date))
+                if self._is_relevant(kind, end_date, now):
+                    self._dispatch(kind, subscription_id, end_date)
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(timeout, max((self._heap[0][0] - now).total_seconds(), 0))
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Загрузить подписки и запустить обработку событий"""
+        if self.running:
+            return
+        count = await self.seed()
+        self._loop_task = asyncio.create_task(self._run())
+        logger.info(f"Subscription event scheduler started: {count} subscriptions, {len(self._heap)} events")
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Остановить планировщик, дав начатым обработчикам до timeout секунд"""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        logger.info("Subscription event scheduler stopped")
@@ -1,12 +1,16 @@
 """
-Сервисы для работы с подписками
+Сервисы для работы с подписками и доступами
 """
 
 from .subscription_service import SubscriptionService
 from .subscription_payment_service import SubscriptionPaymentService
+from .entitlement_service import EntitlementService, Entitlement, entitlement_service
 
 __all__ = [
     'SubscriptionService',
-    'SubscriptionPaymentService'
+    'SubscriptionPaymentService',
+    'EntitlementService',
+    'Entitlement',
+    'entitlement_service'
 ]
 
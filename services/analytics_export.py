@@ -0,0 +1,262 @@
+"""
+Выгрузка аналитики в Excel
+
+Книга пишется в write-only режиме openpyxl: строки уходят во временные
+файлы листов, а не копятся в памяти. Пользователи и покупки читаются
+агрегацией Motor пачками по batch_size (число покупок считается в той же
+агрегации через $lookup), запись пачки и сохранение книги выполняются в
+отдельном потоке, чтобы не блокировать event loop.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+
+from data import (
+    get_all_courses,
+    get_all_consultations,
+    get_all_guides,
+    get_course_by_slug,
+    get_consultation_by_slug,
+    get_guide_by_id
+)
+from database.repositories import UserRepository, PaymentRepository
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%d.%m.%Y %H:%M'
+
+HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+HEADER_FONT = Font(bold=True, color="FFFFFF", size=12)
+
+USER_HEADERS = ['ID', 'Telegram ID', 'Username', 'Имя', 'Фамилия', 'Дата регистрации', 'Последняя активность', 'Покупок']
+PAYMENT_HEADERS = ['ID', 'Пользователь', 'Продукт', 'Сумма, ₽', 'Статус', 'Дата создания', 'Дата оплаты']
+
+# Пользователи (новые сверху) с числом успешных покупок
+USERS_PIPELINE = [
+    {"$sort": {"created_at": -1}},
+    {"$lookup": {
+        "from": "payments",
+        "localField": "_id",
+        "foreignField": "user_id",
+        "pipeline": [
+            {"$match": {"status": "succeeded"}},
+            {"$group": {"_id": None, "count": {"$sum": 1}}}
+        ],
+        "as": "purchases"
+    }},
+    {"$project": {
+        "telegram_id": 1,
+        "username": 1,
+        "first_name": 1,
+        "last_name": 1,
+        "created_at": 1,
+        "last_activity": 1,
+        "purchases": {"$ifNull": [{"$first": "$purchases.count"}, 0]}
+    }}
+]
+
+# Все платежи (новые сверху) с именем покупателя
+PAYMENTS_PIPELINE = [
+    {"$sort": {"created_at": -1}},
+    {"$lookup": {
+        "from": "users",
+        "localField": "user_id",
+        "foreignField": "_id",
+        "pipeline": [{"$project": {"_id": 0, "username": 1, "first_name": 1}}],
+        "as": "user"
+    }},
+    {"$project": {
+        "product_type": 1,
+        "course_slug": 1,
+        "consultation_slug": 1,
+        "product_id": 1,
+        "amount": 1,
+        "status": 1,
+        "created_at": 1,
+        "paid_at": 1,
+        "user": {"$first": "$user"}
+    }}
+]
+
+
+def _format_date(value: Optional[datetime]) -> str:
+    return value.strftime(DATE_FORMAT) if value else '-'
+
+
+def _product_name(payment: Dict[str, Any]) -> str:
+    """Название продукта платежа для отчета"""
+    product_type = payment.get('product_type')
+
+    if product_type == 'course' and payment.get('course_slug'):
+        course = get_course_by_slug(payment['course_slug'])
+        return f"Курс: {course['name']}" if course else "Курс"
+    if product_type == 'consultation' and payment.get('consultation_slug'):
+        consultation = get_consultation_by_slug(payment['consultation_slug'])
+        return f"Консультация: {consultation['name']}" if consultation else "Консультация"
+    if product_type == 'guide' and payment.get('product_id'):
+        guide = get_guide_by_id(payment['product_id'])
+        return f"Гайд: {guide['name']}" if guide else "Гайд"
+    return product_type or "Неизвестно"
+
+
+def _user_row(user: Dict[str, Any]) -> List[Any]:
+    return [
+        str(user['_id']),
+        user.get('telegram_id'),
+        user.get('username') or '-',
+        user.get('first_name') or '-',
+        user.get('last_name') or '-',
+        _format_date(user.get('created_at')),
+        _format_date(user.get('last_activity')),
+        user.get('purchases', 0)
+    ]
+
+
+def _payment_row(payment: Dict[str, Any]) -> List[Any]:
+    user = payment.get('user') or {}
+    return [
+        str(payment['_id']),
+        user.get('username') or user.get('first_name') or 'Пользователь',
+        _product_name(payment),
+        payment.get('amount'),
+        payment.get('status'),
+        _format_date(payment.get('created_at')),
+        _format_date(payment.get('paid_at'))
+    ]
+
+
+class AnalyticsExporter:
+    """Построение Excel-отчета по пользователям и покупкам"""
+
+    def __init__(self, db: AsyncIOMotorDatabase, batch_size: int = 1000):
+        """
+        Args:
+            db: База MongoDB
+            batch_size: Сколько строк читать из базы и записывать за раз
+        """
+        self.db = db
+        self.batch_size = batch_size
+
+    def _header_row(self, ws, headers: List[str]) -> List[WriteOnlyCell]:
+        cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.fill = HEADER_FILL
+            cell.font = HEADER_FONT
+            cell.alignment = Alignment(horizontal='center')
+            cells.append(cell)
+        return cells
+
+    @staticmethod
+    def _append_rows(ws, docs: List[Dict[str, Any]], to_row: Callable[[Dict[str, Any]], List[Any]]) -> None:
+        for doc in docs:
+            ws.append(to_row(doc))
+
+    async def _stream_sheet(
+        self,
+        ws,
+        collection: str,
+        pipeline: List[Dict[str, Any]],
+        to_row: Callable[[Dict[str, Any]], List[Any]]
+    ) -> int:
+        """Запись результата агрегации на лист пачками, возвращает число строк"""
+        cursor = self.db[collection].aggregate(
+            pipeline,
+            allowDiskUse=True,
+            batchSize=self.batch_size
+        )
+        written = 0
+
+        while True:
+            docs = await cursor.to_list(length=self.batch_size)
+            if not docs:
+                break
+            await asyncio.to_thread(self._append_rows, ws, docs, to_row)
+            written += len(docs)
+
+        return written
+
+    async def _collect_stats(self) -> List[tuple]:
+        """Показатели для листа общей статистики"""
+        user_repo = UserRepository(self.db)
+        payment_repo = PaymentRepository(self.db)
+
+        week_ago = datetime.utcnow() - timedelta(days=7)
+        month_ago = datetime.utcnow() - timedelta(days=30)
+
+        total_revenue = await payment_repo.sum_by_status('succeeded')
+        week_revenue = await payment_repo.sum_since(week_ago, 'succeeded')
+        month_revenue = await payment_repo.sum_since(month_ago, 'succeeded')
+
+        return [
+            ('ПОЛЬЗОВАТЕЛИ', ''),
+            ('Всего пользователей', await user_repo.count()),
+            ('Активных за неделю', await user_repo.count_active_since(week_ago)),
+            ('Активных за месяц', await user_repo.count_active_since(month_ago)),
+            ('Новых за неделю', await user_repo.count_created_since(week_ago)),
+            ('Новых за месяц', await user_repo.count_created_since(month_ago)),
+            ('', ''),
+            ('ФИНАНСЫ', ''),
+            ('Всего покупок', await payment_repo.count_by_status('succeeded')),
+            ('Общая выручка, ₽', f'{total_revenue:,.2f}'),
+            ('Покупок за неделю', await payment_repo.count_since(week_ago, 'succeeded')),
+            ('Выручка за неделю, ₽', f'{week_revenue:,.2f}'),
+            ('Покупок за месяц', await payment_repo.count_since(month_ago, 'succeeded')),
+            ('Выручка за месяц, ₽', f'{month_revenue:,.2f}'),
+            ('', ''),
+            ('КОНТЕНТ', ''),
+            ('Курсов', len(get_all_courses())),
+            ('Консультаций', len(get_all_consultations())),
+            ('Гайдов', len(get_all_guides())),
+        ]
+
+    async def export(self, path: str) -> None:
+        """
+        Построить отчет и сохранить в файл
+
+        Args:
+            path: Путь к .xlsx файлу
+        """
+        wb = Workbook(write_only=True)
+
+        # Лист 1: Общая статистика
+        ws_stats = wb.create_sheet("Общая статистика")
+        ws_stats.column_dimensions['A'].width = 30
+        ws_stats.column_dimensions['B'].width = 20
+
+        title = WriteOnlyCell(ws_stats, value='Общая статистика бота')
+        title.font = Font(bold=True, size=14)
+        ws_stats.append([title])
+        ws_stats.append([])
+        ws_stats.append(self._header_row(ws_stats, ['Показатель', 'Значение']))
+
+        for label, value in await self._collect_stats():
+            if label and not value:
+                label_cell = WriteOnlyCell(ws_stats, value=label)
+                label_cell.font = Font(bold=True)
+                ws_stats.append([label_cell, value])
+            else:
+                ws_stats.append([label, value])
+
+        # Лист 2: Пользователи
+        ws_users = wb.create_sheet("Пользователи")
+        for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
+            ws_users.column_dimensions[col].width = 15
+        ws_users.append(self._header_row(ws_users, USER_HEADERS))
+        users_count = await self._stream_sheet(ws_users, 'users', USERS_PIPELINE, _user_row)
+
+        # Лист 3: Покупки
+        ws_payments = wb.create_sheet("Покупки")
+        for col, width in zip(['A', 'B', 'C', 'D', 'E', 'F', 'G'], [26, 20, 30, 12, 12, 18, 18]):
+            ws_payments.column_dimensions[col].width = width
+        ws_payments.append(self._header_row(ws_payments, PAYMENT_HEADERS))
+        payments_count = await self._stream_sheet(ws_payments, 'payments', PAYMENTS_PIPELINE, _payment_row)
+
+        await asyncio.to_thread(wb.save, path)
+        logger.info(f"Analytics exported: {users_count} users, {payments_count} payments")
@@ -0,0 +1,464 @@
+"""
+Сервис массовых рассылок
+
+Получатели читаются курсором из users (по возрастанию telegram_id) и
+рассылаются несколькими воркерами через общий token bucket. Прогресс
+(последний обработанный telegram_id и счетчики) периодически сохраняется
+в коллекции broadcasts, поэтому после перезапуска рассылка продолжается
+с места остановки. Пользователи, заблокировавшие бота, помечаются
+is_active=False и в следующие рассылки не попадают.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from database.mongodb import mongodb
+from database.repositories import UserRepository
+from utils.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Получатели рассылки
+RECIPIENTS_FILTER = {"is_active": {"$ne": False}}
+
+# heartbeat_at рассылки, отпущенной при остановке процесса
+RELEASED_AT = datetime(1970, 1, 1)
+
+# Попыток отправки одному получателю (повторяются только после retry_after)
+MAX_SEND_ATTEMPTS = 3
+
+
+def get_broadcast_cancel_keyboard(broadcast_id: str) -> InlineKeyboardMarkup:
+    """Кнопка остановки рассылки под сообщением с прогрессом"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⏹ Остановить рассылку", callback_data=f"broadcast_cancel_{broadcast_id}")]
+    ])
+
+
+class BroadcastJob:
+    """Выполнение одной рассылки"""
+
+    def __init__(self, service: 'BroadcastService', doc: Dict[str, Any]):
+        self.service = service
+        self.bot = service.bot
+        self.broadcast_id: ObjectId = doc["_id"]
+        self.content: Dict[str, Any] = doc["content"]
+        self.admin_chat_id: int = doc["admin_chat_id"]
+        self.status_message_id: Optional[int] = doc.get("status_message_id")
+        self.total: int = doc.get("total", 0)
+
+        self.sent: int = doc.get("sent", 0)
+        self.blocked: int = doc.get("blocked", 0)
+        self.failed: int = doc.get("failed", 0)
+
+        # Все получатели с telegram_id <= checkpoint уже обработаны
+        self.checkpoint: int = doc.get("last_telegram_id", 0)
+        self._dispatched: "OrderedDict[int, bool]" = OrderedDict()
+        self._blocked_ids: List[int] = []
+        self.cancelled = False
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    async def run(self) -> None:
+        """Разослать всем оставшимся получателям"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.service.concurrency * 2)
+        producer = asyncio.create_task(self._produce(queue))
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.service.concurrency)]
+        reporter = asyncio.create_task(self._report_loop(producer))
+
+        try:
+            try:
+                await producer
+            except asyncio.CancelledError:
+                # Рассылку остановил админ - очередь разберут воркеры без отправки
+                if not self.cancelled:
+                    raise
+            await queue.join()
+        except asyncio.CancelledError:
+            # Остановка бота: сохраняем контрольную точку и отпускаем рассылку,
+            # чтобы после перезапуска ее сразу подхватили
+            await self._save_progress(release=True)
+            raise
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(reporter, *workers, return_exceptions=True)
+
+        await self._finish()
+
+    async def _produce(self, queue: asyncio.Queue) -> None:
+        """Чтение получателей курсором после контрольной точки"""
+        user_repo = UserRepository(mongodb.get_database())
+        last_id = self.checkpoint
+
+        while True:
+            try:
+                users = user_repo.iter_users(
+                    {**RECIPIENTS_FILTER, "telegram_id": {"$gt": last_id}},
+                    fields=("telegram_id",),
+                    sort=[("telegram_id", 1)]
+                )
+
+                async for user in users:
+                    telegram_id = user.telegram_id
+                    self._dispatched[telegram_id] = False
+                    await queue.put(telegram_id)
+                    last_id = telegram_id
+                return
+            except PyMongoError as e:
+                # Курсор мог истечь за долгую паузу - продолжаем с последнего
+                logger.warning(f"Broadcast {self.broadcast_id}: recipients cursor failed ({e}), reopening")
+                await asyncio.sleep(1)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            telegram_id = await queue.get()
+            try:
+                if not self.cancelled:
+                    result = await self._send(telegram_id)
+                    if result == "sent":
+                        self.sent += 1
+                    elif result == "blocked":
+                        self.blocked += 1
+                        self._blocked_ids.append(telegram_id)
+                    else:
+                        self.failed += 1
+                self._complete(telegram_id)
+            finally:
+                queue.task_done()
+
+    def _complete(self, telegram_id: int) -> None:
+        """Отметить получателя обработанным и сдвинуть контрольную точку"""
+        self._dispatched[telegram_id] = True
+        while self._dispatched:
+            first_id, done = next(iter(self._dispatched.items()))
+            if not done:
+                break
+            self._dispatched.popitem(last=False)
+            self.checkpoint = first_id
+
+    async def _send(self, chat_id: int) -> str:
+        """
+        Отправка одному получателю
+
+        Returns:
+            'sent', 'blocked' или 'failed'
+        """
+        media_type = self.content.get("media_type")
+
+        for _ in range(MAX_SEND_ATTEMPTS):
+            await self.service.limiter.acquire()
+            try:
+                if media_type == "photo":
+                    await self.bot.send_photo(
+                        chat_id=chat_id,
+                        photo=self.content["photo_id"],
+                        caption=self.content.get("caption")
+                    )
+                elif media_type == "video":
+                    await self.bot.send_video(
+                        chat_id=chat_id,
+                        video=self.content["video_id"],
+                        caption=self.content.get("caption")
+                    )
+                else:
+                    await self.bot.send_message(chat_id=chat_id, text=self.content["text"])
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Лимит Telegram: останавливаем всех воркеров, а не только этот
+                logger.warning(f"Broadcast {self.broadcast_id}: flood control, retry in {e.retry_after}s")
+                self.service.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                logger.debug(f"Broadcast {self.broadcast_id}: cannot send to {chat_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logger.warning(f"Broadcast {self.broadcast_id}: error sending to {chat_id}: {e}")
+                return "failed"
+
+        return "failed"
+
+    async def _report_loop(self, producer: asyncio.Task) -> None:
+        """Периодическое сохранение прогресса и обновление сообщения админу"""
+        while True:
+            await asyncio.sleep(self.service.progress_interval)
+            status = await self._save_progress()
+            if status == "cancelled" and not self.cancelled:
+                logger.info(f"Broadcast {self.broadcast_id} cancelled")
+                self.cancelled = True
+                producer.cancel()
+            await self._update_status_message(final=False)
+
+    async def _save_progress(self, status: Optional[str] = None, release: bool = False) -> Optional[str]:
+        """
+        Сохранить контрольную точку, пометить заблокировавших бота
+
+        Args:
+            status: Итоговый статус рассылки
+            release: Сбросить heartbeat_at, чтобы рассылку мог продолжить любой процесс
+
+        Returns:
+            Текущий статус рассылки в базе
+        """
+        db = mongodb.get_database()
+
+        blocked_ids, self._blocked_ids = self._blocked_ids, []
+        if blocked_ids:
+            try:
+                await db.users.update_many(
+                    {"telegram_id": {"$in": blocked_ids}},
+                    {"$set": {"is_active": False}}
+                )
+            except PyMongoError as e:
+                logger.error(f"Broadcast {self.broadcast_id}: error marking blocked users: {e}")
+                self._blocked_ids.extend(blocked_ids)
+
+        updates = {
+            "last_telegram_id": self.checkpoint,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "heartbeat_at": RELEASED_AT if release else datetime.utcnow()
+        }
+        if status:
+            updates["status"] = status
+            updates["finished_at"] = datetime.utcnow()
+
+        try:
+            doc = await db.broadcasts.find_one_and_update(
+                {"_id": self.broadcast_id},
+                {"$set": updates},
+                projection={"status": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            logger.error(f"Broadcast {self.broadcast_id}: error saving progress: {e}")
+            return None
+        return doc.get("status") if doc else None
+
+    async def _update_status_message(self, final: bool) -> None:
+        """Редактирование сообщения с прогрессом (не чаще progress_interval)"""
+        if not self.status_message_id:
+            return
+
+        if final:
+            title = "⏹ Рассылка остановлена" if self.cancelled else "✅ Рассылка завершена!"
+            reply_markup = None
+        else:
+            percent = int(self.processed * 100 / self.total) if self.total else 0
+            title = f"📤 Рассылка: {self.processed} из {self.total} ({percent}%)"
+            reply_markup = get_broadcast_cancel_keyboard(str(self.broadcast_id))
+
+        text = (
+            f"{title}\n\n"
+            f"Успешно: {self.sent}\n"
+            f"Заблокировали бота: {self.blocked}\n"
+            f"Ошибок: {self.failed}"
+        )
+
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=self.admin_chat_id,
+                message_id=self.status_message_id,
+                reply_markup=reply_markup
+            )
+        except TelegramBadRequest:
+            # "message is not modified" или сообщение удалено
+            pass
+        except Exception as e:
+            logger.warning(f"Broadcast {self.broadcast_id}: cannot update progress message: {e}")
+
+    async def _finish(self) -> None:
+        status = "cancelled" if self.cancelled else "done"
+        await self._save_progress(status=status)
+        await self._update_status_message(final=True)
+        logger.info(
+            f"Broadcast {self.broadcast_id} {status}: sent={self.sent}, "
+            f"blocked={self.blocked}, failed={self.failed}"
+        )
+
+
+class BroadcastService:
+    """Запуск, остановка и возобновление рассылок"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = 25.0,
+        concurrency: int = 10,
+        progress_interval: float = 5.0
+    ):
+        """
+        Args:
+            bot: Бот, от имени которого идет рассылка
+            rate: Сообщений в секунду на всю рассылку (лимит Telegram - около 30)
+            concurrency: Одновременных запросов к Telegram
+            progress_interval: Период сохранения прогресса и обновления сообщения админу
+        """
+        self.bot = bot
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        # Общий лимит на процесс: параллельные рассылки делят его между собой
+        self.limiter = RateLimiter(rate)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+
+    @property
+    def stale_after(self) -> float:
+        """Сколько секунд без heartbeat_at рассылка считается брошенной"""
+        return self.progress_interval * 3
+
+    async def start(self, content: Dict[str, Any], admin_chat_id: int) -> str:
+        """
+        Запустить рассылку в фоне
+
+        Args:
+            content: media_type ('text' / 'photo' / 'video'), text, photo_id, video_id, caption
+            admin_chat_id: Чат админа для сообщения с прогрессом
+
+        Returns:
+            ID рассылки
+        """
+        db = mongodb.get_database()
+        total = await db.users.count_documents(RECIPIENTS_FILTER)
+
+        broadcast_id = ObjectId()
+        status_msg = await self.bot.send_message(
+            chat_id=admin_chat_id,
+            text=f"📤 Начинаю рассылку для {total} пользователей...",
+            reply_markup=get_broadcast_cancel_keyboard(str(broadcast_id))
+        )
+
+        now = datetime.utcnow()
+        await db.broadcasts.insert_one({
+            "_id": broadcast_id,
+            "status": "running",
+            "content": content,
+            "admin_chat_id": admin_chat_id,
+            "status_message_id": status_msg.message_id,
+            "total": total,
+            "last_telegram_id": 0,
+            "sent": 0,
+            "blocked": 0,
+            "failed": 0,
+            "created_at": now,
+            "heartbeat_at": now
+        })
+
+        logger.info(f"Broadcast {broadcast_id} started for {total} users")
+        self._launch(broadcast_id)
+        return str(broadcast_id)
+
+    async def cancel(self, broadcast_id: str) -> bool:
+        """
+        Остановить рассылку (в любом процессе, который ее выполняет)
+
+        Returns:
+            True, если рассылка была запущена
+        """
+        db = mongodb.get_database()
+        result = await db.broadcasts.update_one(
+            {"_id": ObjectId(broadcast_id), "status": "running"},
+            {"$set": {"status": "cancelled"}}
+        )
+        return result.modified_count > 0
+
+    async def resume_unfinished(self) -> int:
+        """
+        Продолжить рассылки, прерванные перезапуском
+
+        Рассылка забирается, только если ее давно никто не обновлял:
+        работающую в другом процессе рассылку не задублируем.
+
+        Returns:
+            Количество возобновленных рассылок
+        """
+        db = mongodb.get_database()
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        resumed = 0
+
+        async for doc in db.broadcasts.find({"status": "running", "heartbeat_at": {"$lt": stale_before}}, {"_id": 1}):
+            claimed = await db.broadcasts.update_one(
+                {"_id": doc["_id"], "status": "running", "heartbeat_at": {"$lt": stale_before}},
+                {"$set": {"heartbeat_at": datetime.utcnow()}}
+            )
+            if claimed.modified_count and str(doc["_id"]) not in self._tasks:
+                logger.info(f"Resuming broadcast {doc['_id']}")
+                self._launch(doc["_id"])
+                resumed += 1
+
+        return resumed
+
+    async def _resume_loop(self) -> None:
+        while True:
+            try:
+                resumed = await self.resume_unfinished()
+                if resumed:
+                    logger.info(f"Resumed broadcasts: {resumed}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error resuming broadcasts: {e}", exc_info=True)
+            await asyncio.sleep(self.stale_after)
+
+    async def start_resuming(self) -> None:
+        """
+        Периодически продолжать брошенные рассылки
+
+        Проверка повторяется каждые stale_after секунд: после быстрого
+        перезапуска heartbeat_at прерванной рассылки еще свежий, и забрать
+        ее можно только со следующей проверки. Так же подхватываются
+        рассылки процесса, который упал во время работы.
+        """
+        if self._resume_task is not None and not self._resume_task.done():
+            return
+        self._resume_task = asyncio.create_task(self._resume_loop())
+
+    def _launch(self, broadcast_id: ObjectId) -> None:
+        key = str(broadcast_id)
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def _run(self, broadcast_id: ObjectId) -> None:
+        db = mongodb.get_database()
+        try:
+            doc = await db.broadcasts.find_one({"_id": broadcast_id})
+            if not doc:
+                return
+            await BroadcastJob(self, doc).run()
+        except asyncio.CancelledError:
+            # Остановка бота: статус остается running, продолжим после перезапуска
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} failed: {e}", exc_info=True)
+
+    async def shutdown(self) -> None:
+        """Прервать рассылки при остановке (прогресс уже сохранен контрольными точками)"""
+        if self._resume_task is not None:
+            self._resume_task.cancel()
+            try:
+                await self._resume_task
+            except asyncio.CancelledError:
+                pass
+            self._resume_task = None
+
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
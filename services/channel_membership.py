@@ -0,0 +1,253 @@
+"""
+Участие пользователей в платном канале
+
+Истекшие подписки обрабатываются пачками: обработчики событий окончания
+ставят подписку в очередь, воркер собирает до batch_size подписок,
+деактивирует их одним update_many и исключает пользователей из канала
+(ban + unban) через общий token bucket, который при retry_after от
+Telegram приостанавливает все запросы.
+
+Коллекция channel_members - журнал участия: member (подписка оформлена
+или пользователь вступил в канал), left (вышел сам), kicked (исключен
+ботом). Тех, кто уже не в канале, повторно не исключаем.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database.mongodb import mongodb
+from utils.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+MEMBER = "member"
+LEFT = "left"
+KICKED = "kicked"
+
+# Попыток одного вызова Bot API (повторяются только после retry_after)
+MAX_CALL_ATTEMPTS = 3
+
+# Сколько ждать, пока в пачку соберутся одновременно истекшие подписки
+BATCH_LINGER = 0.5
+
+
+class ChannelMembership:
+    """Исключение из канала и журнал участия"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        channel_id: str,
+        rate: float = 20.0,
+        batch_size: int = 100,
+        concurrency: int = 5
+    ):
+        """
+        Args:
+            bot: Экземпляр бота
+            channel_id: ID канала подписки
+            rate: Запросов к Bot API в секунду (исключение - два запроса)
+            batch_size: Максимум подписок в одной пачке
+            concurrency: Сколько пользователей исключается одновременно
+        """
+        self.bot = bot
+        self.channel_id = channel_id
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return mongodb.get_database().channel_members
+
+    # Журнал участия
+
+    async def mark(self, user_ids: Iterable[int], status: str) -> None:
+        """Записать статус участия пользователей"""
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"_id": user_id}, {"$set": {"status": status, "updated_at": now}}, upsert=True)
+            for user_id in set(user_ids)
+        ]
+        if not operations:
+            return
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Журнал - оптимизация: без записи пользователя просто исключат еще раз
+            logger.error(f"Error updating channel membership ledger: {e}")
+
+    async def _not_in_channel(self, user_ids: Set[int]) -> Set[int]:
+        """Пользователи, которые уже вышли или исключены"""
+        if not user_ids:
+            return set()
+        cursor = self.collection.find(
+            {"_id": {"$in": list(user_ids)}, "status": {"$in": [LEFT, KICKED]}},
+            {"_id": 1}
+        )
+        return {doc["_id"] async for doc in cursor}
+
+    # Вызовы Bot API
+
+    async def _call(self, method, **kwargs) -> bool:
+        for _ in range(MAX_CALL_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                await method(**kwargs)
+                return True
+            except TelegramRetryAfter as e:
+                # Ждут все запросы, а не только получивший ошибку
+                self.limiter.pause(e.retry_after)
+            except Exception as e:
+                logger.error(f"Error calling {method.__name__} for user {kwargs.get('user_id')}: {e}")
+                return False
+        return False
+
+    async def _kick(self, user_id: int) -> bool:
+        async with self._semaphore:
+            # Бан и сразу разбан: пользователь исключен, но может вернуться при продлении
+            if not await self._call(self.bot.ban_chat_member, chat_id=self.channel_id, user_id=user_id):
+                return False
+            return await self._call(self.bot.unban_chat_member, chat_id=self.channel_id, user_id=user_id)
+
+    async def remove(self, user_id: int) -> bool:
+        """Исключить одного пользователя сразу (без очереди)"""
+        if not self.channel_id:
+            logger.warning("SUBSCRIPTION_CHANNEL_ID not configured")
+            return False
+
+        kicked = await self._kick(user_id)
+        if kicked:
+            await self.mark([user_id], KICKED)
+            logger.info(f"Kicked user {user_id} from channel")
+        return kicked
+
+    # Пачки истекших подписок
+
+    async def expire(self, subscription_id: ObjectId, end_date: datetime) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Деактивировать подписку (если ее не продлили) и исключить пользователя
+
+        Returns:
+            (подписка, исключен): отключенная подписка или None, если она
+            уже продлена или отключена; исключен - пользователя нет в канале
+            (False, если у него есть другая активная подписка или исключить не удалось)
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((subscription_id, end_date, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[ObjectId, datetime, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + BATCH_LINGER
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await self._process(batch)
+            except asyncio.CancelledError:
+                for _, _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Error expiring {len(batch)} subscriptions: {e}", exc_info=True)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for subscription_id, _, future in batch:
+                if not future.done():
+                    future.set_result(results.get(subscription_id, (None, False)))
+
+    async def _process(
+        self,
+        batch: List[Tuple[ObjectId, datetime, asyncio.Future]]
+    ) -> Dict[ObjectId, Tuple[Dict[str, Any], bool]]:
+        db = mongodb.get_database()
+        now = datetime.utcnow()
+        ids = [subscription_id for subscription_id, _, _ in batch]
+
+        # Одна запись на пачку; метка показывает, какие подписки отключил именно этот вызов
+        token = ObjectId()
+        await db.subscriptions.update_many(
+            {
+                "is_active": True,
+                "$or": [
+                    {"_id": subscription_id, "end_date": end_date}
+                    for subscription_id, end_date, _ in batch
+                ]
+            },
+            {"$set": {"is_active": False, "expiry_batch": token}}
+        )
+        expired = await db.subscriptions.find(
+            {"_id": {"$in": ids}, "expiry_batch": token}
+        ).to_list(length=None)
+        if not expired:
+            return {}
+
+        users = {subscription["user_id"] for subscription in expired}
+
+        # Оформил новую подписку до окончания старой - остается в канале
+        subscribed = set(await db.subscriptions.distinct(
+            "user_id",
+            {"user_id": {"$in": list(users)}, "is_active": True, "end_date": {"$gt": now}}
+        ))
+        already_out = await self._not_in_channel(users - subscribed)
+        to_kick = users - subscribed - already_out
+
+        kicked: Set[int] = set()
+        if to_kick and self.channel_id:
+            outcomes = await asyncio.gather(*(self._kick(user_id) for user_id in to_kick))
+            kicked = {user_id for user_id, ok in zip(to_kick, outcomes) if ok}
+            await self.mark(kicked, KICKED)
+        elif to_kick:
+            logger.warning("SUBSCRIPTION_CHANNEL_ID not configured")
+
+        logger.info(
+            f"Expired {len(expired)} subscriptions: kicked {len(kicked)}/{len(to_kick)}, "
+            f"already out {len(already_out)}, still subscribed {len(subscribed)}"
+        )
+
+        removed = kicked | already_out
+        return {
+            subscription["_id"]: (subscription, subscription["user_id"] in removed)
+            for subscription in expired
+        }
+
+    async def stop(self) -> None:
+        """Остановить воркер (ожидающие подписки обработаются после перезапуска)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
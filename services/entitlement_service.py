@@ -0,0 +1,127 @@
+"""
+Сервис доступа к купленным курсам
+
+Отвечает на вопрос "оплатил ли пользователь курс" из кэша в памяти.
+Для каждого пользователя один раз загружается список оплаченных курсов
+(покрывающим индексом по payments), дальше навигация по урокам не делает
+запросов к платежам. Кэш сбрасывается при успешной оплате.
+"""
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+from config import config
+from database.mongodb import mongodb
+from database.repositories import PaymentRepository
+
+logger = logging.getLogger(__name__)
+
+# Типы продуктов, открывающих доступ к материалам в учебном боте
+COURSE_PRODUCT_TYPES = ['course', 'mini_course']
+
+
+class Entitlement:
+    """Доступ пользователя к одному курсу"""
+
+    __slots__ = ("course_slug", "product_type", "paid_at")
+
+    def __init__(self, course_slug: str, product_type: str, paid_at: Optional[datetime]):
+        self.course_slug = course_slug
+        self.product_type = product_type
+        self.paid_at = paid_at
+
+
+class EntitlementService:
+    """Кэш оплаченных курсов по пользователям"""
+
+    def __init__(self, ttl: float = 300.0, miss_refresh: float = 10.0, max_users: int = 10000):
+        """
+        Args:
+            ttl: Сколько секунд список доступов пользователя считается актуальным
+            miss_refresh: Через сколько секунд перезагрузить список, если курса
+                в нем нет (оплата могла пройти в другом процессе)
+            max_users: Максимум пользователей в кэше
+        """
+        self.ttl = ttl
+        self.miss_refresh = miss_refresh
+        self.max_users = max_users
+        self._cache: "OrderedDict[ObjectId, Tuple[float, Dict[str, Entitlement]]]" = OrderedDict()
+        # Растет при каждом сбросе: загрузка, начатая до сброса, не попадет в кэш
+        self._epoch = 0
+
+    async def _load(self, user_id: ObjectId) -> Dict[str, Entitlement]:
+        """
+        Загрузка оплаченных курсов из базы
+        
+        Запрос покрывается индексом payments
+        (user_id, status, product_type, course_slug, created_at, paid_at).
+        """
+        epoch = self._epoch
+        payment_repo = PaymentRepository(mongodb.get_database())
+        rows = await payment_repo.get_succeeded_purchases(user_id, COURSE_PRODUCT_TYPES)
+        # Как и раньше, для курса берется последний по времени создания платеж
+        rows.sort(key=lambda row: row.get("created_at") or datetime.min, reverse=True)
+
+        entitlements: Dict[str, Entitlement] = {}
+        for row in rows:
+            course_slug = row.get("course_slug")
+            if course_slug and course_slug not in entitlements:
+                entitlements[course_slug] = Entitlement(course_slug, row["product_type"], row.get("paid_at"))
+
+        if epoch == self._epoch:
+            self._cache[user_id] = (time.monotonic(), entitlements)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+
+        return entitlements
+
+    async def get_entitlements(self, user_id: ObjectId, max_age: Optional[float] = None) -> Dict[str, Entitlement]:
+        """
+        Оплаченные курсы пользователя (course_slug -> Entitlement),
+        от последней покупки к первой
+
+        Args:
+            user_id: ID пользователя в MongoDB
+            max_age: Допустимый возраст записи кэша (по умолчанию ttl)
+        """
+        cached = self._cache.get(user_id)
+        max_age = self.ttl if max_age is None else max_age
+
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            self._cache.move_to_end(user_id)
+            return cached[1]
+
+        return await self._load(user_id)
+
+    async def list_entitlements(self, user_id: ObjectId) -> List[Entitlement]:
+        """Оплаченные курсы пользователя списком"""
+        return list((await self.get_entitlements(user_id)).values())
+
+    async def get_entitlement(self, user_id: ObjectId, course_slug: str) -> Optional[Entitlement]:
+        """Доступ к курсу или None"""
+        entitlement = (await self.get_entitlements(user_id)).get(course_slug)
+        if entitlement is None:
+            # Нет в кэше - возможно, курс только что оплачен в другом процессе
+            entitlement = (await self.get_entitlements(user_id, max_age=self.miss_refresh)).get(course_slug)
+        return entitlement
+
+    async def has_access(self, user_id: ObjectId, course_slug: str) -> bool:
+        """Оплатил ли пользователь курс"""
+        return await self.get_entitlement(user_id, course_slug) is not None
+
+    def invalidate(self, user_id: Optional[ObjectId] = None) -> None:
+        """Сбросить кэш пользователя (или весь кэш)"""
+        self._epoch += 1
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id, None)
+
+
+# Глобальный экземпляр (общий для обработчиков, вебхука и фоновой проверки)
+entitlement_service = EntitlementService(ttl=config.ENTITLEMENT_CACHE_TTL)
@@ -0,0 +1,233 @@
+"""
+Запас пригласительных ссылок в канал подписки
+
+Ссылки создаются заранее фоновой задачей и лежат в коллекции invite_links.
+При покупке ссылка выдается одним find_one_and_update по частичному индексу,
+без запроса к Bot API; если запас пуст, ссылка создается на месте, как раньше.
+Запас пополняется до size, когда в нем остается меньше low_water ссылок.
+
+Каждая ссылка выдается одному пользователю. Срок действия ссылки - период
+подписки плюс shelf_life, поэтому выданная из запаса ссылка работает весь
+оплаченный период. Невыданные ссылки старше shelf_life и ссылки закончившихся
+подписок отзываются.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from pymongo import ReturnDocument
+
+from database.mongodb import mongodb
+from utils.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = "available"
+ISSUED = "issued"
+REVOKED = "revoked"
+
+# Попыток одного вызова Bot API (повторяются только после retry_after)
+MAX_CALL_ATTEMPTS = 3
+
+# Сколько входов разрешено по одной ссылке (повторный вход после выхода)
+MEMBER_LIMIT = 5
+
+
+class InviteLinkPool:
+    """Заранее созданные пригласительные ссылки"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        channel_id: str,
+        link_days: int,
+        size: int = 50,
+        low_water: int = 10,
+        shelf_life: int = 6 * 60 * 60,
+        rate: float = 5.0,
+        check_interval: int = 60
+    ):
+        """
+        Args:
+            bot: Экземпляр бота
+            channel_id: ID канала подписки
+            link_days: Период подписки в днях
+            size: Сколько ссылок держать в запасе (0 - не держать)
+            low_water: Пополнять запас, когда в нем меньше ссылок
+            shelf_life: Секунд, в течение которых созданная ссылка может быть выдана
+            rate: Запросов к Bot API в секунду
+            check_interval: Секунд между проверками запаса
+        """
+        self.bot = bot
+        self.channel_id = channel_id
+        self.link_days = link_days
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.shelf_life = timedelta(seconds=shelf_life)
+        self.check_interval = check_interval
+        self.limiter = RateLimiter(rate)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return mongodb.get_database().invite_links
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.channel_id) and self.size > 0
+
+    async def _call(self, method, **kwargs):
+        for attempt in range(MAX_CALL_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                return await method(**kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_CALL_ATTEMPTS - 1:
+                    raise
+                self.limiter.pause(e.retry_after)
+
+    async def _create(self, name: str) -> Tuple[str, datetime]:
+        """Создать ссылку: (ссылка, срок действия)"""
+        expire_date = datetime.utcnow() + timedelta(days=self.link_days) + self.shelf_life
+        link = await self._call(
+            self.bot.create_chat_invite_link,
+            chat_id=self.channel_id,
+            name=name,
+            expire_date=expire_date,
+            member_limit=MEMBER_LIMIT
+        )
+        return link.invite_link, expire_date
+
+    async def take(self, user_id: int, valid_until: datetime) -> str:
+        """
+        Выдать ссылку пользователю
+
+        Args:
+            user_id: Telegram ID пользователя
+            valid_until: Дата окончания подписки (после нее ссылка отзывается)
+
+        Returns:
+            Пригласительная ссылка
+        """
+        if not self.channel_id:
+            raise ValueError("SUBSCRIPTION_CHANNEL_ID not configured")
+
+        now = datetime.utcnow()
+        issued = {"status": ISSUED, "user_id": user_id, "issued_at": now, "valid_until": valid_until}
+
+        if self.enabled:
+            link = await self.collection.find_one_and_update(
+                {"status": AVAILABLE, "created_at": {"$gt": now - self.shelf_life}},
+                {"$set": issued},
+                sort=[("created_at", 1)],
+                projection={"invite_link": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            # Проверить, не пора ли пополнить запас
+            self._wakeup.set()
+            if link:
+                return link["invite_link"]
+            logger.warning(f"Invite link pool is empty, creating link for user {user_id} inline")
+
+        invite_link, expire_date = await self._create(f"Подписка для пользователя {user_id}")
+        await self.collection.insert_one({
+            "invite_link": invite_link,
+            "created_at": now,
+            "expire_date": expire_date,
+            **issued
+        })
+        logger.info(f"Created invite link for user {user_id}")
+        return invite_link
+
+    async def _fill(self) -> int:
+        """Пополнить запас, если он ниже low_water"""
+        fresh_since = datetime.utcnow() - self.shelf_life
+        available = await self.collection.count_documents(
+            {"status": AVAILABLE, "created_at": {"$gt": fresh_since}}
+        )
+        if available >= self.low_water:
+            return 0
+
+        created = 0
+        for _ in range(self.size - available):
+            invite_link, expire_date = await self._create("Подписка")
+            # Сразу в коллекцию: во время наплыва покупок ссылка нужна немедленно
+            await self.collection.insert_one({
+                "invite_link": invite_link,
+                "status": AVAILABLE,
+                "created_at": datetime.utcnow(),
+                "expire_date": expire_date
+            })
+            created += 1
+        return created
+
+    async def _revoke(self, query: dict) -> int:
+        now = datetime.utcnow()
+        links = await self.collection.find(query, {"invite_link": 1, "expire_date": 1}).to_list(length=None)
+
+        revoked: List = []
+        for link in links:
+            if link["expire_date"] <= now:
+                # Истекла сама - отзывать в Telegram нечего
+                revoked.append(link["_id"])
+                continue
+            try:
+                await self._call(self.bot.revoke_chat_invite_link, chat_id=self.channel_id, invite_link=link["invite_link"])
+            except TelegramRetryAfter:
+                break
+            except Exception as e:
+                # Ссылка уже недействительна - отзывать нечего
+                logger.warning(f"Error revoking invite link {link['_id']}: {e}")
+            revoked.append(link["_id"])
+
+        if revoked:
+            await self.collection.update_many(
+                {"_id": {"$in": revoked}},
+                {"$set": {"status": REVOKED, "revoked_at": now}}
+            )
+        return len(revoked)
+
+    async def _revoke_leftovers(self) -> int:
+        """Отозвать невыданные ссылки старше shelf_life и ссылки закончившихся подписок"""
+        now = datetime.utcnow()
+        stale = await self._revoke({"status": AVAILABLE, "created_at": {"$lte": now - self.shelf_life}})
+        ended = await self._revoke({"status": ISSUED, "valid_until": {"$lt": now}})
+        return stale + ended
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                revoked = await self._revoke_leftovers()
+                created = await self._fill() if self.size > 0 else 0
+                if revoked or created:
+                    logger.info(f"Invite link pool: created {created}, revoked {revoked}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error maintaining invite link pool: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Запустить пополнение запаса и отзыв старых ссылок"""
+        if not self.channel_id or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Invite link pool started (size: {self.size}, low water: {self.low_water})")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,107 @@
+"""
+Статистика для админ-панели
+
+Цифры считаются одной $facet-агрегацией на коллекцию (или читаются из
+счетчиков stats_counters, если они включены) и кэшируются на короткое
+время: повторные нажатия и другие админы получают готовый результат,
+а одновременные запросы ждут один общий расчет.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from config import config
+from database.mongodb import mongodb
+from database.counters import stats_counters
+from database.repositories import UserRepository, PaymentRepository
+
+logger = logging.getLogger(__name__)
+
+
+class StatsService:
+    """Кэш статистики админ-панели"""
+
+    def __init__(self, ttl: float = 30.0, period_days: int = 7):
+        """
+        Args:
+            ttl: Сколько секунд статистика считается актуальной
+            period_days: Период для "активных", "новых" и "за неделю"
+        """
+        self.ttl = ttl
+        self.period_days = period_days
+        self._stats: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._stats is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def get_dashboard_stats(self, subscription_service=None) -> Dict[str, Any]:
+        """
+        Статистика для кнопки "Статистика"
+
+        Args:
+            subscription_service: SubscriptionService, если подписки включены
+
+        Returns:
+            total_users, active_users, new_users, total_purchases, total_revenue,
+            week_purchases, week_revenue, subscriptions (dict или None)
+        """
+        if self._is_fresh():
+            return self._stats
+
+        async with self._lock:
+            # Пока ждали блокировку, статистику мог посчитать другой запрос
+            if not self._is_fresh():
+                self._stats = await self._load(subscription_service)
+                self._loaded_at = time.monotonic()
+            return self._stats
+
+    async def _load(self, subscription_service) -> Dict[str, Any]:
+        db = mongodb.get_database()
+        user_repo = UserRepository(db)
+        since = datetime.utcnow() - timedelta(days=self.period_days)
+
+        counters = await stats_counters.read(since)
+        if counters:
+            # Счетчики не знают об активности - она считается по индексу last_activity
+            stats = {
+                "total_users": counters["total_users"],
+                "active_users": await user_repo.count_active_since(since),
+                "new_users": counters["new_users"],
+                "total_purchases": counters["total_purchases"],
+                "total_revenue": counters["total_revenue"],
+                "week_purchases": counters["period_purchases"],
+                "week_revenue": counters["period_revenue"]
+            }
+        else:
+            users = await user_repo.get_stats(since)
+            payments = await PaymentRepository(db).get_stats(since)
+            stats = {
+                "total_users": users["total"],
+                "active_users": users["active"],
+                "new_users": users["new"],
+                "total_purchases": payments["total_count"],
+                "total_revenue": payments["total_amount"],
+                "week_purchases": payments["period_count"],
+                "week_revenue": payments["period_amount"]
+            }
+
+        stats["subscriptions"] = None
+        if subscription_service:
+            try:
+                stats["subscriptions"] = await subscription_service.get_subscription_stats()
+            except Exception as e:
+                logger.warning(f"Could not get subscription stats: {e}")
+
+        return stats
+
+    def invalidate(self) -> None:
+        """Сбросить кэш (следующий запрос посчитает заново)"""
+        self._stats = None
+
+
+# Глобальный экземпляр (общий для всех админов)
+stats_service = StatsService(ttl=config.STATS_CACHE_TTL)
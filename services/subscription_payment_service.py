@@ -8,6 +8,7 @@ from datetime import datetime
 from yookassa import Configuration, Payment
 
 from config import config
+from payments import run_in_payment_pool
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +28,35 @@ class SubscriptionPaymentService:
         
         logger.info(f"SubscriptionPaymentService initialized: {self.price} {self.currency} for {self.days} days")
     
-    def create_payment(self, user_id: int, return_url: str = None, customer_email: str = None) -> Dict[str, Any]:
+    async def create_payment(self, user_id: int, return_url: str = None, customer_email: str = None) -> Dict[str, Any]:
         """
-        Создание платежа для подписки на канал
+        Создание платежа для подписки на канал (запрос к YooKassa идет в пуле потоков)
+        
+        Args:
+            user_id: Telegram ID пользователя
+            return_url: URL для возврата после оплаты
+            customer_email: Email покупателя для чека
+            
+        Returns:
+            Dict с информацией о платеже
+        """
+        return await run_in_payment_pool(self._create_payment_sync, user_id, return_url, customer_email)
+    
+    async def check_payment(self, payment_id: str) -> Dict[str, Any]:
+        """
+        Проверка статуса платежа (запрос к YooKassa идет в пуле потоков)
+        
+        Args:
+            payment_id: ID платежа в YooKassa
+            
+        Returns:
+            Dict с информацией о статусе платежа
+        """
+        return await run_in_payment_pool(self._check_payment_sync, payment_id)
+    
+    def _create_payment_sync(self, user_id: int, return_url: str = None, customer_email: str = None) -> Dict[str, Any]:
+        """
+        Создание платежа для подписки на канал (блокирующий вызов SDK)
         
         Args:
             user_id: Telegram ID пользователя
@@ -101,9 +128,9 @@ class SubscriptionPaymentService:
             logger.error(f"Error creating payment: {e}")
             raise
     
-    def check_payment(self, payment_id: str) -> Dict[str, Any]:
+    def _check_payment_sync(self, payment_id: str) -> Dict[str, Any]:
         """
-        Проверка статуса платежа
+        Проверка статуса платежа (блокирующий вызов SDK)
         
         Args:
             payment_id: ID платежа в YooKassa
@@ -2,16 +2,21 @@
 Сервис для управления подписками на канал
 """
 import logging
-from typing import Optional, Dict, Any
+from typing import AsyncIterator, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 from aiogram import Bot
 
 from config import config
 from database.mongodb import mongodb
 from database.mongo_models import Subscription, SubscriptionPayment
+from services.channel_membership import ChannelMembership, MEMBER
+from services.invite_link_pool import InviteLinkPool
 
 logger = logging.getLogger(__name__)
 
+# Через сколько платеж, занятый для активации (processing), можно занять снова
+PAYMENT_PROCESSING_TIMEOUT = timedelta(minutes=5)
+
 
 class SubscriptionService:
     """Сервис для управления подписками на канал"""
@@ -26,6 +31,24 @@ class SubscriptionService:
         self.bot = bot
         self.channel_id = config.SUBSCRIPTION_CHANNEL_ID
         self.subscription_days = config.SUBSCRIPTION_DAYS
+        # Планировщик событий подписок (SubscriptionEventScheduler), подключается в scheduler
+        self.event_scheduler = None
+        # Исключение из канала (пачками для истекших подписок)
+        self.membership = ChannelMembership(
+            bot,
+            self.channel_id,
+            rate=config.CHANNEL_KICK_RPS,
+            batch_size=config.CHANNEL_KICK_BATCH_SIZE
+        )
+        # Заранее созданные пригласительные ссылки (пополняются после start())
+        self.invite_links = InviteLinkPool(
+            bot,
+            self.channel_id,
+            link_days=self.subscription_days,
+            size=config.INVITE_LINK_POOL_SIZE,
+            low_water=config.INVITE_LINK_POOL_LOW_WATER,
+            shelf_life=config.INVITE_LINK_SHELF_LIFE
+        )
         
         if not self.channel_id:
             logger.warning("SUBSCRIPTION_CHANNEL_ID not configured!")
@@ -54,34 +77,20 @@ class SubscriptionService:
             logger.error(f"Error getting active subscription for user {user_id}: {e}")
             return None
     
-    async def create_invite_link(self, user_id: int) -> str:
+    async def create_invite_link(self, user_id: int, valid_until: datetime) -> str:
         """
-        Создать уникальную пригласительную ссылку для пользователя
+        Выдать уникальную пригласительную ссылку для пользователя
         
         Args:
             user_id: Telegram ID пользователя
+            valid_until: Дата окончания подписки
             
         Returns:
             Пригласительная ссылка
         """
         try:
-            if not self.channel_id:
-                raise ValueError("SUBSCRIPTION_CHANNEL_ID not configured")
-            
-            # Дата истечения ссылки
-            expire_date = datetime.utcnow() + timedelta(days=self.subscription_days)
-            
-            # Создаем уникальную ссылку
-            invite_link = await self.bot.create_chat_invite_link(
-                chat_id=self.channel_id,
-                name=f"Подписка для пользователя {user_id}",
-                expire_date=expire_date,
-                member_limit=5  # Несколько попыток входа
-            )
-            
-            logger.info(f"Created invite link for user {user_id}")
-            return invite_link.invite_link
-            
+            # Обычно из заранее созданного запаса, без запроса к Bot API
+            return await self.invite_links.take(user_id, valid_until)
         except Exception as e:
             logger.error(f"Error creating invite link for user {user_id}: {e}")
             raise
@@ -106,13 +115,13 @@ class SubscriptionService:
             Словарь с данными созданной подписки
         """
         try:
-            # Создаем пригласительную ссылку
-            invite_link = await self.create_invite_link(user_id)
-            
             # Даты подписки
             start_date = datetime.utcnow()
             end_date = start_date + timedelta(days=self.subscription_days)
             
+            # Выдаем пригласительную ссылку
+            invite_link = await self.create_invite_link(user_id, end_date)
+            
             # Создаем подписку
             subscription = Subscription(
                 user_id=user_id,
@@ -133,6 +142,9 @@ class SubscriptionService:
             subscription_data['_id'] = result.inserted_id
             
             logger.info(f"Created subscription for user {user_id} until {end_date}, auto_renew={subscription.auto_renew}")
+            # Пользователь снова в канале (или вот-вот вступит) - при окончании его нужно исключить
+            await self.membership.mark([user_id], MEMBER)
+            self._schedule_events(subscription_data)
             return subscription_data
             
         except Exception as e:
@@ -170,29 +182,7 @@ class SubscriptionService:
         Returns:
             True если успешно удален
         """
-        try:
-            if not self.channel_id:
-                logger.warning("SUBSCRIPTION_CHANNEL_ID not configured")
-                return False
-            
-            # Блокируем пользователя
-            await self.bot.ban_chat_member(
-                chat_id=self.channel_id,
-                user_id=user_id
-            )
-            
-            # Сразу разблокируем (чтобы мог вернуться при продлении)
-            await self.bot.unban_chat_member(
-                chat_id=self.channel_id,
-                user_id=user_id
-            )
-            
-            logger.info(f"Kicked user {user_id} from channel")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error kicking user {user_id} from channel: {e}")
-            return False
+        return await self.membership.remove(user_id)
     
     async def save_payment(
         self,
@@ -272,6 +262,112 @@ class SubscriptionService:
             logger.error(f"Error updating payment {payment_id}: {e}")
             return False
     
+    async def claim_payment(self, payment_id: str) -> bool:
+        """
+        Атомарно занять оплаченный платеж для активации подписки
+        
+        Кнопка «Проверить оплату» и вебхук ЮKassa могут прийти одновременно -
+        True возвращается только тому, кто первым перевел платеж в processing.
+        Платеж, застрявший в processing дольше PAYMENT_PROCESSING_TIMEOUT
+        (процесс упал во время активации), можно занять снова.
+        
+        Args:
+            payment_id: ID платежа YooKassa
+            
+        Returns:
+            True если платеж занят этим вызовом
+        """
+        now = datetime.utcnow()
+        db = mongodb.get_database()
+        result = await db.subscription_payments.update_one(
+            {
+                "payment_id": payment_id,
+                "$or": [
+                    {"status": {"$nin": ["succeeded", "processing"]}},
+                    {"status": "processing", "processing_at": {"$lt": now - PAYMENT_PROCESSING_TIMEOUT}}
+                ]
+            },
+            {"$set": {"status": "processing", "processing_at": now}}
+        )
+        return result.modified_count > 0
+    
+    async def complete_payment(self, payment_id: str, subscription_id, paid_at: Optional[datetime] = None) -> None:
+        """Пометить занятый платеж успешным и связать его с подпиской"""
+        db = mongodb.get_database()
+        await db.subscription_payments.update_one(
+            {"payment_id": payment_id},
+            {
+                "$set": {
+                    "status": "succeeded",
+                    "paid_at": paid_at or datetime.utcnow(),
+                    "subscription_id": subscription_id
+                },
+                "$unset": {"processing_at": ""}
+            }
+        )
+    
+    async def release_payment(self, payment_id: str) -> None:
+        """Вернуть занятый платеж в pending, чтобы активацию можно было повторить"""
+        try:
+            db = mongodb.get_database()
+            await db.subscription_payments.update_one(
+                {"payment_id": payment_id, "status": "processing"},
+                {"$set": {"status": "pending"}, "$unset": {"processing_at": ""}}
+            )
+        except Exception as e:
+            logger.error(f"Error releasing payment {payment_id}: {e}")
+    
+    async def activate_paid_subscription(
+        self,
+        user_id: int,
+        payment_id: str,
+        payment_method_id: Optional[str] = None
+    ) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Активировать подписку по успешному платежу (идемпотентно)
+        
+        Платеж помечается succeeded только после того, как подписка создана.
+        Если создать подписку не удалось, платеж возвращается в pending и
+        активацию можно повторить (кнопкой «Проверить оплату»); подписка,
+        уже созданная по этому платежу, при повторе не дублируется.
+        
+        Args:
+            user_id: Telegram ID пользователя
+            payment_id: ID платежа YooKassa
+            payment_method_id: ID метода оплаты для автопродления
+            
+        Returns:
+            (подписка, создана_сейчас): новая подписка, если платеж обработан
+            этим вызовом, иначе уже существующая активная подписка пользователя
+            
+        Raises:
+            Exception: Подписку создать не удалось (платеж снова в pending)
+        """
+        if not await self.claim_payment(payment_id):
+            logger.info(f"Payment {payment_id} already processed, returning active subscription")
+            return await self.get_active_subscription(user_id), False
+        
+        try:
+            db = mongodb.get_database()
+            # Подписка могла остаться от прерванной активации этого же платежа
+            subscription = await db.subscriptions.find_one({"payment_id": payment_id})
+            if subscription is None:
+                # Создаем подписку с автопродлением (только если есть payment_method_id)
+                subscription = await self.create_subscription(
+                    user_id=user_id,
+                    payment_id=payment_id,
+                    payment_method_id=payment_method_id,
+                    auto_renew=bool(payment_method_id)
+                )
+            
+            await self.complete_payment(payment_id, subscription['_id'])
+        except Exception:
+            logger.error(f"Failed to activate subscription for payment {payment_id}, payment released for retry")
+            await self.release_payment(payment_id)
+            raise
+        
+        return subscription, True
+    
     async def get_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
         """
         Получить платеж по ID
@@ -312,154 +408,94 @@ class SubscriptionService:
             logger.error(f"Error linking payment {payment_id} to subscription: {e}")
             return False
     
-    async def get_expiring_subscriptions(self, days_before: int) -> list:
+    def _schedule_events(self, subscription: Dict[str, Any]) -> None:
+        """Запланировать напоминания, продление и окончание подписки"""
+        if self.event_scheduler:
+            self.event_scheduler.schedule(subscription)
+    
+    async def iter_active_subscriptions(self) -> AsyncIterator[Dict[str, Any]]:
         """
-        Получить подписки, которые истекают через N дней
+        Активные подписки (поля, нужные планировщику), по дате окончания
         
-        Args:
-            days_before: Количество дней до истечения
-            
-        Returns:
-            Список подписок
-        """
-        try:
-            db = mongodb.get_database()
-            
-            # Границы временного окна
-            now = datetime.utcnow()
-            start_time = now + timedelta(days=days_before)
-            end_time = start_time + timedelta(hours=1)  # Окно в 1 час
-            
-            # Определяем поле для проверки
-            notification_field = f"notified_{days_before}_days" if days_before == 3 else f"notified_{days_before}_day"
-            
-            subscriptions = await db.subscriptions.find({
-                "is_active": True,
-                "end_date": {
-                    "$gte": start_time,
-                    "$lt": end_time
-                },
-                notification_field: False
-            }).to_list(length=None)
-            
-            return subscriptions
-            
-        except Exception as e:
-            logger.error(f"Error getting expiring subscriptions: {e}")
-            return []
+        Запрос идет по частичному индексу active_end_date.
+        """
+        db = mongodb.get_database()
+        cursor = db.subscriptions.find(
+            {"is_active": True},
+            {
+                "user_id": 1,
+                "end_date": 1,
+                "auto_renew": 1,
+                "payment_method_id": 1,
+                "renewal_attempted": 1,
+                "notified_3_days": 1,
+                "notified_1_day": 1
+            }
+        ).sort("end_date", 1)
+        async for subscription in cursor:
+            yield subscription
     
-    async def mark_notification_sent(self, subscription_id, days_before: int) -> bool:
+    async def _claim(self, subscription_id, end_date: datetime, condition: Dict[str, Any], updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
-        Пометить, что уведомление отправлено
+        Атомарно отметить событие подписки обработанным
+        
+        Срабатывает, только если подписка активна, не продлена с момента
+        планирования (end_date тот же) и удовлетворяет condition.
         
-        Args:
-            subscription_id: ID подписки
-            days_before: За сколько дней было уведомление
-            
         Returns:
-            True если успешно помечено
+            Подписка до изменения или None, если событие уже неактуально
         """
         try:
             db = mongodb.get_database()
-            
-            # Определяем поле
-            notification_field = f"notified_{days_before}_days" if days_before == 3 else f"notified_{days_before}_day"
-            
-            result = await db.subscriptions.update_one(
-                {"_id": subscription_id},
-                {"$set": {notification_field: True}}
+            return await db.subscriptions.find_one_and_update(
+                {"_id": subscription_id, "is_active": True, "end_date": end_date, **condition},
+                {"$set": updates}
             )
-            
-            return result.modified_count > 0
-            
         except Exception as e:
-            logger.error(f"Error marking notification sent: {e}")
-            return False
+            logger.error(f"Error claiming subscription event {subscription_id}: {e}")
+            return None
     
-    async def get_expired_subscriptions(self) -> list:
-        """
-        Получить истекшие подписки
-        
-        Returns:
-            Список истекших подписок
-        """
-        try:
-            db = mongodb.get_database()
-            
-            now = datetime.utcnow()
-            
-            subscriptions = await db.subscriptions.find({
-                "is_active": True,
-                "end_date": {"$lt": now}
-            }).to_list(length=None)
-            
-            return subscriptions
-            
-        except Exception as e:
-            logger.error(f"Error getting expired subscriptions: {e}")
-            return []
+    async def claim_notification(self, subscription_id, end_date: datetime, days_before: int) -> Optional[Dict[str, Any]]:
+        """Забрать отправку напоминания за days_before дней (один раз на период)"""
+        notification_field = f"notified_{days_before}_days" if days_before == 3 else f"notified_{days_before}_day"
+        return await self._claim(subscription_id, end_date, {notification_field: False}, {notification_field: True})
     
-    async def get_subscriptions_to_renew(self) -> list:
+    async def get_renewal_candidate(self, subscription_id, end_date: datetime) -> Optional[Dict[str, Any]]:
         """
-        Получить подписки, которые нужно продлить автоматически
-        (истекают завтра и еще не было попытки продления)
+        Подписка, которую нужно автопродлить за период, заканчивающийся end_date
         
         Returns:
-            Список подписок для автопродления
+            Подписка или None, если она продлена, отменена, без автопродления
+            или попытка продления за этот период уже завершена
         """
         try:
             db = mongodb.get_database()
-            
-            # Границы временного окна (завтра)
-            now = datetime.utcnow()
-            tomorrow_start = now + timedelta(days=1)
-            tomorrow_end = tomorrow_start + timedelta(hours=2)  # Окно в 2 часа
-            
-            subscriptions = await db.subscriptions.find({
+            return await db.subscriptions.find_one({
+                "_id": subscription_id,
                 "is_active": True,
+                "end_date": end_date,
                 "auto_renew": True,
                 "renewal_attempted": False,
-                "payment_method_id": {"$exists": True, "$ne": None},
-                "end_date": {
-                    "$gte": tomorrow_start,
-                    "$lt": tomorrow_end
-                }
-            }).to_list(length=None)
-            
-            return subscriptions
-            
+                "payment_method_id": {"$exists": True, "$ne": None}
+            })
         except Exception as e:
-            logger.error(f"Error getting subscriptions to renew: {e}")
-            return []
+            logger.error(f"Error getting subscription {subscription_id} for renewal: {e}")
+            return None
     
-    async def mark_renewal_attempted(self, subscription_id) -> bool:
-        """
-        Пометить, что была попытка продления
-        
-        Args:
-            subscription_id: ID подписки
-            
-        Returns:
-            True если успешно помечено
-        """
-        try:
-            db = mongodb.get_database()
-            result = await db.subscriptions.update_one(
-                {"_id": subscription_id},
-                {"$set": {"renewal_attempted": True}}
-            )
-            return result.modified_count > 0
-        except Exception as e:
-            logger.error(f"Error marking renewal attempted: {e}")
-            return False
+    async def close_renewal(self, subscription_id, end_date: datetime) -> Optional[Dict[str, Any]]:
+        """Завершить автопродление за период без списания (больше не пытаться)"""
+        return await self._claim(subscription_id, end_date, {"renewal_attempted": False}, {"renewal_attempted": True})
     
-    async def extend_subscription(self, subscription_id, new_payment_id: str) -> bool:
+    async def extend_subscription(self, subscription_id, new_payment_id: str, end_date: Optional[datetime] = None) -> bool:
         """
         Продлить существующую подписку на следующий период
         
         Args:
             subscription_id: ID подписки
             new_payment_id: ID нового платежа
+            end_date: Продлеваемый период (дата окончания). Если указан,
+                подписка продлевается, только пока она активна и не продлена
+                за этот период - повторный вызов ничего не меняет
             
         Returns:
             True если успешно продлено
@@ -467,8 +503,12 @@ class SubscriptionService:
         try:
             db = mongodb.get_database()
             
+            query = {"_id": subscription_id}
+            if end_date is not None:
+                query.update(is_active=True, end_date=end_date)
+            
             # Получаем текущую подписку
-            subscription = await db.subscriptions.find_one({"_id": subscription_id})
+            subscription = await db.subscriptions.find_one(query)
             if not subscription:
                 return False
             
@@ -476,9 +516,9 @@ class SubscriptionService:
             current_end = subscription['end_date']
             new_end = current_end + timedelta(days=self.subscription_days)
             
-            # Обновляем подписку
+            # Обновляем подписку (если ее не изменили с момента чтения)
             result = await db.subscriptions.update_one(
-                {"_id": subscription_id},
+                {**query, "end_date": current_end},
                 {
                     "$set": {
                         "end_date": new_end,
@@ -490,8 +530,12 @@ class SubscriptionService:
                 }
             )
             
-            logger.info(f"Extended subscription {subscription_id} until {new_end}")
-            return result.modified_count > 0
+            if result.modified_count > 0:
+                logger.info(f"Extended subscription {subscription_id} until {new_end}")
+                subscription.update(end_date=new_end, renewal_attempted=False, notified_3_days=False, notified_1_day=False)
+                self._schedule_events(subscription)
+                return True
+            return False
             
         except Exception as e:
             logger.error(f"Error extending subscription: {e}")
@@ -507,30 +551,36 @@ class SubscriptionService:
         try:
             db = mongodb.get_database()
             
-            # Общее количество подписок
-            total_subscriptions = await db.subscriptions.count_documents({})
-            
-            # Активные подписки
-            active_subscriptions = await db.subscriptions.count_documents({
-                "is_active": True,
-                "end_date": {"$gt": datetime.utcnow()}
-            })
-            
-            # Всего платежей
-            total_payments = await db.subscription_payments.count_documents({})
-            
-            # Успешные платежи
-            succeeded_payments = await db.subscription_payments.count_documents({
-                "status": "succeeded"
-            })
-            
-            # Общая сумма
-            pipeline = [
-                {"$match": {"status": "succeeded"}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            result = await db.subscription_payments.aggregate(pipeline).to_list(length=1)
-            total_amount = result[0]["total"] if result else 0
+            # Одна агрегация на коллекцию вместо отдельных count_documents
+            subscriptions = await db.subscriptions.aggregate([
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "active": [
+                        {"$match": {"is_active": True, "end_date": {"$gt": datetime.utcnow()}}},
+                        {"$count": "count"}
+                    ]
+                }}
+            ]).to_list(length=1)
+            
+            payments = await db.subscription_payments.aggregate([
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "succeeded": [
+                        {"$match": {"status": "succeeded"}},
+                        {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+                    ]
+                }}
+            ]).to_list(length=1)
+            
+            subscriptions = subscriptions[0] if subscriptions else {}
+            payments = payments[0] if payments else {}
+            succeeded = payments["succeeded"][0] if payments.get("succeeded") else {}
+            
+            total_subscriptions = subscriptions["total"][0]["count"] if subscriptions.get("total") else 0
+            active_subscriptions = subscriptions["active"][0]["count"] if subscriptions.get("active") else 0
+            total_payments = payments["total"][0]["count"] if payments.get("total") else 0
+            succeeded_payments = succeeded.get("count", 0)
+            total_amount = succeeded.get("amount", 0)
             
             return {
                 "total_subscriptions": total_subscriptions,
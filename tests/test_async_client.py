@@ -0,0 +1,179 @@
+"""
+Тесты асинхронного клиента ЮKassa на локальном поддельном API
+
+SDK направляется на aiohttp-сервер из того же event loop (Configuration.api_url),
+поэтому проверяется весь путь запроса: пул потоков, HTTP-запрос SDK и разбор ответа.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from yookassa import Configuration
+
+from config import config
+from payments import AsyncYooKassaPayment, PaymentTemporaryError, shutdown_payment_pool
+
+POOL_SIZE = 2
+
+
+def payment_json(payment_id: str, status: str = "pending") -> dict:
+    return {
+        "id": payment_id,
+        "status": status,
+        "paid": status == "succeeded",
+        "amount": {"value": "990.00", "currency": "RUB"},
+        "confirmation": {"type": "redirect", "confirmation_url": f"https://yoomoney.ru/checkout/{payment_id}"},
+        "created_at": "2024-01-01T00:00:00.000Z",
+        "metadata": {},
+        "test": True
+    }
+
+
+def error_response(status: int) -> web.Response:
+    return web.json_response(
+        {"type": "error", "id": "fake", "code": f"http_{status}", "description": "fake error"},
+        status=status
+    )
+
+
+class FakeYooKassa:
+    """
+    Поддельное API ЮKassa
+
+    Считает одновременные запросы. Ошибку возвращает по id платежа или
+    описанию вида "error-<код>".
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.idempotence_keys = []
+        self.app = web.Application()
+        self.app.router.add_post("/v3/payments", self.create_payment)
+        self.app.router.add_get("/v3/payments/{payment_id}", self.get_payment)
+        self.app.router.add_post("/v3/payments/{payment_id}/cancel", self.cancel_payment)
+
+    async def _respond(self, key: str, payment_id: str) -> web.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        if key.startswith("error-"):
+            return error_response(int(key.split("-", 1)[1]))
+        return web.json_response(payment_json(payment_id))
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        self.idempotence_keys.append(request.headers.get("Idempotence-Key"))
+        body = await request.json()
+        return await self._respond(body["description"], f"created-{len(self.idempotence_keys)}")
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        payment_id = request.match_info["payment_id"]
+        return await self._respond(payment_id, payment_id)
+
+    async def cancel_payment(self, request: web.Request) -> web.Response:
+        payment_id = request.match_info["payment_id"]
+        return await self._respond(payment_id, payment_id)
+
+
+class AsyncYooKassaPaymentTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        for name, value in (
+            ("YOOKASSA_SHOP_ID", "test-shop"),
+            ("YOOKASSA_SECRET_KEY", "test-secret"),
+            ("YOOKASSA_MAX_WORKERS", POOL_SIZE),
+        ):
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Пул создается при первом запросе с текущим YOOKASSA_MAX_WORKERS
+        shutdown_payment_pool()
+        self.addCleanup(shutdown_payment_pool)
+
+        self.server = FakeYooKassa()
+        self.runner = web.AppRunner(self.server.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+
+        api_url = Configuration.api_url
+        self.addCleanup(setattr, Configuration, "api_url", api_url)
+        Configuration.api_url = f"http://127.0.0.1:{port}/v3"
+
+        self.client = AsyncYooKassaPayment()
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_create_and_get_payment(self):
+        created = await self.client.create_payment(990, "Курс", metadata={"user_id": "1"})
+        self.assertEqual(created["id"], "created-1")
+        self.assertEqual(created["confirmation_url"], "https://yoomoney.ru/checkout/created-1")
+        self.assertEqual(created["amount"], 990.0)
+        self.assertTrue(self.server.idempotence_keys[0])
+
+        status = await self.client.get_payment_status("payment-1")
+        self.assertEqual(status["id"], "payment-1")
+        self.assertEqual(status["status"], "pending")
+        self.assertFalse(status["paid"])
+
+        self.assertTrue(await self.client.cancel_payment("payment-1"))
+
+    async def test_requests_are_bounded_by_pool_size(self):
+        self.server.delay = 0.2
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        try:
+            results = await asyncio.gather(*(
+                self.client.get_payment_status(f"payment-{i}") for i in range(POOL_SIZE * 3)
+            ))
+        finally:
+            ticker_task.cancel()
+
+        self.assertEqual([result["id"] for result in results], [f"payment-{i}" for i in range(POOL_SIZE * 3)])
+        # Не больше запросов, чем потоков в пуле, но и не по одному
+        self.assertEqual(self.server.max_in_flight, POOL_SIZE)
+        # Пока потоки ждут ответа, event loop продолжает работать
+        self.assertGreater(ticks, 10)
+
+    async def test_errors_are_reported_through_the_pool(self):
+        self.assertIsNone(await self.client.get_payment_status("error-500"))
+        self.assertIsNone(await self.client.create_payment(990, "error-400"))
+        self.assertFalse(await self.client.cancel_payment("error-404"))
+
+    async def test_recurrent_payment_errors(self):
+        # Ошибку запроса повторять бессмысленно
+        self.assertIsNone(await self.client.create_recurrent_payment(990, "error-400", "method-1"))
+
+        # Ошибка ЮKassa: повтор с тем же ключом идемпотентности
+        for status in (500, 429):
+            with self.assertRaises(PaymentTemporaryError):
+                await self.client.create_recurrent_payment(
+                    990, f"error-{status}", "method-1", idempotence_key=f"renewal-{status}"
+                )
+        self.assertEqual(self.server.idempotence_keys[-2:], ["renewal-500", "renewal-429"])
+
+    async def test_network_error_is_temporary(self):
+        await self.runner.cleanup()
+
+        with self.assertRaises(PaymentTemporaryError):
+            await self.client.create_recurrent_payment(990, "Подписка", "method-1")
+        self.assertIsNone(await self.client.get_payment_status("payment-1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
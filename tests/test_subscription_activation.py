@@ -0,0 +1,109 @@
+"""
+Тесты активации подписки по оплаченному платежу
+
+MongoDB подменяется на mongomock-motor, Bot API - на AsyncMock. Проверяется,
+что сбой при создании подписки не оставляет платеж succeeded без подписки
+и что повторная активация (кнопка «Проверить оплату») выдает доступ.
+"""
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from aiogram.exceptions import TelegramNetworkError
+from mongomock_motor import AsyncMongoMockClient
+
+from config import config
+from database.mongodb import MongoDB
+from services.subscription_service import SubscriptionService, PAYMENT_PROCESSING_TIMEOUT
+
+USER_ID = 1001
+PAYMENT_ID = "payment-1"
+INVITE_LINK = "https://t.me/+invite"
+
+
+class ActivatePaidSubscriptionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncMongoMockClient()["astro_bot_test"]
+        for target, name, value in (
+            (MongoDB, "db", self.db),
+            (config, "SUBSCRIPTION_CHANNEL_ID", "-100123"),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.bot = mock.AsyncMock()
+        # Запас ссылок пуст: ссылка создается запросом к Bot API, первый падает
+        self.bot.create_chat_invite_link.side_effect = [
+            TelegramNetworkError(method=mock.Mock(), message="Bad Gateway"),
+            SimpleNamespace(invite_link=INVITE_LINK),
+        ]
+        self.service = SubscriptionService(self.bot)
+
+        await self.service.save_payment(USER_ID, PAYMENT_ID, 990.0)
+
+    async def payment_status(self) -> str:
+        payment = await self.service.get_payment(PAYMENT_ID)
+        return payment["status"]
+
+    async def test_failed_invite_link_is_retried(self):
+        with self.assertRaises(TelegramNetworkError):
+            await self.service.activate_paid_subscription(USER_ID, PAYMENT_ID)
+
+        # Платеж снова можно активировать, подписки нет
+        self.assertEqual(await self.payment_status(), "pending")
+        self.assertEqual(await self.db.subscriptions.count_documents({}), 0)
+
+        subscription, created = await self.service.activate_paid_subscription(USER_ID, PAYMENT_ID)
+        self.assertTrue(created)
+        self.assertEqual(subscription["invite_link"], INVITE_LINK)
+
+        payment = await self.service.get_payment(PAYMENT_ID)
+        self.assertEqual(payment["status"], "succeeded")
+        self.assertEqual(payment["subscription_id"], subscription["_id"])
+
+        # Повтор после успеха возвращает ту же подписку
+        active, created = await self.service.activate_paid_subscription(USER_ID, PAYMENT_ID)
+        self.assertFalse(created)
+        self.assertEqual(active["_id"], subscription["_id"])
+        self.assertEqual(self.bot.create_chat_invite_link.await_count, 2)
+
+    async def test_retry_reuses_subscription_created_for_payment(self):
+        self.bot.create_chat_invite_link.side_effect = None
+        self.bot.create_chat_invite_link.return_value = SimpleNamespace(invite_link=INVITE_LINK)
+
+        # Подписка создана, но пометить платеж не удалось
+        complete_payment = self.service.complete_payment
+        with mock.patch.object(self.service, "complete_payment", side_effect=RuntimeError("write failed")):
+            with self.assertRaises(RuntimeError):
+                await self.service.activate_paid_subscription(USER_ID, PAYMENT_ID)
+        self.assertEqual(await self.payment_status(), "pending")
+
+        with mock.patch.object(self.service, "complete_payment", wraps=complete_payment):
+            subscription, created = await self.service.activate_paid_subscription(USER_ID, PAYMENT_ID)
+
+        self.assertTrue(created)
+        self.assertEqual(await self.db.subscriptions.count_documents({"payment_id": PAYMENT_ID}), 1)
+        self.assertEqual(await self.payment_status(), "succeeded")
+        self.assertEqual(self.bot.create_chat_invite_link.await_count, 1)
+
+    async def test_stale_processing_claim_is_taken_over(self):
+        processing_at = datetime.utcnow() - timedelta(seconds=10)
+        await self.db.subscription_payments.update_one(
+            {"payment_id": PAYMENT_ID},
+            {"$set": {"status": "processing", "processing_at": processing_at}}
+        )
+        # Активацию ведет другой вызов
+        self.assertFalse(await self.service.claim_payment(PAYMENT_ID))
+
+        await self.db.subscription_payments.update_one(
+            {"payment_id": PAYMENT_ID},
+            {"$set": {"processing_at": processing_at - PAYMENT_PROCESSING_TIMEOUT}}
+        )
+        # Процесс упал во время активации
+        self.assertTrue(await self.service.claim_payment(PAYMENT_ID))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,11 @@
-"""Helper функции для работы с настройками бота"""
+"""Helper функции для работы с настройками бота (чтение - из кэша в памяти)"""
 from typing import Optional
-from database import get_db, BotSettingsRepository
+from database import settings_cache
 
 
 async def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     """
-    Получить значение настройки из базы данных
+    Получить значение настройки (без запроса к базе, см. database.settings_cache)
     
     Args:
         key: ключ настройки
@@ -14,12 +14,7 @@ async def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     Returns:
         Значение настройки или default
     """
-    db = await get_db()
-    settings_repo = BotSettingsRepository(db)
-    setting = await settings_repo.get(key)
-    if setting:
-        return setting.setting_value
-    return default
+    return await settings_cache.get(key, default)
 
 
 async def set_setting(key: str, value: Optional[str]) -> bool:
@@ -34,9 +29,7 @@ async def set_setting(key: str, value: Optional[str]) -> bool:
         True если успешно, False если ошибка
     """
     try:
-        db = await get_db()
-        settings_repo = BotSettingsRepository(db)
-        await settings_repo.set(key, value)
+        await settings_cache.set(key, value)
         return True
     except Exception as e:
         print(f"Error setting {key}: {e}")
@@ -54,9 +47,7 @@ async def delete_setting(key: str) -> bool:
         True если успешно, False если ошибка
     """
     try:
-        db = await get_db()
-        settings_repo = BotSettingsRepository(db)
-        await settings_repo.delete(key)
+        await settings_cache.delete(key)
         return True
     except Exception as e:
         print(f"Error deleting {key}: {e}")
@@ -0,0 +1,60 @@
+"""Асинхронный ограничитель частоты запросов (token bucket)"""
+import asyncio
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token bucket для asyncio: не более rate запросов в секунду,
+    допускается всплеск до burst запросов подряд
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        Args:
+            rate: Разрешенное число запросов в секунду
+            burst: Размер всплеска (по умолчанию - одна секунда запросов)
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Дождаться разрешения на один запрос"""
+        # Ожидающие проходят под блокировкой по очереди - в порядке прихода
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Не выдавать разрешений ближайшие seconds секунд
+
+        Для ответа сервера "слишком много запросов" (retry_after):
+        останавливаются все ожидающие, а не только получивший ошибку.
+        """
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            # После паузы начинаем с пустого ведра, без всплеска
+            self._tokens = 0.0
+            self._updated = until
@@ -0,0 +1,14 @@
+"""Встроенный веб-сервер для вебхуков"""
+from .server import create_web_app, start_web_server, stop_web_server, wait_for_stop_signal
+from .yookassa import setup_yookassa_webhook
+from .telegram import setup_telegram_webhook, set_telegram_webhook
+
+__all__ = [
+    'create_web_app',
+    'start_web_server',
+    'stop_web_server',
+    'wait_for_stop_signal',
+    'setup_yookassa_webhook',
+    'setup_telegram_webhook',
+    'set_telegram_webhook'
+]
@@ -0,0 +1,83 @@
+"""
+Встроенный aiohttp веб-сервер
+
+Работает в том же event loop, что и боты. На него монтируются обработчики
+вебхуков (уведомления ЮKassa, апдейты Telegram в режиме webhook).
+"""
+import asyncio
+import logging
+import signal
+from aiohttp import web
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+async def healthcheck(request: web.Request) -> web.Response:
+    """Проверка доступности сервера"""
+    return web.Response(text="ok")
+
+
+def create_web_app() -> web.Application:
+    """Создание пустого приложения с healthcheck"""
+    app = web.Application()
+    app.router.add_get("/health", healthcheck)
+    return app
+
+
+def get_client_ip(request: web.Request) -> str:
+    """
+    IP клиента с учетом обратного прокси
+
+    Если WEB_TRUST_PROXY включен, адрес берется из X-Forwarded-For справа:
+    каждый из WEB_TRUSTED_PROXY_HOPS доверенных прокси дописывает в конец
+    адрес того, кто к нему подключился. Левые записи присылает сам клиент,
+    им верить нельзя. Если записей меньше, чем прокси, заголовок подделан
+    или прокси настроен иначе - используется адрес соединения.
+    """
+    if config.WEB_TRUST_PROXY and config.WEB_TRUSTED_PROXY_HOPS > 0:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            if len(hops) >= config.WEB_TRUSTED_PROXY_HOPS:
+                return hops[-config.WEB_TRUSTED_PROXY_HOPS]
+    return request.remote or ""
+
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    """
+    Запуск веб-сервера
+
+    Args:
+        app: Приложение aiohttp с зарегистрированными маршрутами
+
+    Returns:
+        AppRunner для последующей остановки
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEB_SERVER_HOST, port=config.WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"🌐 Web server started on {config.WEB_SERVER_HOST}:{config.WEB_SERVER_PORT}")
+    return runner
+
+
+async def stop_web_server(runner: web.AppRunner) -> None:
+    """Остановка веб-сервера"""
+    await runner.cleanup()
+    logger.info("Web server stopped")
+
+
+async def wait_for_stop_signal():
+    """Ожидание SIGTERM/SIGINT (для режима вебхуков)"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+    await stop_event.wait()
+    logger.info("Stop signal received, shutting down...")
@@ -0,0 +1,70 @@
+"""
+Прием апдейтов Telegram через вебхук
+
+Все боты процесса монтируются на одно aiohttp приложение под путями
+{TELEGRAM_WEBHOOK_PATH}/{name}. Каждый запрос проверяется по заголовку
+X-Telegram-Bot-Api-Secret-Token.
+"""
+import hashlib
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def telegram_webhook_path(name: str) -> str:
+    """Путь вебхука для бота"""
+    return f"{config.TELEGRAM_WEBHOOK_PATH.rstrip('/')}/{name}"
+
+
+def telegram_webhook_secret(bot: Bot) -> str:
+    """
+    Секрет вебхука
+
+    Если TELEGRAM_WEBHOOK_SECRET не задан, секрет выводится из токена бота:
+    он одинаков у всех реплик и не угадывается без знания токена.
+    """
+    if config.TELEGRAM_WEBHOOK_SECRET:
+        return config.TELEGRAM_WEBHOOK_SECRET
+    return hashlib.sha256(bot.token.encode()).hexdigest()
+
+
+def setup_telegram_webhook(app: web.Application, name: str, bot: Bot, dp: Dispatcher) -> None:
+    """
+    Смонтировать диспетчер бота на приложение
+
+    Вызывается до запуска веб-сервера. Startup/shutdown события диспетчера
+    привязываются к жизненному циклу приложения.
+
+    Args:
+        app: Общее aiohttp приложение
+        name: Имя бота (часть пути вебхука)
+        bot: Бот
+        dp: Диспетчер бота
+    """
+    path = telegram_webhook_path(name)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=telegram_webhook_secret(bot)
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    logger.info(f"Telegram webhook for '{name}' bot mounted at {path}")
+
+
+async def set_telegram_webhook(name: str, bot: Bot, dp: Dispatcher) -> None:
+    """Сообщить Telegram адрес вебхука бота (вызывается после запуска сервера)"""
+    if not config.TELEGRAM_WEBHOOK_BASE_URL:
+        raise ValueError("TELEGRAM_WEBHOOK_BASE_URL must be set for webhook mode")
+
+    url = f"{config.TELEGRAM_WEBHOOK_BASE_URL}{telegram_webhook_path(name)}"
+    await bot.set_webhook(
+        url=url,
+        secret_token=telegram_webhook_secret(bot),
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Telegram webhook for '{name}' bot set to {url}")
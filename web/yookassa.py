@@ -0,0 +1,78 @@
+"""
+Прием HTTP-уведомлений ЮKassa
+
+Уведомление принимается только с адресов ЮKassa, а статус платежа
+дополнительно сверяется через API (см. process_payment_webhook).
+"""
+import ipaddress
+import logging
+from aiohttp import web
+from aiogram import Bot
+
+from config import config
+from handlers.webhook_handler import process_payment_webhook
+from payments import AsyncYooKassaPayment
+from .server import get_client_ip
+
+logger = logging.getLogger(__name__)
+
+# Адреса, с которых ЮKassa отправляет уведомления
+# https://yookassa.ru/developers/using-api/webhooks#ip
+YOOKASSA_NETWORKS = [
+    ipaddress.ip_network(network) for network in (
+        "185.71.76.0/27",
+        "185.71.77.0/27",
+        "77.75.153.0/25",
+        "77.75.156.11/32",
+        "77.75.156.35/32",
+        "77.75.154.128/25",
+        "2a02:5180::/32",
+    )
+]
+
+
+def is_yookassa_ip(ip: str) -> bool:
+    """Проверка, что запрос пришел из сети ЮKassa"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in YOOKASSA_NETWORKS)
+
+
+def setup_yookassa_webhook(
+    app: web.Application,
+    bot: Bot,
+    yookassa: AsyncYooKassaPayment,
+    subscription_service=None
+) -> None:
+    """
+    Регистрация обработчика уведомлений ЮKassa
+
+    Args:
+        app: Приложение aiohttp
+        bot: Бот, от имени которого уведомляются пользователи и админ
+        yookassa: Асинхронный клиент YooKassa
+        subscription_service: Сервис подписок на канал
+    """
+
+    async def handle_notification(request: web.Request) -> web.Response:
+        client_ip = get_client_ip(request)
+
+        if config.YOOKASSA_WEBHOOK_CHECK_IP and not is_yookassa_ip(client_ip):
+            logger.warning(f"Rejected YooKassa webhook from {client_ip}")
+            return web.Response(status=403)
+
+        try:
+            notification_data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+
+        await process_payment_webhook(notification_data, bot, yookassa, subscription_service)
+
+        # Отвечаем 200 в любом случае: если обработка не удалась,
+        # платеж подхватит фоновая проверка
+        return web.Response(status=200)
+
+    app.router.add_post(config.YOOKASSA_WEBHOOK_PATH, handle_notification)
+    logger.info(f"YooKassa webhook registered at {config.YOOKASSA_WEBHOOK_PATH}")